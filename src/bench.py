@@ -0,0 +1,257 @@
+import argparse, asyncio, json, os, subprocess, sys, time
+
+import numpy as np
+
+from serial_reader import serial_reader, acquisition, frames
+from simulator import fake_board
+from headless import headless
+
+# run in a fresh interpreter, so that nothing has been imported yet
+FIRST_SAMPLE_SCRIPT = """
+import json, sys, time
+started_at = time.perf_counter()
+from headless import headless
+imported_at = time.perf_counter()
+reader = headless.create_readers(json.loads(sys.argv[1]))[0]
+opened_at = time.perf_counter()
+while len(reader.read_batch()) == 0:
+    pass
+print(json.dumps({
+    "import_s": imported_at - started_at,
+    "open_s": opened_at - imported_at,
+    "first_sample_s": time.perf_counter() - opened_at,
+}))
+"""
+
+UI_IMPORT_SCRIPT = """
+import time
+started_at = time.perf_counter()
+from cli import cli
+print(time.perf_counter() - started_at)
+"""
+
+
+def bench_throughput(
+    board: fake_board.FakeBoard, reader: serial_reader.SerialReader, duration: float
+) -> dict[str, float]:
+    """read from the board as fast as possible for `duration` seconds"""
+    reader.reset_input()
+    rejected_before = reader.rejected_lines
+    num_lines = 0
+
+    started_at = time.perf_counter()
+    while (elapsed := time.perf_counter() - started_at) < duration:
+        rows = reader.read_batch(block=True)
+        num_lines += len(rows)
+
+    num_rejected = reader.rejected_lines - rejected_before
+    return {
+        "lines_per_s": num_lines / elapsed,
+        "lines_sent_per_s": board.line_rate,
+        "parse_failure_rate": num_rejected / max(1, num_lines + num_rejected),
+    }
+
+
+def _run_fresh_interpreter(script: str, *args: str) -> tuple[str, float]:
+    """run a script in a new python process, returns what it printed and how long the process took"""
+    src_dir = os.path.dirname(os.path.abspath(__file__))
+    env = {**os.environ, "PYTHONPATH": src_dir}
+    started_at = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, "-c", script, *args],
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return result.stdout, time.perf_counter() - started_at
+
+
+def bench_startup(
+    board: fake_board.FakeBoard, repeats: int
+) -> dict[str, float | list[float]]:
+    """time from launching a headless run to its first sample, and how long the UI takes to import"""
+    config = {
+        "baud_rate": 115200,
+        "num_readings_per_pt": 1,
+        "boards": [
+            {"name": "Board 0", "port": board.port, "pt_count": board.num_channels}
+        ],
+    }
+
+    runs = []
+    for _ in range(repeats):
+        output, process_time = _run_fresh_interpreter(
+            FIRST_SAMPLE_SCRIPT, json.dumps(config)
+        )
+        runs.append({**json.loads(output), "process_s": process_time})
+
+    ui_import_times = [
+        float(_run_fresh_interpreter(UI_IMPORT_SCRIPT)[0]) for _ in range(repeats)
+    ]
+
+    report: dict[str, float | list[float]] = {
+        key: float(np.median([run[key] for run in runs]))
+        for key in ("import_s", "open_s", "first_sample_s", "process_s")
+    }
+    report["ui_import_s"] = float(np.median(ui_import_times))
+    report["time_to_first_sample_s"] = [
+        run["import_s"] + run["open_s"] + run["first_sample_s"] for run in runs
+    ]
+    return report
+
+
+async def bench_calibration(
+    boards: list[fake_board.FakeBoard],
+    readers: list[serial_reader.SerialReader],
+    pressures: list[float],
+    aligned: bool = False,
+) -> dict[str, float | list[float]]:
+    """run a full headless calibration sweep against the boards"""
+    engine = acquisition.AcquisitionEngine(readers, aligned=aligned)
+
+    def set_pressure(pressure: float) -> None:
+        for board in boards:
+            board.set_pressure(pressure)
+
+    started_at = time.perf_counter()
+    step_latencies = await headless.run_calibration(
+        engine, [(pressure, 0.0) for pressure in pressures], set_pressure
+    )
+
+    slope_errors = []
+    for board, reader in zip(boards, readers):
+        fit = reader.get_linear_fit()
+        slope_errors.append(float(np.max(np.abs(fit.slopes - board.slopes))))
+
+    step_skews = [skew.get_skew() for skew in engine.step_skews]
+    return {
+        "total_wall_time_s": time.perf_counter() - started_at,
+        "step_latency_mean_s": float(np.mean(step_latencies)),
+        "step_latency_max_s": float(np.max(step_latencies)),
+        "step_latencies_s": step_latencies,
+        "step_skew_max_s": float(np.max(step_skews)),
+        "step_skews_s": step_skews,
+        "max_slope_error": max(slope_errors),
+    }
+
+
+def bench_startup_main(args: argparse.Namespace) -> None:
+    with fake_board.FakeBoard(args.channels, args.rate, args.noise) as board:
+        report = bench_startup(board, args.repeats)
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return
+
+    print(f"headless imports:     {report['import_s'] * 1000:.0f} ms")
+    print(f"opening the port:     {report['open_s'] * 1000:.1f} ms")
+    print(f"waiting for a line:   {report['first_sample_s'] * 1000:.1f} ms")
+    print(f"whole process:        {report['process_s'] * 1000:.0f} ms")
+    print(f"UI imports:           {report['ui_import_s'] * 1000:.0f} ms")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Benchmark serial acquisition and calibration against simulated boards"
+    )
+    parser.add_argument("--boards", type=int, default=2)
+    parser.add_argument("--channels", type=int, default=8)
+    parser.add_argument("--rate", type=float, default=1000, help="lines/s per board")
+    parser.add_argument("--noise", type=float, default=0.01)
+    parser.add_argument("--fault-rate", type=float, default=0.01)
+    parser.add_argument("--readings", type=int, default=100)
+    parser.add_argument("--steps", type=int, default=5)
+    parser.add_argument("--max-pressure", type=float, default=100)
+    parser.add_argument("--duration", type=float, default=2, help="throughput run, s")
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    parser.add_argument(
+        "--startup",
+        action="store_true",
+        help="only measure the import and time-to-first-sample cost of a fresh launch",
+    )
+    parser.add_argument("--repeats", type=int, default=5, help="startup runs")
+    parser.add_argument(
+        "--protocol",
+        choices=(frames.ASCII, frames.BINARY),
+        default=frames.ASCII,
+        help="what the simulated boards send, lines or binary frames",
+    )
+    parser.add_argument(
+        "--aligned",
+        action="store_true",
+        help="take every step from the same window of time on every board",
+    )
+    args = parser.parse_args()
+
+    if args.startup:
+        bench_startup_main(args)
+        return
+
+    faults = fake_board.FaultConfig(
+        partial_line=args.fault_rate / 3,
+        bad_utf8=args.fault_rate / 3,
+        wrong_columns=args.fault_rate / 3,
+    )
+    boards = [
+        fake_board.FakeBoard(
+            args.channels,
+            args.rate,
+            args.noise,
+            faults=faults,
+            seed=board_no,
+            protocol=args.protocol,
+        )
+        for board_no in range(args.boards)
+    ]
+    # the throughput run only reads the first board, so don't let the others compete with it for CPU
+    boards[0].start()
+
+    try:
+        readers = [
+            serial_reader.SerialReader(
+                serial_port=board.port,
+                baud_rate=115200,
+                num_sensors=args.channels,
+                num_readings_per_pt=args.readings,
+                name=f"Board {board_no}",
+            )
+            for board_no, board in enumerate(boards)
+        ]
+
+        throughput = bench_throughput(boards[0], readers[0], args.duration)
+        for board in boards[1:]:
+            board.start()
+
+        report = {
+            "throughput": throughput,
+            "calibration": asyncio.run(
+                bench_calibration(
+                    boards,
+                    readers,
+                    list(np.linspace(0, args.max_pressure, args.steps)),
+                    args.aligned,
+                )
+            ),
+        }
+    finally:
+        for board in boards:
+            board.stop()
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return
+
+    throughput = report["throughput"]
+    calibration = report["calibration"]
+    print(f"lines/s:              {throughput['lines_per_s']:.0f}")
+    print(f"parse failure rate:   {throughput['parse_failure_rate']:.2%}")
+    print(f"step latency (mean):  {calibration['step_latency_mean_s'] * 1000:.1f} ms")
+    print(f"step latency (max):   {calibration['step_latency_max_s'] * 1000:.1f} ms")
+    print(f"step skew (max):      {calibration['step_skew_max_s'] * 1000:.1f} ms")
+    print(f"calibration time:     {calibration['total_wall_time_s']:.2f} s")
+    print(f"max slope error:      {calibration['max_slope_error']:.5f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,264 @@
+from dataclasses import dataclass
+
 import numpy as np
 
+from profiling import profiler
+
+
+@dataclass
+class LinearFit:
+    """Least squares fits of y = slope * x + intercept, one entry per sensor"""
+
+    slopes: np.ndarray
+    intercepts: np.ndarray
+    r_squared: np.ndarray
+    residual_rms: np.ndarray
+    slope_stderr: np.ndarray
+    intercept_stderr: np.ndarray
+    # (n_steps, n_sensors) mask of the steps a robust fit found to be outliers, None for a least squares fit
+    outlier_steps: np.ndarray | None = None
+
+    def subset(self, index: slice | np.ndarray) -> "LinearFit":
+        """the fits of only the selected sensors"""
+        return LinearFit(
+            self.slopes[index],
+            self.intercepts[index],
+            self.r_squared[index],
+            self.residual_rms[index],
+            self.slope_stderr[index],
+            self.intercept_stderr[index],
+            None if self.outlier_steps is None else self.outlier_steps[:, index],
+        )
+
+    def get_outlier_steps(self, sensor: int) -> list[int]:
+        """indexes of the steps that are outliers for a sensor"""
+        if self.outlier_steps is None:
+            return []
+
+        return np.flatnonzero(self.outlier_steps[:, sensor]).tolist()
+
+    def to_dict(self) -> dict[str, list]:
+        """plain lists for writing out as JSON, where NaN (e.g. standard errors of a 2 point fit) becomes None"""
+        fields = {
+            field: [None if np.isnan(value) else value for value in values.tolist()]
+            for field, values in (
+                ("slopes", self.slopes),
+                ("intercepts", self.intercepts),
+                ("r_squared", self.r_squared),
+                ("residual_rms", self.residual_rms),
+                ("slope_stderr", self.slope_stderr),
+                ("intercept_stderr", self.intercept_stderr),
+            )
+        }
+        if self.outlier_steps is not None:
+            fields["outlier_steps"] = [
+                self.get_outlier_steps(sensor) for sensor in range(len(self.slopes))
+            ]
+
+        return fields
+
+    def rounded(self, decimals: int = 5) -> "LinearFit":
+        """copy of the fit rounded for display"""
+        return LinearFit(
+            *(
+                np.round(values, decimals=decimals)
+                for values in (
+                    self.slopes,
+                    self.intercepts,
+                    self.r_squared,
+                    self.residual_rms,
+                    self.slope_stderr,
+                    self.intercept_stderr,
+                )
+            ),
+            self.outlier_steps,
+        )
+
+
+class RunningLinearFit:
+    """Least squares fits of every sensor against the same x values, kept up to date one point at a time.
+
+    Holds the count, means and co-moments (Σ(x - x̄)², Σ(x - x̄)(y - ȳ), Σ(y - ȳ)²) rather than the raw sums, which
+    are the same sufficient statistics but don't lose precision to cancellation when the values are large. Adding a
+    point and getting the fit are O(n_sensors) however many points there are.
+
+    The slopes and intercepts are as good as a batch fit's, but the residual sum of squares is Σ(y - ȳ)² less the part
+    the line explains, so when the points are almost on the line it keeps only a few significant digits (about 6 for
+    an R² of 1 - 1e-10). That is plenty for showing the fit live, calibrations are fit from the steps themselves
+    """
+
+    __slots__ = ("count", "x_mean", "y_mean", "sxx", "sxy", "syy")
+
+    def __init__(self, num_sensors: int):
+        self.count = 0
+        self.x_mean = 0.0
+        self.y_mean = np.zeros(num_sensors, dtype=np.float64)
+        self.sxx = 0.0
+        self.sxy = np.zeros(num_sensors, dtype=np.float64)
+        self.syy = np.zeros(num_sensors, dtype=np.float64)
+
+    def add(self, x: float, y: np.ndarray) -> None:
+        """add the point (x, y[i]) to the fit of every sensor i"""
+        self.count += 1
+        dx = x - self.x_mean
+        dy = y - self.y_mean
+        self.x_mean += dx / self.count
+        self.y_mean += dy / self.count
+        # the deviation from the old mean times the deviation from the new one (Welford)
+        self.sxx += dx * (x - self.x_mean)
+        self.sxy += dx * (y - self.y_mean)
+        self.syy += dy * (y - self.y_mean)
+
+    def get_fit(self) -> LinearFit:
+        """
+        Raises:
+            ValueError: If there are less than 2 points, or all of them have the same x value
+        """
+        if self.count < 2:
+            raise ValueError("At least 2 data points required for linear regression")
+        if self.sxx == 0:
+            raise ValueError(
+                "At least 2 distinct x values required for linear regression"
+            )
+
+        slopes = self.sxy / self.sxx
+        intercepts = self.y_mean - slopes * self.x_mean
+        # rounding can leave a perfect fit very slightly negative
+        sse = np.maximum(self.syy - slopes * self.sxy, 0)
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            r_squared = np.where(self.syy > 0, 1 - sse / self.syy, 1.0)
+
+        residual_rms = np.sqrt(sse / self.count)
+
+        if self.count > 2:
+            residual_var = sse / (self.count - 2)
+            slope_stderr = np.sqrt(residual_var / self.sxx)
+            intercept_stderr = np.sqrt(
+                residual_var * (1 / self.count + self.x_mean**2 / self.sxx)
+            )
+        else:
+            slope_stderr = np.full_like(slopes, np.nan)
+            intercept_stderr = np.full_like(slopes, np.nan)
+
+        return LinearFit(
+            slopes, intercepts, r_squared, residual_rms, slope_stderr, intercept_stderr
+        )
+
+
+@profiler.traced
+def calculate_linear_regressions(
+    x_values: np.ndarray | list[float], y_values: np.ndarray
+) -> LinearFit:
+    """
+    Calculate the linear regression of every column of y_values against the same x_values in one pass.
+
+    Args:
+        x_values: Independent variable values, shape (n,)
+        y_values: Dependent variable values, shape (n, n_sensors)
+
+    Returns:
+        LinearFit: slopes, intercepts, R², residual RMS and standard errors, each of shape (n_sensors,)
+
+    Raises:
+        ValueError: If the inputs have different lengths, have less than 2 entries, or x_values are all identical
+    """
+    x_array = np.asarray(x_values, dtype=float)
+    y_array = np.asarray(y_values, dtype=float)
+    if y_array.ndim == 1:
+        y_array = y_array[:, np.newaxis]
+
+    if x_array.ndim != 1 or len(x_array) != len(y_array):
+        raise ValueError(
+            f"Input arrays must have same length. "
+            f"Got x_values: {x_array.shape}, y_values: {y_array.shape}"
+        )
+
+    num_points = len(x_array)
+    if num_points == 0:
+        raise ValueError("Input arrays cannot be empty")
+
+    if num_points < 2:
+        raise ValueError("At least 2 data points required for linear regression")
+
+    x_mean = x_array.mean()
+    x_centered = x_array - x_mean
+    sxx = x_centered @ x_centered
+    if sxx == 0:
+        raise ValueError("At least 2 distinct x values required for linear regression")
+
+    y_mean = y_array.mean(axis=0)
+    y_centered = y_array - y_mean
+
+    slopes = (x_centered @ y_centered) / sxx
+    intercepts = y_mean - slopes * x_mean
+
+    residuals = y_centered - np.outer(x_centered, slopes)
+    sse = np.einsum("ij,ij->j", residuals, residuals)
+    sst = np.einsum("ij,ij->j", y_centered, y_centered)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        # a flat line is fit perfectly, so report R² = 1 rather than 0 / 0
+        r_squared = np.where(sst > 0, 1 - sse / sst, 1.0)
+
+    residual_rms = np.sqrt(sse / num_points)
+
+    if num_points > 2:
+        residual_var = sse / (num_points - 2)
+        slope_stderr = np.sqrt(residual_var / sxx)
+        intercept_stderr = np.sqrt(residual_var * (1 / num_points + x_mean**2 / sxx))
+    else:
+        # two points always fit exactly, there are no degrees of freedom left to estimate the error
+        slope_stderr = np.full_like(slopes, np.nan)
+        intercept_stderr = np.full_like(slopes, np.nan)
+
+    return LinearFit(
+        slopes, intercepts, r_squared, residual_rms, slope_stderr, intercept_stderr
+    )
+
+
+@profiler.traced
+def calculate_weighted_linear_regressions(
+    x_values: np.ndarray, y_values: np.ndarray, weights: np.ndarray
+) -> LinearFit:
+    """
+    Weighted least squares version of calculate_linear_regressions, where each sensor has its own weight for every
+    point. The statistics are over the weighted points, with the number of points taken as the sum of the weights.
+
+    Args:
+        x_values: Independent variable values, shape (n,)
+        y_values: Dependent variable values, shape (n, n_sensors)
+        weights: Weight of every value in y_values, between 0 and 1, shape (n, n_sensors)
+    """
+    total_weights = weights.sum(axis=0)
+    x_means = (x_values @ weights) / total_weights
+    x_centered = x_values[:, np.newaxis] - x_means
+    y_means = np.einsum("ij,ij->j", weights, y_values) / total_weights
+    y_centered = y_values - y_means
+
+    sxx = np.einsum("ij,ij,ij->j", weights, x_centered, x_centered)
+    slopes = np.einsum("ij,ij,ij->j", weights, x_centered, y_centered) / sxx
+    intercepts = y_means - slopes * x_means
+
+    residuals = y_centered - x_centered * slopes
+    sse = np.einsum("ij,ij,ij->j", weights, residuals, residuals)
+    sst = np.einsum("ij,ij,ij->j", weights, y_centered, y_centered)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        r_squared = np.where(sst > 0, 1 - sse / sst, 1.0)
+        residual_var = np.where(total_weights > 2, sse / (total_weights - 2), np.nan)
+
+    residual_rms = np.sqrt(sse / total_weights)
+    slope_stderr = np.sqrt(residual_var / sxx)
+    intercept_stderr = np.sqrt(residual_var * (1 / total_weights + x_means**2 / sxx))
+
+    return LinearFit(
+        slopes, intercepts, r_squared, residual_rms, slope_stderr, intercept_stderr
+    )
+
 
 def calculate_linear_regression(
-    x_values: list[float], y_values: list[float]
+    x_values: list[float], y_values: list[float], decimals: int | None = None
 ) -> tuple[float, float]:
     """
     Calculate linear regression coefficients using least squares method.
@@ -10,6 +266,7 @@ def calculate_linear_regression(
     Args:
         x_values: Independent variable values
         y_values: Dependent variable values
+        decimals: Round the coefficients to this many decimals for display
 
     Returns:
         tup [float, float]: (slope, intercept) where y = slope * x + intercept
@@ -23,15 +280,8 @@ def calculate_linear_regression(
             f"Got x_values: {len(x_values)}, y_values: {len(y_values)}"
         )
 
-    if len(x_values) == 0 or len(y_values) == 0:
-        raise ValueError("Input arrays cannot be empty")
-
-    if len(x_values) < 2 or len(y_values) < 2:
-        raise ValueError("At least 2 data points required for linear regression")
-
-    x_array = np.asarray(x_values, dtype=float)
-    y_array = np.asarray(y_values, dtype=float)
-
-    slope, intercept = np.polyfit(x_array, y_array, 1)
+    fit = calculate_linear_regressions(x_values, np.asarray(y_values, dtype=float))
+    if decimals is not None:
+        fit = fit.rounded(decimals)
 
-    return float(np.round(slope, decimals=5)), float(np.round(intercept, decimals=5))
+    return float(fit.slopes[0]), float(fit.intercepts[0])
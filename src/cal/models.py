@@ -0,0 +1,317 @@
+"""
+Calibration curves beyond a straight line, for sensors that are noticeably nonlinear.
+
+Every candidate model is linear in its coefficients, so each one is a single design matrix of the pressures. It is
+factorised once (QR) and solved for every sensor at the same time, which keeps fitting all of the models to hundreds
+of sensors cheap enough to redo after every step. Each sensor then gets the model with the lowest AICc or
+leave-one-out cross validation error
+"""
+
+from dataclasses import dataclass
+
+import numpy as np
+
+from profiling import profiler
+
+LINEAR = "linear"
+QUADRATIC = "quadratic"
+CUBIC = "cubic"
+PIECEWISE = "piecewise"
+# in order of preference when models fit equally well, simplest first
+MODELS = (LINEAR, QUADRATIC, CUBIC, PIECEWISE)
+
+# criteria to pick each sensor's model with
+AICC = "aicc"
+LOOCV = "loocv"
+CRITERIA = (AICC, LOOCV)
+
+# Newton's method for inverting the models stops once no x moves by more than this (of the scaled range)
+INVERSE_TOLERANCE = 1e-10
+MAX_INVERSE_ITERATIONS = 50
+
+
+def _get_design_matrix(model: str, x_scaled: np.ndarray, knot: float) -> np.ndarray:
+    """the basis functions of a model evaluated at every x, shape (n, n_coefficients)"""
+    if model == PIECEWISE:
+        # a straight line that bends once at the knot
+        return np.column_stack(
+            (np.ones_like(x_scaled), x_scaled, np.maximum(x_scaled - knot, 0))
+        )
+
+    degree = MODELS.index(model) + 1
+    return np.vander(x_scaled, degree + 1, increasing=True)
+
+
+def _get_raw_coefficients(
+    model: str, coefficients: np.ndarray, center: float, half_range: float
+) -> np.ndarray:
+    """convert coefficients of the scaled x, (x - center) / half_range, into coefficients of x"""
+    if model == PIECEWISE:
+        intercept, slope, bend = coefficients
+        return np.array(
+            (
+                intercept - slope * center / half_range,
+                slope / half_range,
+                bend / half_range,
+            )
+        )
+
+    # the polynomial of the scaled x, expanded with the binomial theorem
+    degree = len(coefficients) - 1
+    transform = np.zeros((degree + 1, degree + 1))
+    for power in range(degree + 1):
+        transform[: power + 1, power] = np.polynomial.polynomial.polypow(
+            [-center / half_range, 1 / half_range], power
+        )
+    return transform @ coefficients
+
+
+@dataclass
+class ModelFit:
+    """Every candidate model fit to every sensor, and the one picked for each sensor"""
+
+    x_values: np.ndarray
+    # names of the candidate models, in the order of the entries below
+    models: tuple[str, ...]
+    # (n_coefficients, n_sensors) coefficients of each model, in terms of the scaled x
+    coefficients: list[np.ndarray]
+    # (n_models, n_sensors) score of each model, lower is better and inf where the model can't be used
+    scores: np.ndarray
+    # (n_sensors,) index of the model picked for each sensor
+    selected: np.ndarray
+    # (n, n_sensors) residuals of the picked model at every x
+    residuals: np.ndarray
+    center: float
+    half_range: float
+    knot: float
+
+    def get_model_names(self) -> list[str]:
+        return [self.models[index] for index in self.selected.tolist()]
+
+    def get_max_errors(self) -> np.ndarray:
+        return np.abs(self.residuals).max(axis=0)
+
+    def get_residual_rms(self) -> np.ndarray:
+        return np.sqrt((self.residuals**2).mean(axis=0))
+
+    def predict(self, x_values: np.ndarray | list[float]) -> np.ndarray:
+        """the picked model of every sensor evaluated at x_values, shape (len(x_values), n_sensors)"""
+        x_scaled = (np.asarray(x_values, dtype=float) - self.center) / self.half_range
+        predictions = np.empty((len(x_scaled), len(self.selected)))
+        for index, model in enumerate(self.models):
+            sensors = self.selected == index
+            if sensors.any():
+                predictions[:, sensors] = (
+                    _get_design_matrix(model, x_scaled, self.knot)
+                    @ self.coefficients[index][:, sensors]
+                )
+
+        return predictions
+
+    def _evaluate(self, x_scaled: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """(value, derivative with respect to the scaled x) of each sensor's picked model at its own scaled x, both of
+        shape (n, n_sensors) like x_scaled
+        """
+        values = np.empty_like(x_scaled)
+        derivatives = np.empty_like(x_scaled)
+        for index, model in enumerate(self.models):
+            sensors = self.selected == index
+            if not sensors.any():
+                continue
+
+            x = x_scaled[:, sensors]
+            coefficients = self.coefficients[index][:, sensors]
+            if model == PIECEWISE:
+                intercept, slope, bend = coefficients
+                values[:, sensors] = (
+                    intercept + slope * x + bend * np.maximum(x - self.knot, 0)
+                )
+                derivatives[:, sensors] = slope + bend * (x > self.knot)
+                continue
+
+            # Horner's scheme for the polynomial and its derivative together
+            value = np.broadcast_to(coefficients[-1], x.shape).copy()
+            derivative = np.zeros_like(x)
+            for coefficient in coefficients[-2::-1]:
+                derivative = derivative * x + value
+                value = value * x + coefficient
+            values[:, sensors] = value
+            derivatives[:, sensors] = derivative
+
+        return values, derivatives
+
+    @profiler.traced
+    def invert(self, y_values: np.ndarray) -> np.ndarray:
+        """
+        The x at which each sensor's picked model gives the y values, e.g. the pressure of raw readings.
+
+        Solved with Newton's method for every value at once, from the straight line through the model's values at
+        the ends of the fitted range. The models are only expected to be monotonic over (about) that range, values
+        the model can't reach, or where it is flat, are NaN.
+
+        Args:
+            y_values: shape (n, n_sensors)
+        """
+        y_array = np.asarray(y_values, dtype=float)
+        ends, _ = self._evaluate(np.array([[-1.0], [1.0]]).repeat(y_array.shape[1], 1))
+        with np.errstate(divide="ignore", invalid="ignore"):
+            x_scaled = -1 + 2 * (y_array - ends[0]) / (ends[1] - ends[0])
+            for _ in range(MAX_INVERSE_ITERATIONS):
+                values, derivatives = self._evaluate(x_scaled)
+                step = (values - y_array) / derivatives
+                x_scaled = x_scaled - step
+                if not np.any(np.abs(step) > INVERSE_TOLERANCE):
+                    break
+
+            values, _ = self._evaluate(x_scaled)
+            # whatever hasn't converged by now is a reading the model can't produce
+            unsolved = ~(
+                np.abs(values - y_array)
+                <= INVERSE_TOLERANCE * np.maximum(np.abs(ends[1] - ends[0]), 1)
+            )
+
+        x_values = self.center + x_scaled * self.half_range
+        x_values[unsolved] = np.nan
+        return x_values
+
+    def to_dict(self) -> dict[str, list]:
+        """plain lists for writing out as JSON. Coefficients are of x itself: polynomials are c0 + c1 x + c2 x² ...,
+        piecewise is c0 + c1 x + c2 max(0, x - knot)
+        """
+        raw_coefficients = []
+        for sensor, index in enumerate(self.selected.tolist()):
+            raw_coefficients.append(
+                _get_raw_coefficients(
+                    self.models[index],
+                    self.coefficients[index][:, sensor],
+                    self.center,
+                    self.half_range,
+                ).tolist()
+            )
+
+        return {
+            "models": self.get_model_names(),
+            "coefficients": raw_coefficients,
+            "knot": self.center + self.knot * self.half_range,
+            "residuals": self.residuals.T.tolist(),
+            "max_errors": self.get_max_errors().tolist(),
+            "residual_rms": self.get_residual_rms().tolist(),
+            "scores": {
+                model: [None if np.isinf(score) else score for score in scores]
+                for model, scores in zip(self.models, self.scores.tolist())
+            },
+        }
+
+
+@profiler.traced
+def fit_models(
+    x_values: np.ndarray | list[float],
+    y_values: np.ndarray,
+    models: tuple[str, ...] = MODELS,
+    criterion: str = AICC,
+) -> ModelFit:
+    """
+    Fit every model to every column of y_values against the same x_values and pick the best model for each column.
+
+    Args:
+        x_values: Independent variable values, shape (n,)
+        y_values: Dependent variable values, shape (n, n_sensors)
+        models: the candidate MODELS, the first one is used where no model can be scored (e.g. too few points)
+        criterion: AICC (Akaike information criterion corrected for few points) or LOOCV (mean squared leave-one-out
+            error, worked out from the hat matrix without refitting)
+
+    Raises:
+        ValueError: If the inputs have different lengths, have less than 2 distinct x values, or an unknown model or
+        criterion is asked for
+    """
+    unknown = [model for model in models if model not in MODELS]
+    if unknown or criterion not in CRITERIA:
+        raise ValueError(
+            f"Unknown model or criterion: {', '.join(unknown) or criterion}"
+        )
+
+    x_array = np.asarray(x_values, dtype=float)
+    y_array = np.asarray(y_values, dtype=float)
+    if y_array.ndim == 1:
+        y_array = y_array[:, np.newaxis]
+
+    if x_array.ndim != 1 or len(x_array) != len(y_array):
+        raise ValueError(
+            f"Input arrays must have same length. "
+            f"Got x_values: {x_array.shape}, y_values: {y_array.shape}"
+        )
+
+    distinct_x = np.unique(x_array)
+    if len(distinct_x) < 2:
+        raise ValueError("At least 2 distinct x values required for a calibration")
+
+    # fit on x scaled to [-1, 1], so that powers of large pressures don't swamp the factorisation
+    center = (distinct_x[-1] + distinct_x[0]) / 2
+    half_range = (distinct_x[-1] - distinct_x[0]) / 2
+    x_scaled = (x_array - center) / half_range
+    knot = (np.median(distinct_x) - center) / half_range
+
+    num_points = len(x_array)
+    all_coefficients = []
+    all_residuals = []
+    scores = np.full((len(models), y_array.shape[1]), np.inf)
+    for index, model in enumerate(models):
+        design = _get_design_matrix(model, x_scaled, knot)
+        num_coefficients = design.shape[1]
+        q, r = np.linalg.qr(design)
+        # the same factorisation solves every sensor at once
+        rank = np.sum(np.abs(np.diag(r)) > 1e-10 * np.abs(r[0, 0]))
+        if rank < num_coefficients or num_points <= num_coefficients:
+            coefficients = np.zeros((num_coefficients, y_array.shape[1]))
+            if index == 0:
+                # the fallback model still needs coefficients, from a least squares solve that copes with rank loss
+                coefficients = np.linalg.lstsq(design, y_array, rcond=None)[0]
+            all_coefficients.append(coefficients)
+            all_residuals.append(y_array - design @ coefficients)
+            continue
+
+        coefficients = np.linalg.solve(r, q.T @ y_array)
+        residuals = y_array - design @ coefficients
+        all_coefficients.append(coefficients)
+        all_residuals.append(residuals)
+        sse = np.einsum("ij,ij->j", residuals, residuals)
+
+        if criterion == AICC:
+            # parameters are the coefficients plus the noise variance
+            num_parameters = num_coefficients + 1
+            if num_points - num_parameters - 1 <= 0:
+                continue
+            # an exact fit would score -inf, the floor lets the penalty decide between exact fits
+            scores[index] = (
+                num_points * np.log(np.maximum(sse / num_points, np.finfo(float).tiny))
+                + 2 * num_parameters
+                + 2
+                * num_parameters
+                * (num_parameters + 1)
+                / (num_points - num_parameters - 1)
+            )
+        else:
+            leverage = np.einsum("ij,ij->i", q, q)
+            if np.any(leverage > 1 - 1e-10):
+                # a point only this model's extra freedom can reach, it can't be left out
+                continue
+            loo_residuals = residuals / (1 - leverage)[:, np.newaxis]
+            scores[index] = np.mean(loo_residuals**2, axis=0)
+
+    # ties, including no model being usable, go to the earliest (simplest) model
+    selected = np.argmin(scores, axis=0)
+    residuals = np.take_along_axis(
+        np.stack(all_residuals), selected[np.newaxis, np.newaxis, :], axis=0
+    )[0]
+
+    return ModelFit(
+        x_array,
+        tuple(models),
+        all_coefficients,
+        scores,
+        selected,
+        residuals,
+        center,
+        half_range,
+        knot,
+    )
@@ -0,0 +1,178 @@
+"""
+Averages and line fits that a few bad values can't drag off, e.g. a spike from a half read line within a step or a
+step taken before the rig had settled. Everything works on every sensor at once, like cal.calculate_linear_regressions
+"""
+
+import numpy as np
+
+from cal import cal
+from profiling import profiler
+
+# scales the median absolute deviation of normally distributed values to their standard deviation
+MAD_TO_STD = 1.4826
+
+# how to average the samples of a step
+MEAN = "mean"
+SIGMA_CLIP = "sigma_clip"
+MEDIAN_OF_MEANS = "median_of_means"
+AVERAGING_METHODS = (MEAN, SIGMA_CLIP, MEDIAN_OF_MEANS)
+
+# how to fit the steps
+LEAST_SQUARES = "least_squares"
+HUBER = "huber"
+FIT_METHODS = (LEAST_SQUARES, HUBER)
+
+# samples further than this many standard deviations from the median of a step are rejected
+CLIP_SIGMAS = 3.5
+# number of groups the samples of a step are split into for a median of means
+MEDIAN_OF_MEANS_GROUPS = 5
+# residuals up to this many standard deviations count fully in a Huber fit, larger ones are down weighted
+HUBER_THRESHOLD = 1.345
+# steps with a residual over this many residual standard deviations are reported as outliers
+OUTLIER_SIGMAS = 3.0
+MAX_FIT_ITERATIONS = 50
+# the fit has converged once no weight changes by more than this
+WEIGHT_TOLERANCE = 1e-4
+
+
+def _get_spread(values: np.ndarray, center: np.ndarray) -> np.ndarray:
+    """robust standard deviation of each column, from the median absolute deviation (NaNs are ignored).
+    Falls back to the standard deviation where more than half of the values are the same, e.g. quantised readings
+    """
+    spread = MAD_TO_STD * np.nanmedian(np.abs(values - center), axis=0)
+    return np.where(spread > 0, spread, np.nanstd(values, axis=0))
+
+
+@profiler.traced
+def sigma_clip(
+    block: np.ndarray, num_sigmas: float = CLIP_SIGMAS
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Average each column of a block of samples, leaving out the samples too far from the median of their column.
+    The spread is measured with the median absolute deviation, which the samples being left out barely move, so a
+    single pass is enough.
+
+    Args:
+        block: samples of a step, shape (n, n_sensors)
+        num_sigmas: reject samples further than this many (robust) standard deviations from the median
+
+    Returns:
+        (means, stds, rejected): the mean and sample standard deviation of each sensor over the samples that were
+        kept, and which samples were rejected, shape (n, n_sensors)
+    """
+    center = np.median(block, axis=0)
+    rejected = np.abs(block - center) > num_sigmas * _get_spread(block, center)
+
+    kept = np.where(rejected, np.nan, block)
+    num_kept = len(block) - rejected.sum(axis=0)
+    # the median itself is never rejected, so every column keeps at least one sample
+    means = np.nanmean(kept, axis=0)
+    sum_squares = np.nansum((kept - means) ** 2, axis=0)
+    stds = np.where(num_kept > 1, np.sqrt(sum_squares / np.maximum(num_kept - 1, 1)), 0)
+
+    return means, stds, rejected
+
+
+@profiler.traced
+def median_of_means(
+    block: np.ndarray, num_groups: int = MEDIAN_OF_MEANS_GROUPS
+) -> np.ndarray:
+    """split the samples of a step into consecutive groups and take the median of the group means of each column"""
+    num_groups = max(1, min(num_groups, len(block)))
+    group_starts = np.linspace(0, len(block), num_groups, endpoint=False).astype(int)
+    group_sizes = np.diff(np.append(group_starts, len(block)))
+    group_means = np.add.reduceat(block, group_starts, axis=0) / group_sizes[:, None]
+    return np.median(group_means, axis=0)
+
+
+def average_step(
+    block: np.ndarray, method: str
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """(means, stds, rejected samples) of a step with one of the AVERAGING_METHODS"""
+    if method == SIGMA_CLIP:
+        return sigma_clip(block)
+
+    rejected = np.zeros(block.shape, dtype=bool)
+    stds = block.std(axis=0, ddof=1) if len(block) > 1 else np.zeros(block.shape[1])
+    if method == MEDIAN_OF_MEANS:
+        return median_of_means(block), stds, rejected
+    if method == MEAN:
+        return block.mean(axis=0), stds, rejected
+
+    raise ValueError(
+        f"Unknown averaging method {method}, expected one of {', '.join(AVERAGING_METHODS)}"
+    )
+
+
+@profiler.traced
+def calculate_huber_regressions(
+    x_values: np.ndarray | list[float],
+    y_values: np.ndarray,
+    threshold: float = HUBER_THRESHOLD,
+) -> cal.LinearFit:
+    """
+    Fit every column of y_values against the same x_values with a Huber loss, by iteratively reweighted least
+    squares. Steps with small residuals count fully and the rest are weighted down in proportion to their residual,
+    so a single bad step can't pull the line towards itself.
+
+    Args:
+        x_values: Independent variable values, shape (n,)
+        y_values: Dependent variable values, shape (n, n_sensors)
+        threshold: residuals up to this many (robust) standard deviations count fully
+
+    Returns:
+        LinearFit: as for calculate_linear_regressions, with R², residual RMS and standard errors over the weighted
+        steps and outlier_steps marking the steps more than OUTLIER_SIGMAS from the line
+
+    Raises:
+        ValueError: as for calculate_linear_regressions
+    """
+    # starts from the least squares fit, which also checks the inputs
+    fit = cal.calculate_linear_regressions(x_values, y_values)
+    x_array = np.asarray(x_values, dtype=float)
+    y_array = np.asarray(y_values, dtype=float)
+    if y_array.ndim == 1:
+        y_array = y_array[:, np.newaxis]
+
+    scale = np.full(y_array.shape[1], np.inf)
+    weights = np.ones_like(y_array)
+    for _ in range(MAX_FIT_ITERATIONS):
+        residuals = y_array - (np.outer(x_array, fit.slopes) + fit.intercepts)
+        # the scale of the residuals is re-estimated as the line moves away from the outliers, the least squares line
+        # is tilted towards them and leaves every step with a large residual. It is only let shrink, or the weights
+        # can flip back and forth instead of settling
+        scale = np.minimum(scale, _get_spread(residuals, np.median(residuals, axis=0)))
+        # a sensor that fits (almost) exactly has nothing to down weight
+        with np.errstate(divide="ignore", invalid="ignore"):
+            scaled = np.abs(residuals) / (threshold * scale)
+            new_weights = np.where((scale > 0) & (scaled > 1), 1 / scaled, 1.0)
+        if np.allclose(new_weights, weights, rtol=0, atol=WEIGHT_TOLERANCE):
+            break
+
+        weights = new_weights
+        fit = cal.calculate_weighted_linear_regressions(x_array, y_array, weights)
+
+    # judged against the residual standard deviation of the final fit, the median absolute deviation of a handful
+    # of steps is too noisy and would flag good steps
+    residuals = y_array - (np.outer(x_array, fit.slopes) + fit.intercepts)
+    total_weights = weights.sum(axis=0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        residual_std = fit.residual_rms * np.sqrt(total_weights / (total_weights - 2))
+    fit.outlier_steps = (total_weights > 2) & (
+        np.abs(residuals) > OUTLIER_SIGMAS * residual_std
+    )
+    return fit
+
+
+def fit_steps(
+    x_values: np.ndarray | list[float], y_values: np.ndarray, method: str
+) -> cal.LinearFit:
+    """fit every sensor's steps with one of the FIT_METHODS"""
+    if method == LEAST_SQUARES:
+        return cal.calculate_linear_regressions(x_values, y_values)
+    if method == HUBER:
+        return calculate_huber_regressions(x_values, y_values)
+
+    raise ValueError(
+        f"Unknown fit method {method}, expected one of {', '.join(FIT_METHODS)}"
+    )
@@ -8,9 +8,53 @@ from textual.css.query import NoMatches
 from textual.message import Message
 from textual.widget import Widget
 from textual.timer import Timer
-from textual.worker import get_current_worker
+from textual.message_pump import MessagePump
+
+import sqlite3
+
+import numpy as np
+
+from cal import cal, models, robust
+from daemon import client as daemon_client
+from history import history
+from profiling import profiler
+from serial_reader import (
+    serial_reader,
+    acquisition,
+    convergence,
+    frames,
+    metrics,
+    verification,
+)
+from session import session
+
+# live values and progress are redrawn at most this many times a second, however fast the samples come in
+UI_FRAME_RATE = 15
+# seconds between refreshes of the metrics panel
+METRICS_REFRESH_INTERVAL = 1.0
+# the verification panel is redrawn at most this many times a second, it converts every reading that came in since
+VERIFICATION_FRAME_RATE = 5
+# PTs fitting worse than this are shown when filtering the results for poor fits
+POOR_FIT_R_SQUARED = 0.999
+# steps needed before the calibration curves are compared, the AICc of a curve needs a few more steps than it has
+# coefficients
+MIN_MODEL_STEPS = 5
+
+
+def _trace_message_dispatch() -> None:
+    """time the handling of every Textual message and event while profiling"""
+    if getattr(MessagePump._dispatch_message, "_traced", False):
+        return
+
+    dispatch_message = MessagePump._dispatch_message
 
-from serial_reader import serial_reader
+    async def traced_dispatch_message(self: MessagePump, message: Message) -> None:
+        # every widget handles its messages on its own task, which would otherwise nest under the widget that mounted it
+        with profiler.span(f"{type(self).__name__}.{message.handler_name}", root=True):
+            await dispatch_message(self, message)
+
+    traced_dispatch_message._traced = True  # type: ignore[attr-defined]
+    MessagePump._dispatch_message = traced_dispatch_message  # type: ignore[method-assign]
 
 
 class CalculateLinearRegressionAction(Message):
@@ -31,6 +75,8 @@ class AutoCalCli(App):
     BINDINGS = [
         ("ctrl+q", "quit", "Quit"),
         ("ctrl+g", "calibrate", "Calibrate PTs"),
+        ("ctrl+t", "toggle_metrics", "Port metrics"),
+        ("ctrl+r", "toggle_verification", "Verify calibration"),
     ]
 
     def __init__(
@@ -40,23 +86,90 @@ class AutoCalCli(App):
         pt_configs: list[dict[str, str | int]],
         hv: str,
         lv: str,
+        continuous: bool = False,
+        lookback: float = 0,
+        aligned: bool = False,
+        tolerance: float = 0,
+        min_readings_per_pressure: int = 0,
+        settle_window: float = convergence.DEFAULT_SETTLE_WINDOW,
+        averaging: str = robust.MEAN,
+        fit_method: str = robust.LEAST_SQUARES,
+        session_path: str | None = None,
+        metrics_path: str | None = None,
+        capture_prefix: str | None = None,
+        client: daemon_client.DaemonClient | None = None,
     ):
-        # dynamically load the PTs that you have to read from
+        if profiler.is_enabled():
+            _trace_message_dispatch()
+
+        # with a tolerance, steps stop early once every PT has settled and its standard error is small enough
+        criteria = None
+        if tolerance > 0:
+            criteria = convergence.ConvergenceCriteria(
+                tolerance,
+                min_readings_per_pressure,
+                num_readings_per_pressure,
+                settle_window,
+            )
+
+        # a viewer of an acquisition daemon shows the daemon's readers, which it keeps up to date
+        self.client = client
         self.pts = []
-        for config in pt_configs:
-            assert isinstance(port := config.get("port", None), str)
-            assert isinstance(pt_count := config.get("pt_count", None), int)
-            assert isinstance(name := config.get("name", None), str)
-            self.pts.append(
-                serial_reader.SerialReader(
-                    serial_port=port,
-                    baud_rate=baud_rate,
-                    num_sensors=pt_count,
-                    num_readings_per_pt=num_readings_per_pressure,
-                    name=name,
+        if client:
+            self.pts = client.readers
+        else:
+            # dynamically load the PTs that you have to read from
+            for config in pt_configs:
+                assert isinstance(port := config.get("port", None), str)
+                assert isinstance(pt_count := config.get("pt_count", None), int)
+                assert isinstance(name := config.get("name", None), str)
+                self.pts.append(
+                    serial_reader.SerialReader(
+                        serial_port=port,
+                        baud_rate=baud_rate,
+                        num_sensors=pt_count,
+                        num_readings_per_pt=num_readings_per_pressure,
+                        name=name,
+                        criteria=criteria,
+                        averaging=averaging,
+                        fit_method=fit_method,
+                        capture_path=(
+                            f"{capture_prefix}-{serial_reader.make_id(name)}.cap"
+                            if capture_prefix
+                            else None
+                        ),
+                        protocol=config.get("protocol", frames.AUTO),
+                    )
                 )
+
+        # record every step, and pick up the steps of an interrupted session
+        self.session_writer = None
+        if session_path:
+            self.session_writer = session.SessionWriter(
+                session_path,
+                [session.describe_reader(reader) for reader in self.pts],
+                {
+                    "baud_rate": baud_rate,
+                    "num_readings_per_pt": num_readings_per_pressure,
+                    "boards": pt_configs,
+                },
             )
+            self.session_writer.restore(self.pts)
+
+        self.pts_by_id = {reader.get_pt_id(): reader for reader in self.pts}
+        self.session_path = session_path
+        # every calibration of this run replaces the run's previous one in the calibration history
+        self.history_calibration_id: int | None = None
+        # whether continuous acquisition was only started for verification
+        self.verification_sampling = False
+
+        self.metrics_exporter = None
+        if metrics_path:
+            self.metrics_exporter = metrics.MetricsExporter(self.pts, metrics_path)
 
+        self.engine = client or acquisition.AcquisitionEngine(
+            self.pts, continuous=continuous, lookback=lookback, aligned=aligned
+        )
         self.num_readings_per_pt = num_readings_per_pressure
         self.hv = hv
         self.lv = lv
@@ -67,18 +180,159 @@ class AutoCalCli(App):
         yield Header()
         yield Footer()
         yield FullCalibrationDisplay(
-            self.pts, self.num_readings_per_pt, self.hv, self.lv
+            self.pts, self.engine, self.num_readings_per_pt, self.hv, self.lv
         )
+        yield MetricsPanel(self.pts)
+        yield VerificationPanel(self.pts)
 
-    def _post_calibration_message(self) -> None:
-        """Calculate the linear regression for all PTs"""
+    def on_mount(self) -> None:
+        if self.client:
+            self.client.on_progress = self.query_one(
+                CurrentCalibrationProgressIndicator
+            ).advance_progress
+            self.client.on_step = self._show_remote_step
+            self.client.on_calibrated = self._show_calibration
+            self.client.on_error = self.notify
+        if self.engine.continuous:
+            self.run_continuous_acquisition()
+        if self.metrics_exporter:
+            self.set_interval(
+                self.metrics_exporter.interval, self.metrics_exporter.export
+            )
+
+    def on_unmount(self) -> None:
+        if self.session_writer:
+            self.session_writer.close()
+        if self.metrics_exporter:
+            self.metrics_exporter.export()
+        if self.client:
+            self.client.close()
+
+    @work(exit_on_error=True, group="continuous-acquisition")
+    async def run_continuous_acquisition(self) -> None:
+        """keep sampling every port in the background so that steps can be taken from already captured samples"""
+        await self.engine.run_continuous()
+
+    def _show_calibration(self) -> None:
         for calibration_display in self.query(PreviousCalculationDisplay):
             calibration_display.post_message(CalculateLinearRegressionAction())
 
+    def _show_remote_step(
+        self, reader: serial_reader.SerialReader, pressure: float, avgs: list[float]
+    ) -> None:
+        """a step the daemon took, whichever of its viewers asked for it"""
+        self.query_one(FullCalibrationDisplay).post_message(
+            AverageRawReadingUpdated(
+                pressure,
+                avgs,
+                reader.get_pt_id(),
+                bool(reader.store.get_settled()[-1]),
+            )
+        )
+
+    def _post_calibration_message(self) -> None:
+        """Calculate the linear regression for all PTs"""
+        if self.client:
+            # the daemon records the calibration, then every viewer shows it
+            self.client.calibrate()
+            return
+
+        self._show_calibration()
+
+        fitted = []
+        for reader in self.pts:
+            try:
+                fit = reader.get_linear_fit()
+            except ValueError:
+                continue
+            fitted.append((reader, fit))
+            if self.session_writer:
+                self.session_writer.write_fit(reader.get_pt_id(), fit)
+
+        if fitted:
+            self._record_history(fitted)
+
+    def _record_history(
+        self, fitted: list[tuple[serial_reader.SerialReader, cal.LinearFit]]
+    ) -> None:
+        try:
+            calibration_history = history.CalibrationHistory()
+            try:
+                self.history_calibration_id = calibration_history.record_calibration(
+                    [
+                        (
+                            history.get_board_key(
+                                reader.serial.port, reader.get_pt_name()
+                            ),
+                            reader.get_pt_name(),
+                            fit,
+                        )
+                        for reader, fit in fitted
+                    ],
+                    history.INTERACTIVE,
+                    self.session_path,
+                    self.history_calibration_id,
+                )
+            finally:
+                calibration_history.close()
+        except (sqlite3.Error, OSError) as e:
+            # the calibration itself is still on screen
+            self.notify(f"Couldn't save the calibration to the history: {e}")
+
+    def on_average_raw_reading_updated(
+        self, message: "AverageRawReadingUpdated"
+    ) -> None:
+        """warn about steps that were taken before they settled. The step itself has already been saved, see
+        CurrentCalibrationDisplay.take_readings_from_serial
+        """
+        if not message.settled:
+            self.notify(
+                f"{self.pts_by_id[message.pt_id].get_pt_name()} hadn't settled at {message.pressure}, "
+                "its readings were still drifting when the step was taken",
+                severity="warning",
+            )
+
     def action_calibrate(self) -> None:
         """Tell the system to calculate the linear regression"""
         self._post_calibration_message()
 
+    def action_toggle_metrics(self) -> None:
+        metrics_panel = self.query_one(MetricsPanel)
+        metrics_panel.display = not metrics_panel.display
+        if metrics_panel.display:
+            metrics_panel.refresh_metrics()
+
+    def action_toggle_verification(self) -> None:
+        """convert the live readings with the current calibration, to check it against a reference pressure"""
+        verification_panel = self.query_one(VerificationPanel)
+        if verification_panel.display:
+            verification_panel.display = False
+            if self.verification_sampling:
+                # back to reading each step straight from the ports
+                self.workers.cancel_group(self, "continuous-acquisition")
+                self.engine.continuous = False
+                self.verification_sampling = False
+            return
+
+        if any(
+            worker.name == "take_readings_from_serial" and worker.is_running
+            for worker in self.workers
+        ):
+            self.notify("Wait for the current step to finish before verifying")
+            return
+
+        reference = self.query_one(CurrentCalibrationProgressIndicator).current_pressure
+        if not verification_panel.start(reference if reference >= 0 else None):
+            self.notify("Take readings at 2 pressures and calibrate (ctrl+g) first")
+            return
+
+        verification_panel.display = True
+        if not self.engine.continuous:
+            # the readings have to keep coming in, steps are taken from them until verification is turned off
+            self.engine.continuous = True
+            self.verification_sampling = True
+            self.run_continuous_acquisition()
+
     def on_trigger_calibration_message_action(
         self, message: TriggerCalibrationMessageAction
     ) -> None:
@@ -86,10 +340,18 @@ class AutoCalCli(App):
 
 
 class AverageRawReadingUpdated(Message):
-    def __init__(self, pressure: float, raw_readings: list[float], pt_id: str) -> None:
+    def __init__(
+        self,
+        pressure: float,
+        raw_readings: list[float],
+        pt_id: str,
+        settled: bool = True,
+    ) -> None:
         self.pressure = pressure
         self.raw_readings = raw_readings
         self.pt_id = pt_id
+        # False when the readings were still drifting but the step couldn't wait any longer
+        self.settled = settled
         super().__init__()
 
 
@@ -116,31 +378,38 @@ class FullCalibrationDisplay(HorizontalGroup):
     def __init__(
         self,
         pts: list[serial_reader.SerialReader],
+        engine: acquisition.AcquisitionEngine | daemon_client.DaemonClient,
         num_readings_per_pressure: int,
         hv: str,
         lv: str,
     ):
         self.num_readings_per_pressure = num_readings_per_pressure
         self.pts = pts
-        self.total_num_pts = sum([i.get_num_pts() for i in pts])
+        self.engine = engine
         self.hv = hv
         self.lv = lv
+        # the table of each reader, so that a new step only goes to the table it belongs to
+        self.previous_displays: dict[str, PreviousCalculationDisplay] = {}
         super().__init__()
 
     # current set of readings + current set of commands
     def compose(self) -> ComposeResult:
         with Container(id="main-app-container"):
             yield CurrentCalibrationDisplay(
-                self.num_readings_per_pressure, self.pts, self.hv, self.lv
+                self.num_readings_per_pressure, self.pts, self.engine, self.hv, self.lv
             )
             with Container(id="previous-display"):
                 for reader in self.pts:
-                    yield PreviousCalculationDisplay(reader, self.hv, self.lv)
+                    previous_display = PreviousCalculationDisplay(
+                        reader, self.hv, self.lv
+                    )
+                    self.previous_displays[reader.get_pt_id()] = previous_display
+                    yield previous_display
 
     def on_average_raw_reading_updated(self, message: AverageRawReadingUpdated) -> None:
-        print("got the message here", message)
-        for prev_display in self.query(PreviousCalculationDisplay):
-            prev_display.post_message(
+        previous_display = self.previous_displays.get(message.pt_id)
+        if previous_display:
+            previous_display.post_message(
                 TableRowUpdated(message.pressure, message.raw_readings, message.pt_id)
             )
 
@@ -148,17 +417,11 @@ class FullCalibrationDisplay(HorizontalGroup):
         prev_display_container = self.query_one("#previous-display", Container)
         prev_display_container.styles.border = ("solid", "orange")
 
-        prev_display_container.styles.grid_size_columns = 2
+        prev_display_container.styles.grid_size_columns = len(self.pts)
         prev_display_container.styles.grid_size_rows = 1
 
-        # allocate space on the number of pts that each port has
-
-        container_split = ""
-        for pt in self.pts:
-            container_split += f" {int( (pt.get_num_pts() + 1) / (self.total_num_pts + len(self.pts) ) * 100)}%"
-
-        print("the style is ", container_split.strip())
-        prev_display_container.styles.grid_columns = container_split.strip()
+        # every table has a row per PT and a column per pressure, so they all need the same width
+        prev_display_container.styles.grid_columns = "1fr"
 
         prev_display_container.styles.layout = "grid"
 
@@ -178,11 +441,13 @@ class CurrentCalibrationDisplay(VerticalGroup):
         self,
         num_readings_per_pressure: int,
         pts: list[serial_reader.SerialReader],
+        engine: acquisition.AcquisitionEngine | daemon_client.DaemonClient,
         hv: str,
         lv: str,
     ):
         self.num_readings_per_pressure = num_readings_per_pressure
         self.pts = pts
+        self.engine = engine
         self.hv = hv
         self.lv = lv
         super().__init__()
@@ -191,7 +456,7 @@ class CurrentCalibrationDisplay(VerticalGroup):
         with Container(id="current-calibration-container"):
             yield CurrentCalibrationUserInputWidget().data_bind()
             yield CurrentCalibrationProgressIndicator(
-                self.num_readings_per_pressure, self.pts, self.hv, self.lv
+                self.num_readings_per_pressure, self.pts, self.engine, self.hv, self.lv
             ).data_bind(CurrentCalibrationDisplay.current_pressure)
 
     def on_pressure_updated(self, message: PressureUpdated) -> None:
@@ -208,22 +473,30 @@ class CurrentCalibrationDisplay(VerticalGroup):
 
 class CurrentCalibrationProgressIndicator(Widget):
     current_pressure: reactive[float] = reactive(-1)
-    raw_reading: reactive[float] = reactive(-1)
 
     progress_timer: Timer
-    is_first_load = True
 
     def __init__(
         self,
         num_readings_per_pressure: int,
         pts: list[serial_reader.SerialReader],
+        engine: acquisition.AcquisitionEngine | daemon_client.DaemonClient,
         hv: str,
         lv: str,
     ):
         self.num_readings_per_pressure = num_readings_per_pressure
         self.pts = pts
+        self.engine = engine
         self.hv = hv
         self.lv = lv
+
+        # widgets that are redrawn every frame, by reader id
+        self.progress_bars: dict[str, ProgressBar] = {}
+        self.raw_reading_labels: dict[str, Label] = {}
+        # readers whose progress changed since the last frame
+        self.changed_progress: set[str] = set()
+        # how many samples each reader had when its raw reading was last drawn
+        self.drawn_sample_counts: dict[str, int] = {}
         super().__init__()
 
     def compose(self) -> ComposeResult:
@@ -231,7 +504,6 @@ class CurrentCalibrationProgressIndicator(Widget):
             yield Label(
                 f"Reading pressure... {self.current_pressure}", id="pressure-display"
             )
-            yield Label("", id="raw-reading")
             # render a progress bar for each set of PTs
             with Middle(id="progress-bar-container"):
                 for pt_set in self.pts:
@@ -242,9 +514,12 @@ class CurrentCalibrationProgressIndicator(Widget):
                             yield ProgressBar(
                                 total=self.num_readings_per_pressure,
                                 show_eta=False,
-                                show_percentage=False,
+                                # adaptive steps show how close they are to converging
+                                show_percentage=pt_set.criteria is not None,
                                 id=f"{pt_set.get_pt_id()}-progress",
                             )
+                        with Center():
+                            yield Label("", id=f"{pt_set.get_pt_id()}-raw-reading")
 
     def watch_current_pressure(self, pressure: float) -> None:
         """Update the label when pressure changes"""
@@ -252,60 +527,85 @@ class CurrentCalibrationProgressIndicator(Widget):
             label = self.query_one("#pressure-display", Label)
             label.update(f"Reading pressure... {pressure if pressure >= 0 else ''}")
             self.current_pressure = pressure
-
-            if not self.is_first_load:
-                for reader in self.pts:
-                    self.take_readings_from_serial(reader)
-
-            else:
-                self.is_first_load = False
-
         except NoMatches:
             pass
 
-    @work(thread=True, exit_on_error=True)
-    async def take_readings_from_serial(
-        self, reader: serial_reader.SerialReader
-    ) -> None:
-        """reader to read simultaneously from each serial port"""
-        worker = get_current_worker()
-        if worker.is_cancelled:
-            raise Exception("Worker errored out, aborting calibration...")
+        # no pressure has been entered yet
+        if pressure >= 0:
+            self.take_readings_from_serial()
+
+    @work(exclusive=True, exit_on_error=True)
+    @profiler.traced
+    async def take_readings_from_serial(self) -> None:
+        """read the current pressure step from every serial port at once on the app's event loop"""
+        if isinstance(self.engine, daemon_client.DaemonClient):
+            # the results come back to every viewer, see AutoCalCli._show_remote_step
+            await self.engine.take_step(self.current_pressure)
+            return
 
-        for i in range(self.num_readings_per_pressure):
-            reader.read_from_serial(is_first_reading=(i == 0))
-            try:
-                self.query_one(f"#{reader.get_pt_id()}-progress", ProgressBar).advance(
-                    1
+        await self.engine.read_all_steps(self.advance_progress)
+
+        for reader in self.pts:
+            if reader.ready_for_avg():
+                avgs = reader.calculate_avg(self.current_pressure)
+                # saved right away, the step's samples are overwritten as soon as the next step starts
+                if self.app.session_writer:
+                    self.app.session_writer.write_reader_step(reader)
+                self.post_message(
+                    AverageRawReadingUpdated(
+                        self.current_pressure,
+                        avgs,
+                        reader.get_pt_id(),
+                        bool(reader.store.get_settled()[-1]),
+                    )
                 )
-            except NoMatches:
-                pass
-
-        if reader.ready_for_avg():
-            self.post_message(
-                AverageRawReadingUpdated(
-                    self.current_pressure,
-                    reader.calculate_avg(self.current_pressure),
-                    reader.get_pt_id(),
+
+    def advance_progress(self, reader: serial_reader.SerialReader, count: int) -> None:
+        """called for every batch of samples, so only note the change and leave drawing it to the next frame"""
+        self.changed_progress.add(reader.get_pt_id())
+
+    @profiler.traced
+    def refresh_live_values(self) -> None:
+        """draw the progress and latest raw reading of every reader that has changed since the last frame"""
+        for reader in self.pts:
+            pt_id = reader.get_pt_id()
+            if pt_id in self.changed_progress:
+                self.progress_bars[pt_id].update(
+                    progress=self.engine.get_step_progress(reader)
+                    * self.num_readings_per_pressure
                 )
-            )
 
-        return
+            sample_count = reader.history.total
+            if sample_count == self.drawn_sample_counts.get(pt_id, 0):
+                continue
 
-    def watch_raw_reading(self, new_reading: float) -> None:
-        """Update the screen when a raw reading comes in from serial"""
-        try:
-            label = self.query_one("#raw-reading", Label)
-            label.update(f"{f'Raw reading: {new_reading}' if new_reading >= 0 else ''}")
+            self.drawn_sample_counts[pt_id] = sample_count
+            latest = reader.history.latest()
+            if latest is not None:
+                self.raw_reading_labels[pt_id].update(
+                    "Raw: " + "  ".join(f"{value:g}" for value in latest)
+                )
 
-        except NoMatches:
-            pass
+        self.changed_progress.clear()
 
     def on_mount(self) -> None:
         """set the progress on all bars to 0"""
-        for progress_bar in self.query(ProgressBar):
+        for reader in self.pts:
+            pt_id = reader.get_pt_id()
+            self.progress_bars[pt_id] = self.query_one(
+                f"#{pt_id}-progress", ProgressBar
+            )
+            self.raw_reading_labels[pt_id] = self.query_one(
+                f"#{pt_id}-raw-reading", Label
+            )
+
+        for progress_bar in self.progress_bars.values():
             progress_bar.update(progress=0)
 
+        self.progress_timer = self.set_interval(
+            1 / UI_FRAME_RATE, self.refresh_live_values
+        )
+
 
 class CurrentCalibrationUserInputWidget(VerticalGroup):
     """The widget which accepts user input"""
@@ -359,10 +659,41 @@ class CurrentCalibrationUserInputWidget(VerticalGroup):
 
 
 class PreviousCalculationDisplay(VerticalGroup):
+    """The steps and calibration of one reader, with a row per PT and a column per pressure so that boards with
+    hundreds of PTs stay usable. Only the rows on screen are drawn, and new steps and fits update the table in place
+    """
+
+    BINDINGS = [
+        ("s", "cycle_sort", "Sort PTs"),
+        ("f", "toggle_poor_fits", "Poor fits only"),
+    ]
+
+    FIT_COLUMNS = (
+        ("m", "slopes"),
+        ("c", "intercepts"),
+        ("R²", "r_squared"),
+        ("RMS", "residual_rms"),
+    )
+    OUTLIER_COLUMN = ("Outliers", "outliers")
+    # the curve that fits each PT best, once there are enough steps to tell
+    MODEL_COLUMNS = (("Model", "model"), ("Max err", "max_error"))
+
+    # (label, column to sort on, worst first)
+    SORT_ORDERS = (
+        ("PT", "pt", False),
+        ("R²", "r_squared", False),
+        ("RMS", "residual_rms", True),
+    )
+
     def __init__(self, reader: serial_reader.SerialReader, hv: str, lv: str) -> None:
         self.reader = reader
         self.hv = hv
         self.lv = lv
+        self.fit: cal.LinearFit | None = None
+        self.model_fit: models.ModelFit | None = None
+        self.max_errors: np.ndarray | None = None
+        self.pt_sort = 0
+        self.poor_fits_only = False
         super().__init__()
 
     def compose(self) -> ComposeResult:
@@ -373,56 +704,390 @@ class PreviousCalculationDisplay(VerticalGroup):
             )
             yield DataTable(id=f"{self.reader.get_pt_id()}-data-table")
 
+    def get_table(self) -> DataTable:
+        return self.query_one(f"#{self.reader.get_pt_id()}-data-table", DataTable)
+
     def on_mount(self) -> None:
-        table = self.query_one(f"#{self.reader.get_pt_id()}-data-table", DataTable)
+        table = self.get_table()
+        table.add_column("PT", key="pt")
+
+        # steps restored from a previous session
+        for step, pressure in enumerate(self.reader.store.get_pressures()):
+            table.add_column(f"{pressure:g} PSI", key=f"step-{step}")
+
+        self._add_pt_rows()
+        self._show_live_fit()
+
+    def _get_pt_row(self, pt: int) -> list:
+        row = [
+            f"PT {pt + 1}",
+            *np.round(self.reader.store.get_avgs()[:, pt], 5).tolist(),
+        ]
+        if self.fit:
+            row += self._get_fit_cells(pt).values()
+
+        return row
+
+    def _get_fit_columns(self) -> list[tuple[str, str]]:
+        """(label, key) of every fit column that is on display"""
+        columns = list(self.FIT_COLUMNS)
+        if self.fit and self.fit.outlier_steps is not None:
+            columns.append(self.OUTLIER_COLUMN)
+        if self.model_fit:
+            columns += self.MODEL_COLUMNS
+
+        return columns
+
+    def _get_fit_cells(self, pt: int) -> dict[str, float | str]:
+        """the fit columns of a PT's row, by column key"""
+        cells: dict[str, float | str] = {
+            field: float(getattr(self.fit, field)[pt]) for _, field in self.FIT_COLUMNS
+        }
+        if self.fit.outlier_steps is not None:
+            cells["outliers"] = self._get_outliers(pt)
+        if self.model_fit:
+            cells["model"] = self.model_fit.models[self.model_fit.selected[pt]]
+            cells["max_error"] = round(float(self.max_errors[pt]), 5)
+
+        return cells
+
+    def _get_outliers(self, pt: int) -> str:
+        """the pressures of the steps a robust fit left out of a PT's calibration"""
+        pressures = self.reader.store.get_pressures()
+        return ", ".join(
+            f"{pressures[step]:g}" for step in self.fit.get_outlier_steps(pt)
+        )
 
-        # create an additional column for each PT there is
-        pt_columns = [f"PT {i + 1}" for i in range(self.reader.get_num_pts())]
-        table.add_column("PSI", key="Pressure")
-        for pt in pt_columns:
-            table.add_column(pt, key=pt)
+    def _is_poor_fit(self, pt: int) -> bool:
+        return self.fit is not None and self.fit.r_squared[pt] < POOR_FIT_R_SQUARED
+
+    def _add_pt_rows(self) -> None:
+        """add the rows of every PT that should be shown and isn't yet"""
+        table = self.get_table()
+        for pt in range(self.reader.get_num_pts()):
+            if f"pt-{pt}" in table.rows:
+                continue
+            if self.poor_fits_only and not self._is_poor_fit(pt):
+                continue
+            table.add_row(*self._get_pt_row(pt), key=f"pt-{pt}")
+
+        self._sort()
+
+    def _sort(self) -> None:
+        _, column, worst_first = self.SORT_ORDERS[self.pt_sort]
+        if column == "pt":
+            self.get_table().sort("pt", key=lambda pt: int(pt.split()[1]))
+        elif self.fit:
+            self.get_table().sort(column, reverse=worst_first)
+
+    def _remove_fit_columns(self) -> None:
+        table = self.get_table()
+        for _, field in (*self.FIT_COLUMNS, self.OUTLIER_COLUMN, *self.MODEL_COLUMNS):
+            if field in table.columns:
+                table.remove_column(field)
+
+    def _show_live_fit(self) -> None:
+        """the least squares fit of the steps so far, which is kept up to date as each step lands"""
+        if self.reader.store.num_steps < 2:
+            return
 
-    def on_table_row_updated(self, message: TableRowUpdated) -> None:
-        # only handle the message if it is meant for this table
-        print("message received: ", message)
+        try:
+            fit = self.reader.get_live_fit()
+        except ValueError:
+            # every step so far was at the same pressure
+            return
 
-        if message.pt_id != self.reader.get_pt_id():
+        self._show_fit(fit, f"Live fit for {self.reader.get_pt_name()} PTs")
+
+    def on_table_row_updated(self, message: TableRowUpdated) -> None:
+        # only add the step if the values are valid
+        if message.pressure < 0:
             return
 
-        table = self.query_one(f"#{self.reader.get_pt_id()}-data-table", DataTable)
+        table = self.get_table()
+        # new steps go before the fit, which is added back once it has been updated
+        if self.fit:
+            self.fit = None
+            self._remove_fit_columns()
+            self.query_one(
+                f"#{self.reader.get_pt_id()}-data-table-label", Label
+            ).update(f"Previous readings for {self.reader.get_pt_name()} PTs")
 
-        # only add rows to the table if the values are valid
-        if message.pressure >= 0 and message.pressure >= 0:
-            table.add_row(message.pressure, *message.raw_readings)
+        step_key = f"step-{len(table.columns) - 1}"
+        table.add_column(f"{message.pressure:g} PSI", key=step_key)
+        for pt, reading in enumerate(message.raw_readings):
+            if f"pt-{pt}" in table.rows:
+                table.update_cell(f"pt-{pt}", step_key, round(reading, 5))
+
+        self._show_live_fit()
+
+        # without a fit there is nothing to filter on
+        if self.poor_fits_only and not self.fit:
+            self.poor_fits_only = False
+            self._add_pt_rows()
 
     def on_calculate_linear_regression_action(
         self, message: CalculateLinearRegressionAction
     ) -> None:
         try:
-            table = self.query_one(f"#{self.reader.get_pt_id()}-data-table", DataTable)
+            fit = self.reader.get_linear_fit()
+        except ValueError as e:
+            # e.g. fewer than 2 pressures so far
+            self.notify(f"Can't calibrate {self.reader.get_pt_name()}: {e}")
+            return
+
+        self._show_fit(fit, f"Calibration factors for {self.reader.get_pt_name()} PTs")
+
+    def _show_fit(self, fit: cal.LinearFit, title: str) -> None:
+        try:
+            table = self.get_table()
             self.query_one(
                 f"#{self.reader.get_pt_id()}-data-table-label", Label
-            ).update(f"Calibration factors for {self.reader.get_pt_name()} PTs")
+            ).update(title)
         except NoMatches:
             return
 
+        self.fit = fit.rounded(5)
+        self.model_fit = None
+        # with so few steps every curve fits, so the candidates are only compared once there are enough of them
+        if self.reader.store.num_steps >= MIN_MODEL_STEPS:
+            self.model_fit = self.reader.get_model_fit()
+            self.max_errors = self.model_fit.get_max_errors()
+
+        for label, field in self._get_fit_columns():
+            if field not in table.columns:
+                table.add_column(label, key=field)
+
+        # fill in the fit of every PT on display without rebuilding the table
+        for row_key in table.rows:
+            pt = int(row_key.value.split("-")[1])
+            for field, value in self._get_fit_cells(pt).items():
+                table.update_cell(row_key, field, value)
+
+        if self.poor_fits_only:
+            # PTs can get better or worse with every step
+            self._add_pt_rows()
+            self._remove_good_fits()
+        self._sort()
+
+    def _remove_good_fits(self) -> None:
+        table = self.get_table()
+        for row_key in list(table.rows):
+            if not self._is_poor_fit(int(row_key.value.split("-")[1])):
+                table.remove_row(row_key)
+
+    def action_cycle_sort(self) -> None:
+        """sort by PT number, then worst R², then worst residual"""
+        self.pt_sort = (self.pt_sort + 1) % len(self.SORT_ORDERS)
+        if not self.fit and self.SORT_ORDERS[self.pt_sort][1] != "pt":
+            self.notify("Take readings at 2 pressures to sort the PTs by fit quality")
+            self.pt_sort = 0
+
+        self._sort()
+        self.notify(f"Sorted by {self.SORT_ORDERS[self.pt_sort][0]}")
+
+    def action_toggle_poor_fits(self) -> None:
+        """only show the PTs with an R² below POOR_FIT_R_SQUARED"""
+        if not self.fit:
+            self.notify("Take readings at 2 pressures to filter the PTs by fit quality")
+            return
+
+        self.poor_fits_only = not self.poor_fits_only
+        if self.poor_fits_only:
+            self._remove_good_fits()
+        else:
+            self._add_pt_rows()
+
+
+class MetricsPanel(Widget):
+    """How well every port is being read, to spot noisy cables and boards sending faster than they can be read"""
+
+    COLUMNS = (
+        ("Port", "port"),
+        ("Lines/s", "lines_per_s"),
+        ("Bytes/s", "bytes_per_s"),
+        ("Bad values", "decode_errors"),
+        ("Wrong columns", "wrong_column_lines"),
+        ("Dropped frames", "dropped_frames"),
+        ("Retries", "retries"),
+        ("Backoff s", "backoff_s"),
+        ("Buffer", "buffer"),
+        ("Steps", "steps"),
+        ("Step p50 s", "step_p50"),
+        ("Step p90 s", "step_p90"),
+    )
+
+    def __init__(self, pts: list[serial_reader.SerialReader]) -> None:
+        self.pts = pts
+        self.previous_snapshots: dict[str, dict] = {}
+        super().__init__(id="metrics-panel")
+
+    def compose(self) -> ComposeResult:
+        yield Label("Port metrics")
+        yield DataTable(id="metrics-table")
+
+    def on_mount(self) -> None:
+        table = self.query_one("#metrics-table", DataTable)
+        for label, key in self.COLUMNS:
+            table.add_column(label, key=key)
+        for reader in self.pts:
+            table.add_row(
+                reader.get_pt_name(),
+                *([""] * (len(self.COLUMNS) - 1)),
+                key=reader.get_pt_id(),
+            )
+
+        self.set_interval(METRICS_REFRESH_INTERVAL, self.refresh_metrics)
+
+    def _format_latency(self, latency: float) -> str:
+        """latencies are only known to within their histogram bucket"""
+        if np.isnan(latency):
+            return ""
+
+        return f"≤{latency:g}"
+
+    @profiler.traced
+    def refresh_metrics(self) -> None:
+        # nothing to draw while the panel is hidden
+        if not self.display:
+            return
+
+        table = self.query_one("#metrics-table", DataTable)
+        for reader in self.pts:
+            pt_id = reader.get_pt_id()
+            snapshot = reader.metrics.snapshot()
+            rates = metrics.get_rates(self.previous_snapshots.get(pt_id), snapshot)
+            self.previous_snapshots[pt_id] = snapshot
+
+            values = {
+                "lines_per_s": round(rates["lines_read_per_s"]),
+                "bytes_per_s": round(rates["bytes_read_per_s"]),
+                "decode_errors": snapshot["decode_errors"],
+                "wrong_column_lines": snapshot["wrong_column_lines"],
+                "dropped_frames": snapshot["dropped_frames"],
+                "retries": snapshot["retries"],
+                "backoff_s": round(snapshot["backoff_s"], 2),
+                "buffer": f"{snapshot['buffer_used'] / snapshot['buffer_capacity']:.0%} (max {snapshot['max_buffer_used'] / snapshot['buffer_capacity']:.0%})",
+                "steps": snapshot["steps"],
+                "step_p50": self._format_latency(
+                    reader.metrics.get_step_latency_quantile(0.5)
+                ),
+                "step_p90": self._format_latency(
+                    reader.metrics.get_step_latency_quantile(0.9)
+                ),
+            }
+            for key, value in values.items():
+                table.update_cell(pt_id, key, value)
+
+
+class VerificationPanel(Widget):
+    """The pressure every PT reads with its calibration applied, and how far that is from a reference pressure"""
+
+    COLUMNS = (
+        ("Board", "board"),
+        ("PT", "pt"),
+        ("Model", "model"),
+        ("Pressure", "pressure"),
+        ("Error", "error"),
+        ("Band (2σ)", "band"),
+        ("Max error", "max_error"),
+    )
+
+    def __init__(self, pts: list[serial_reader.SerialReader]) -> None:
+        self.pts = pts
+        self.verifiers: dict[str, verification.Verifier] = {}
+        # where each reader's history was last read up to
+        self.next_indexes: dict[str, int] = {}
+        super().__init__(id="verification-panel")
+
+    def compose(self) -> ComposeResult:
+        yield Label("Verification", id="verification-label")
+        yield Input(
+            placeholder="Reference pressure",
+            id="reference-pressure-input",
+            validate_on=["submitted"],
+            validators=[Number()],
+        )
+        yield DataTable(id="verification-table")
+
+    def on_mount(self) -> None:
+        table = self.query_one("#verification-table", DataTable)
+        for label, key in self.COLUMNS:
+            table.add_column(label, key=key)
+
+        self.set_interval(1 / VERIFICATION_FRAME_RATE, self.refresh_verification)
+
+    def start(self, reference: float | None) -> bool:
+        """verify the current calibration of every reader, returns False if one of them can't be calibrated yet"""
+        try:
+            self.verifiers = {
+                reader.get_pt_id(): verification.Verifier(reader.get_model_fit())
+                for reader in self.pts
+            }
+        except ValueError:
+            return False
+
+        # only readings from now on count
+        self.next_indexes = {
+            reader.get_pt_id(): reader.history.total for reader in self.pts
+        }
+        self.set_reference(reference)
+
+        table = self.query_one("#verification-table", DataTable)
         table.clear()
+        for reader in self.pts:
+            model_names = self.verifiers[reader.get_pt_id()].fit.get_model_names()
+            for pt in range(reader.get_num_pts()):
+                table.add_row(
+                    reader.get_pt_name(),
+                    f"PT {pt + 1}",
+                    model_names[pt],
+                    *([""] * (len(self.COLUMNS) - 3)),
+                    key=f"{reader.get_pt_id()}-{pt}",
+                )
 
-        # remove the old columns
-        table.remove_column("Pressure")
-        pt_columns = [f"PT {i + 1}" for i in range(self.reader.get_num_pts())]
-        for pt in pt_columns:
-            table.remove_column(pt)
+        return True
 
-        # add a calibration column to the start
-        table.add_column("Calibration Values", key="values")
-        table.add_columns(*pt_columns)
+    def set_reference(self, reference: float | None) -> None:
+        if reference is not None:
+            for verifier in self.verifiers.values():
+                verifier.set_reference(reference)
+
+        self.query_one("#verification-label", Label).update(
+            "Verification, enter the pressure the rig is at"
+            if reference is None
+            else f"Verification against {reference:g} PSI"
+        )
 
-        lrs = self.reader.get_all_linear_regressions()
+    @on(Input.Submitted, "#reference-pressure-input")
+    def accept_reference(self, event: Input.Submitted) -> None:
+        if event.validation_result and event.validation_result.is_valid:
+            self.set_reference(float(event.value))
+        event.input.value = ""
 
-        # add the m values
-        slopes = [val[0] for val in lrs.values()]
-        table.add_row("m", *slopes)
+    def _format(self, value: float) -> str:
+        return "" if np.isnan(value) else f"{value:.3f}"
 
-        intercepts = [val[1] for val in lrs.values()]
-        table.add_row("c", *intercepts)
+    @profiler.traced
+    def refresh_verification(self) -> None:
+        """convert every reading that came in since the last frame and redraw the table"""
+        if not self.display or not self.verifiers:
+            return
+
+        table = self.query_one("#verification-table", DataTable)
+        for reader in self.pts:
+            pt_id = reader.get_pt_id()
+            verifier = self.verifiers[pt_id]
+            _, rows = reader.history.get_range(self.next_indexes[pt_id])
+            self.next_indexes[pt_id] = reader.history.total
+            verifier.add_rows(rows)
+
+            means, stds, max_errors = verifier.get_errors()
+            for pt in range(reader.get_num_pts()):
+                row_key = f"{pt_id}-{pt}"
+                table.update_cell(
+                    row_key, "pressure", self._format(verifier.pressures[pt])
+                )
+                table.update_cell(row_key, "error", self._format(means[pt]))
+                table.update_cell(row_key, "band", self._format(2 * stds[pt]))
+                table.update_cell(row_key, "max_error", self._format(max_errors[pt]))
@@ -1,6 +1,5 @@
 import inquirer, serial
 from inquirer import errors as inquirer_errors
-from serial.tools import list_ports
 
 
 def validate_number(answers, current) -> bool:
@@ -11,6 +10,14 @@ def validate_number(answers, current) -> bool:
         raise inquirer_errors.ValidationError("", reason="Invalid number")
 
 
+def validate_float(answers, current) -> bool:
+    try:
+        float(current)
+        return True
+    except ValueError:
+        raise inquirer_errors.ValidationError("", reason="Invalid number")
+
+
 def validate_port(answers, current) -> bool:
     """Check that the selected port is open"""
     try:
@@ -23,22 +30,17 @@ def validate_port(answers, current) -> bool:
         )
 
 
-PORT_HV = (
-    "/dev/serial/by-id/usb-Espressif_USB_JTAG_serial_debug_unit_B4:3A:45:B3:70:B0-if00"
-)
-PORT_LV = (
-    "/dev/serial/by-id/usb-Espressif_USB_JTAG_serial_debug_unit_B4:3A:45:B6:7E:D0-if00"
-)
-
-
-# PORT_HV = "/dev/tty.usbserial-2110"
-# PORT_LV = "/dev/tty.usbserial-0001"
+# choice for typing in a port that wasn't discovered
+OTHER_PORT = ""
 
 
 class Config:
     def __init__(self, hv: str, lv: str):
         self.HV = "High Voltage"
         self.LV = "Low Voltage"
+        self.ON_DEMAND = "On demand"
+        self.CONTINUOUS = "Continuous"
+        self.ALIGNED = "Continuous, every board over the same time"
 
         # split the questions into multiple stages so that we can ask questions conditionally
         self.question_stage_one = [
@@ -56,6 +58,11 @@ class Config:
         ]
 
     def prompt(self):
+        # these pull in numpy, which isn't needed until the first questions have been answered
+        from cal import robust
+        from config import discovery
+        from serial_reader import convergence
+
         answers = inquirer.prompt(
             self.question_stage_one, raise_keyboard_interrupt=True
         )
@@ -66,63 +73,206 @@ class Config:
         # clean up the answers dict
         del answers["ports_to_read"]
 
+        print("Looking for boards...")
+        boards = discovery.discover_boards(int(answers["baud_rate"]))
+
         pt_configs = []
-        if self.HV in pts_to_read:
-            hv_pt_count = inquirer.prompt(
+        for name in (self.HV, self.LV):
+            if name in pts_to_read:
+                pt_config = self.prompt_board(name, boards, int(answers["baud_rate"]))
+                if pt_config:
+                    pt_configs.append(pt_config)
+
+        answers["pt_configs"] = pt_configs
+
+        # ask the remaining question
+        num_readings_per_pt = inquirer.prompt(
+            [
+                inquirer.Text(
+                    "num_readings_per_pt",
+                    message="Number of readings to take per pt (the maximum if stopping early)",
+                    validate=validate_number,
+                    default=10,
+                ),
+            ],
+            raise_keyboard_interrupt=True,
+        )
+
+        if num_readings_per_pt:
+            answers.update(num_readings_per_pt)
+
+        answers["tolerance"] = 0.0
+        answers["min_readings_per_pt"] = 0
+        tolerance = inquirer.prompt(
+            [
+                inquirer.Text(
+                    "tolerance",
+                    message="Stop a step early once every PT's standard error is below (0 to always take every reading)",
+                    validate=validate_float,
+                    default=0,
+                ),
+            ],
+            raise_keyboard_interrupt=True,
+        )
+        if tolerance and float(tolerance["tolerance"]) > 0:
+            answers["tolerance"] = float(tolerance["tolerance"])
+            min_readings = inquirer.prompt(
                 [
                     inquirer.Text(
-                        "hv_pts",
-                        message="Number of PTs on HV",
+                        "min_readings_per_pt",
+                        message="Minimum number of readings to take per pt (at least 3)",
                         validate=validate_number,
-                    )
+                        default=5,
+                    ),
                 ],
                 raise_keyboard_interrupt=True,
             )
-            if hv_pt_count:
-                pt_configs.append(
-                    {
-                        "port": PORT_HV,
-                        "pt_count": int(hv_pt_count["hv_pts"]),
-                        "name": self.HV,
-                    }
+            if min_readings:
+                answers["min_readings_per_pt"] = int(
+                    min_readings["min_readings_per_pt"]
                 )
+            settle_window = inquirer.prompt(
+                [
+                    inquirer.Text(
+                        "settle_window",
+                        message="Seconds of readings to check for drift before a step counts as settled",
+                        validate=validate_float,
+                        default=convergence.DEFAULT_SETTLE_WINDOW,
+                    ),
+                ],
+                raise_keyboard_interrupt=True,
+            )
+            if settle_window and float(settle_window["settle_window"]) > 0:
+                answers["settle_window"] = float(settle_window["settle_window"])
+
+        acquisition_mode = inquirer.prompt(
+            [
+                inquirer.List(
+                    "acquisition_mode",
+                    message="Acquisition mode (continuous keeps sampling between pressure steps)",
+                    choices=[self.ON_DEMAND, self.CONTINUOUS, self.ALIGNED],
+                    default=self.ON_DEMAND,
+                ),
+            ],
+            raise_keyboard_interrupt=True,
+        )
 
-        if self.LV in pts_to_read:
-            lv_pt_count = inquirer.prompt(
+        mode = acquisition_mode["acquisition_mode"] if acquisition_mode else None
+        answers["continuous"] = mode in (self.CONTINUOUS, self.ALIGNED)
+        answers["aligned"] = mode == self.ALIGNED
+        answers["lookback"] = 0.0
+        if answers["continuous"]:
+            lookback = inquirer.prompt(
                 [
                     inquirer.Text(
-                        "lv_pts",
-                        message="Number of PTs on LV",
-                        validate=validate_number,
-                    )
+                        "lookback",
+                        message="Seconds of already captured readings to use once a pressure is entered (0 to wait for new readings)",
+                        validate=validate_float,
+                        default=0,
+                    ),
                 ],
                 raise_keyboard_interrupt=True,
             )
-            if lv_pt_count:
-                pt_configs.append(
-                    {
-                        "port": PORT_LV,
-                        "pt_count": int(lv_pt_count["lv_pts"]),
-                        "name": self.LV,
-                    }
-                )
+            if lookback:
+                answers["lookback"] = float(lookback["lookback"])
 
-        answers["pt_configs"] = pt_configs
+        statistics = inquirer.prompt(
+            [
+                inquirer.List(
+                    "averaging",
+                    message="Averaging of each step (robust ones leave out spikes)",
+                    choices=[
+                        ("Mean", robust.MEAN),
+                        ("Sigma clipped mean", robust.SIGMA_CLIP),
+                        ("Median of means", robust.MEDIAN_OF_MEANS),
+                    ],
+                    default=robust.MEAN,
+                ),
+                inquirer.List(
+                    "fit",
+                    message="Calibration fit (Huber down weights steps that are off the line)",
+                    choices=[
+                        ("Least squares", robust.LEAST_SQUARES),
+                        ("Huber", robust.HUBER),
+                    ],
+                    default=robust.LEAST_SQUARES,
+                ),
+            ],
+            raise_keyboard_interrupt=True,
+        )
+        if statistics:
+            answers.update(statistics)
 
-        # ask the remaining question
-        num_readings_per_pt = inquirer.prompt(
+        return answers
+
+    def prompt_board(
+        self, name: str, boards: "list[discovery.DiscoveredBoard]", baud_rate: int
+    ) -> dict | None:
+        """pick the port of a set of PTs from the discovered boards, and how many of its channels are PTs"""
+        boards_by_port = {board.port: board for board in boards}
+        # the board used for this set last time, if it's plugged in
+        default = next(
+            (board.port for board in boards if board.name == name),
+            boards[0].port if boards else OTHER_PORT,
+        )
+
+        port_answer = inquirer.prompt(
+            [
+                inquirer.List(
+                    "port",
+                    message=f"Port of the {name} PTs",
+                    choices=[
+                        (
+                            f"{board.port} ({board.num_channels} channels) {board.description}",
+                            board.port,
+                        )
+                        for board in boards
+                    ]
+                    + [("Other port", OTHER_PORT)],
+                    default=default,
+                ),
+            ],
+            raise_keyboard_interrupt=True,
+        )
+        if not port_answer:
+            return None
+
+        port = port_answer["port"]
+        if port == OTHER_PORT:
+            other_port = inquirer.prompt(
+                [
+                    inquirer.Text(
+                        "port",
+                        message=f"Path of the {name} port",
+                        validate=lambda _, current: validate_port(
+                            {"baud_rate": baud_rate}, current
+                        ),
+                    ),
+                ],
+                raise_keyboard_interrupt=True,
+            )
+            if not other_port:
+                return None
+            port = other_port["port"]
+
+        board = boards_by_port.get(port)
+        pt_count = inquirer.prompt(
             [
                 inquirer.Text(
-                    "num_readings_per_pt",
-                    message="Number of readings to take per pt",
+                    "pt_count",
+                    message=f"Number of PTs on {name}",
                     validate=validate_number,
-                    default=10,
-                ),
+                    default=board.num_channels if board else None,
+                )
             ],
             raise_keyboard_interrupt=True,
         )
+        if not pt_count:
+            return None
 
-        if num_readings_per_pt:
-            answers.update(num_readings_per_pt)
+        if board:
+            from config import discovery
 
-        return answers
+            discovery.remember_board_name(board, name)
+
+        return {"port": port, "pt_count": int(pt_count["pt_count"]), "name": name}
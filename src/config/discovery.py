@@ -0,0 +1,208 @@
+import json, os, time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from serial import Serial, SerialException
+from serial.tools import list_ports
+
+from config import presets
+from serial_reader import frames, line_buffer
+
+# how long to listen to a port for before deciding it isn't a board
+PROBE_TIMEOUT = 1.5
+# complete lines in the same format needed to recognise a board
+MIN_SNIFF_LINES = 5
+
+
+class DiscoveredBoard:
+    def __init__(
+        self,
+        port: str,
+        num_channels: int,
+        fingerprint: str | None,
+        description: str,
+        name: str | None = None,
+        cached: bool = False,
+    ):
+        self.port = port
+        self.num_channels = num_channels
+        # VID:PID:serial number of the USB device, None for ports that aren't USB
+        self.fingerprint = fingerprint
+        self.description = description
+        # the name the board was last used as, e.g. High Voltage
+        self.name = name
+        # whether it was recognised from the cache instead of being probed
+        self.cached = cached
+
+    def __repr__(self) -> str:
+        return f"DiscoveredBoard({self.port}, {self.num_channels} channels, {self.fingerprint})"
+
+
+def get_cache_path() -> str:
+    return os.path.join(presets.get_config_dir(), "devices.json")
+
+
+def load_cache(path: str | None = None) -> dict[str, dict]:
+    path = path or get_cache_path()
+    if not os.path.exists(path):
+        return {}
+
+    try:
+        with open(path) as cache_file:
+            return json.load(cache_file)
+    except ValueError:
+        # a corrupted cache only costs a probe
+        return {}
+
+
+def save_cache(cache: dict[str, dict], path: str | None = None) -> None:
+    path = path or get_cache_path()
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(f"{path}.tmp", "w") as cache_file:
+        json.dump(cache, cache_file, indent=2)
+    os.replace(f"{path}.tmp", path)
+
+
+def get_fingerprint(port_info) -> str | None:
+    """identifies a USB device wherever it is plugged in"""
+    if port_info.vid is None:
+        return None
+
+    return f"{port_info.vid:04x}:{port_info.pid:04x}:{port_info.serial_number or ''}"
+
+
+def sniff_line_format(data: bytes) -> int | None:
+    """number of channels if the data is made of "v1, v2, ..." lines, None if it doesn't look like a board"""
+    # the first and last lines are most likely cut off
+    lines = [line for line in data.split(b"\n")[1:-1] if line.strip()]
+    if len(lines) < MIN_SNIFF_LINES:
+        return None
+
+    num_commas, count = Counter(line.count(b",") for line in lines).most_common(1)[0]
+    if count < MIN_SNIFF_LINES:
+        return None
+
+    rows, _, _ = line_buffer.parse_lines(lines, num_commas + 1)
+    # a few corrupted lines are fine, mostly garbage isn't
+    if len(rows) < MIN_SNIFF_LINES or len(rows) < len(lines) / 2:
+        return None
+
+    return num_commas + 1
+
+
+def probe_port(port: str, baud_rate: int, timeout: float = PROBE_TIMEOUT) -> int | None:
+    """listen to a port for up to `timeout` seconds, returns its number of channels if it is a board sending lines or
+    binary frames
+    """
+    try:
+        with Serial(port, baudrate=baud_rate, timeout=0.1) as serial:
+            serial.reset_input_buffer()
+            data = b""
+            deadline = time.monotonic() + timeout
+            while time.monotonic() < deadline:
+                data += serial.read(max(1, serial.in_waiting))
+                # stop as soon as there are enough lines to tell
+                if data.count(b"\n") > MIN_SNIFF_LINES + 1:
+                    num_channels = sniff_line_format(data)
+                    if num_channels:
+                        return num_channels
+                if frames.SYNC in data:
+                    num_channels = frames.sniff_frame_format(data, MIN_SNIFF_LINES)
+                    if num_channels:
+                        return num_channels
+
+            return sniff_line_format(data) or frames.sniff_frame_format(
+                data, MIN_SNIFF_LINES
+            )
+    except (SerialException, OSError, ValueError):
+        # busy, gone or not a serial port at all
+        return None
+
+
+def discover_boards(
+    baud_rate: int,
+    extra_ports: list[str] | None = None,
+    refresh: bool = False,
+    timeout: float = PROBE_TIMEOUT,
+    cache_path: str | None = None,
+) -> list[DiscoveredBoard]:
+    """find every board connected to a serial port.
+
+    USB devices that have been seen before are recognised by their fingerprint without being opened, every other
+    port is probed at the same time as the rest. `refresh` probes known devices again
+    """
+    cache = load_cache(cache_path)
+    candidates = [
+        (port_info.device, get_fingerprint(port_info), port_info.description)
+        for port_info in list_ports.comports()
+    ]
+    listed = {port for port, _, _ in candidates}
+    candidates += [(port, None, "") for port in extra_ports or [] if port not in listed]
+
+    boards = []
+    to_probe = []
+    for port, fingerprint, description in candidates:
+        if fingerprint in cache and not refresh:
+            known = cache[fingerprint]
+            boards.append(
+                DiscoveredBoard(
+                    port,
+                    known["num_channels"],
+                    fingerprint,
+                    description,
+                    known.get("name"),
+                    cached=True,
+                )
+            )
+        else:
+            to_probe.append((port, fingerprint, description))
+
+    if to_probe:
+        cache_changed = False
+        with ThreadPoolExecutor(max_workers=len(to_probe)) as executor:
+            channel_counts = list(
+                executor.map(
+                    lambda candidate: probe_port(candidate[0], baud_rate, timeout),
+                    to_probe,
+                )
+            )
+
+        for (port, fingerprint, description), num_channels in zip(
+            to_probe, channel_counts
+        ):
+            if not num_channels:
+                continue
+
+            name = cache.get(fingerprint, {}).get("name") if fingerprint else None
+            boards.append(
+                DiscoveredBoard(port, num_channels, fingerprint, description, name)
+            )
+            if fingerprint:
+                cache[fingerprint] = {
+                    **cache.get(fingerprint, {}),
+                    "num_channels": num_channels,
+                    "description": description,
+                }
+                cache_changed = True
+
+        if cache_changed:
+            save_cache(cache, cache_path)
+
+    return sorted(boards, key=lambda board: board.port)
+
+
+def remember_board_name(
+    board: DiscoveredBoard, name: str, cache_path: str | None = None
+) -> None:
+    """record what the board was used as, so that it can be picked for that again next time"""
+    if not board.fingerprint:
+        return
+
+    cache = load_cache(cache_path)
+    cache[board.fingerprint] = {
+        **cache.get(board.fingerprint, {}),
+        "num_channels": board.num_channels,
+        "description": board.description,
+        "name": name,
+    }
+    save_cache(cache, cache_path)
@@ -0,0 +1,65 @@
+import json, os
+
+# the answers Config.prompt returns, which is everything a preset has to hold
+PRESET_KEYS = (
+    "baud_rate",
+    "pt_configs",
+    "num_readings_per_pt",
+    "tolerance",
+    "min_readings_per_pt",
+    "continuous",
+    "lookback",
+)
+# answers added since presets were introduced, older presets use the defaults
+OPTIONAL_PRESET_KEYS = ("averaging", "fit", "aligned", "settle_window")
+
+
+def get_config_dir() -> str:
+    """the user's config directory, so that saved settings work from any checkout"""
+    config_dir = os.environ.get("XDG_CONFIG_HOME") or os.environ.get("APPDATA")
+    if not config_dir:
+        config_dir = os.path.join(os.path.expanduser("~"), ".config")
+
+    return os.path.join(config_dir, "auto-cal")
+
+
+def get_presets_path() -> str:
+    return os.path.join(get_config_dir(), "presets.json")
+
+
+def load_presets(path: str | None = None) -> dict[str, dict]:
+    path = path or get_presets_path()
+    if not os.path.exists(path):
+        return {}
+
+    with open(path) as presets_file:
+        return json.load(presets_file)
+
+
+def load_preset(name: str, path: str | None = None) -> dict | None:
+    """the saved answers of a preset, or None if there is no preset with that name"""
+    preset = load_presets(path).get(name)
+    if preset is None:
+        return None
+
+    missing = [key for key in PRESET_KEYS if key not in preset]
+    if missing:
+        raise ValueError(f"Preset {name} is missing {', '.join(missing)}")
+
+    return preset
+
+
+def save_preset(name: str, answers: dict, path: str | None = None) -> None:
+    path = path or get_presets_path()
+    presets = load_presets(path)
+    presets[name] = {
+        key: answers[key]
+        for key in (*PRESET_KEYS, *OPTIONAL_PRESET_KEYS)
+        if key in answers
+    }
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # replace the file in one go, so other presets survive a crash while saving
+    with open(f"{path}.tmp", "w") as presets_file:
+        json.dump(presets, presets_file, indent=2)
+    os.replace(f"{path}.tmp", path)
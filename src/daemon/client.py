@@ -0,0 +1,165 @@
+import asyncio, json, socket
+from typing import Callable
+
+from daemon import protocol
+from headless import headless
+from serial_reader import serial_reader
+
+
+class RemotePort:
+    """Stands in for a port the daemon owns, the mirror readers never read from it themselves"""
+
+    def __init__(self, port: str, baud_rate: int):
+        self.port = port
+        self.baudrate = baud_rate
+        self.timeout = None
+        self.in_waiting = 0
+
+    def read(self, size: int = 1) -> bytes:
+        return b""
+
+    def readinto(self, buffer) -> int:
+        return 0
+
+    def reset_input_buffer(self) -> None:
+        pass
+
+    def close(self) -> None:
+        pass
+
+
+class DaemonClient:
+    """A viewer of an acquisition daemon.
+
+    Mirrors the daemon's readers: the samples, steps and metrics it sends are put into readers of the same boards,
+    so the UI can show them as if it were reading the ports itself. Steps and calibrations are asked of the daemon,
+    and the results arrive for every viewer through the callbacks
+    """
+
+    # the samples keep coming in whether or not a step is being taken
+    continuous = True
+
+    def __init__(self, socket_path: str):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(socket_path)
+
+        message_type, payload = protocol.receive_message(self.sock)
+        if message_type != protocol.HELLO:
+            raise ConnectionError(f"Expected a hello from the daemon on {socket_path}")
+        hello = json.loads(payload)
+
+        self.config = hello["config"]
+        self.readers = headless.create_readers(
+            self.config,
+            ports=[
+                RemotePort(reader["port"], int(self.config["baud_rate"]))
+                for reader in hello["readers"]
+            ],
+        )
+        self.readers_by_id = {reader.get_pt_id(): reader for reader in self.readers}
+        self.num_sensors = [reader.get_num_pts() for reader in self.readers]
+        # the steps taken before this viewer attached
+        for reader, steps in zip(self.readers, hello["steps"]):
+            for step in steps:
+                reader.store.record_step(
+                    step["pressure"],
+                    step["avgs"],
+                    step["stds"],
+                    step["num_rejected"],
+                    step["settled"],
+                )
+
+        self.progress = [0.0] * len(self.readers)
+        self.writer: asyncio.StreamWriter | None = None
+        # set while this viewer waits for the step it asked for
+        self.step_done: asyncio.Future | None = None
+
+        self.on_progress: Callable[[serial_reader.SerialReader, int], None] | None = (
+            None
+        )
+        # (reader, pressure, averages) of every step, whichever viewer asked for it
+        self.on_step: (
+            Callable[[serial_reader.SerialReader, float, list[float]], None] | None
+        ) = None
+        self.on_calibrated: Callable[[], None] | None = None
+        self.on_error: Callable[[str], None] | None = None
+
+    def get_step_progress(self, reader: serial_reader.SerialReader) -> float:
+        return self.progress[self.readers.index(reader)]
+
+    def send_command(self, command: dict) -> None:
+        if self.writer is None:
+            raise ConnectionError("Not receiving from the daemon yet")
+
+        self.writer.write(protocol.encode_json(protocol.COMMAND, command))
+
+    async def take_step(self, pressure: float) -> None:
+        """ask the daemon for a step at the pressure, and wait for its results (or for it to fail)"""
+        self.step_done = asyncio.get_running_loop().create_future()
+        self.send_command({"command": protocol.STEP_COMMAND, "pressure": pressure})
+        try:
+            await self.step_done
+        finally:
+            self.step_done = None
+
+    def calibrate(self) -> None:
+        self.send_command({"command": protocol.CALIBRATE_COMMAND})
+
+    def _finish_step(self) -> None:
+        if self.step_done and not self.step_done.done():
+            self.step_done.set_result(None)
+
+    def handle_message(self, message_type: int, payload: bytes) -> None:
+        if message_type == protocol.SAMPLES:
+            reader_index, timestamps, rows = protocol.decode_samples(
+                payload, self.num_sensors
+            )
+            self.readers[reader_index].history.append(rows, timestamps)
+        elif message_type == protocol.PROGRESS:
+            for reader_index, fraction in protocol.decode_progress(payload):
+                self.progress[reader_index] = fraction
+                if self.on_progress:
+                    self.on_progress(self.readers[reader_index], 0)
+        elif message_type == protocol.STEP:
+            reader_index, _, pressure, settled, avgs, stds, num_rejected = (
+                protocol.decode_step(payload, self.num_sensors)
+            )
+            reader = self.readers[reader_index]
+            reader.store.record_step(pressure, avgs, stds, num_rejected, settled)
+            self.progress[reader_index] = 0.0
+            if self.on_step:
+                self.on_step(reader, pressure, avgs.tolist())
+            # the daemon sends the readers' steps in order
+            if reader_index == len(self.readers) - 1:
+                self._finish_step()
+        elif message_type == protocol.METRICS:
+            for reader_id, snapshot in json.loads(payload).items():
+                self.readers_by_id[reader_id].metrics.load_snapshot(snapshot)
+        elif message_type == protocol.CALIBRATED:
+            if self.on_calibrated:
+                self.on_calibrated()
+        elif message_type == protocol.ERROR:
+            error = json.loads(payload)
+            if error["command"] == protocol.STEP_COMMAND:
+                self._finish_step()
+            if self.on_error:
+                self.on_error(error["message"])
+
+    async def run_continuous(self) -> None:
+        """receive from the daemon until it goes away"""
+        stream, self.writer = await asyncio.open_unix_connection(sock=self.sock)
+        try:
+            while True:
+                try:
+                    message_type, payload = await protocol.read_message(stream)
+                except asyncio.IncompleteReadError:
+                    raise ConnectionError("The daemon closed the connection")
+                self.handle_message(message_type, payload)
+        finally:
+            self._finish_step()
+            self.writer.close()
+            self.writer = None
+
+    def close(self) -> None:
+        if self.writer is None:
+            self.sock.close()
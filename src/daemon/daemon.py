@@ -0,0 +1,347 @@
+"""
+A long running acquisition service. The daemon owns every port in its config and samples them continuously, whoever
+is watching. Viewers (the UI started with --attach, also when it is served in a browser with textual-serve) connect
+to its Unix domain socket and are sent the samples, the progress and results of every step and the port metrics, see
+daemon.protocol. Any viewer can ask for a step or a calibration, and every viewer sees it happen.
+
+New samples are picked up from each reader's history a few times a second and encoded once for all viewers, so
+the serial side does the same work however many viewers there are. A viewer that can't keep up misses samples,
+progress and metrics rather than holding the others up, but is always sent every step
+"""
+
+import asyncio, json, os, signal, socket, sqlite3
+
+from daemon import protocol
+from headless import headless
+from history import history
+from serial_reader import serial_reader, metrics
+from session import session
+
+# how many times a second new samples and step progress are sent to the viewers
+BROADCAST_RATE = 20
+# seconds between metrics snapshots
+METRICS_INTERVAL = 1.0
+# bytes a viewer may have waiting to be sent before it misses samples, progress and metrics
+MAX_VIEWER_BACKLOG = 1 << 20
+
+
+def describe_steps(reader: serial_reader.SerialReader) -> list[dict]:
+    """every step the reader has taken, for viewers that attach part way through a calibration"""
+    return [
+        {
+            "pressure": float(pressure),
+            "avgs": avgs.tolist(),
+            "stds": stds.tolist(),
+            "num_rejected": num_rejected.tolist(),
+            "settled": bool(settled),
+        }
+        for pressure, avgs, stds, num_rejected, settled in zip(
+            reader.store.get_pressures(),
+            reader.store.get_avgs(),
+            reader.store.get_stds(),
+            reader.store.get_num_rejected(),
+            reader.store.get_settled(),
+        )
+    ]
+
+
+def remove_stale_socket(socket_path: str) -> None:
+    """remove the socket left behind by a daemon that didn't shut down cleanly, but not one that is still running"""
+    if not os.path.exists(socket_path):
+        return
+
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        probe.connect(socket_path)
+    except ConnectionRefusedError:
+        os.unlink(socket_path)
+        return
+    finally:
+        probe.close()
+
+    raise RuntimeError(f"A daemon is already listening on {socket_path}")
+
+
+class AcquisitionDaemon:
+    def __init__(
+        self,
+        config: dict,
+        socket_path: str,
+        session_path: str | None = None,
+        metrics_path: str | None = None,
+    ):
+        self.config = config
+        self.socket_path = socket_path
+        self.session_path = session_path
+        self.readers = headless.create_readers(config)
+        # samples have to keep coming in for the viewers to see them, so steps are always taken from the history
+        self.engine = headless.create_engine(
+            {**config, "continuous": True}, self.readers
+        )
+
+        self.session_writer = None
+        if session_path:
+            self.session_writer = session.SessionWriter(
+                session_path,
+                [session.describe_reader(reader) for reader in self.readers],
+                config,
+            )
+            self.session_writer.restore(self.readers)
+
+        self.metrics_exporter = None
+        if metrics_path:
+            self.metrics_exporter = metrics.MetricsExporter(self.readers, metrics_path)
+
+        self.viewers: set[asyncio.StreamWriter] = set()
+        # where each reader's history was last sent up to
+        self.next_indexes = [0] * len(self.readers)
+        # the step being taken, one at a time whichever viewer asks for it
+        self.step_task: asyncio.Task | None = None
+        # every calibration of this run replaces the run's previous one in the calibration history
+        self.history_calibration_id: int | None = None
+
+    def _send(self, viewer: asyncio.StreamWriter, message: bytes) -> None:
+        if not viewer.is_closing():
+            viewer.write(message)
+
+    def broadcast(self, message: bytes, droppable: bool = False) -> None:
+        """send a message to every viewer. Droppable messages are skipped for viewers that are falling behind"""
+        for viewer in self.viewers:
+            if (
+                droppable
+                and viewer.transport.get_write_buffer_size() > MAX_VIEWER_BACKLOG
+            ):
+                continue
+            self._send(viewer, message)
+
+    def broadcast_error(self, command: str, message: str) -> None:
+        self.broadcast(
+            protocol.encode_json(
+                protocol.ERROR, {"command": command, "message": message}
+            )
+        )
+
+    def is_stepping(self) -> bool:
+        return self.step_task is not None and not self.step_task.done()
+
+    def get_hello(self) -> dict:
+        return {
+            "config": self.config,
+            "readers": [session.describe_reader(reader) for reader in self.readers],
+            "steps": [describe_steps(reader) for reader in self.readers],
+        }
+
+    def send_new_samples(self) -> None:
+        for reader_index, reader in enumerate(self.readers):
+            timestamps, rows = reader.history.get_range(self.next_indexes[reader_index])
+            self.next_indexes[reader_index] = reader.history.total
+            if len(rows) > 0 and self.viewers:
+                self.broadcast(
+                    protocol.encode_samples(reader_index, timestamps, rows),
+                    droppable=True,
+                )
+
+        if self.is_stepping() and self.viewers:
+            self.broadcast(
+                protocol.encode_progress(
+                    [self.engine.get_step_progress(reader) for reader in self.readers]
+                ),
+                droppable=True,
+            )
+
+    def send_metrics(self) -> None:
+        if self.viewers:
+            self.broadcast(
+                protocol.encode_json(
+                    protocol.METRICS,
+                    {
+                        reader.get_pt_id(): reader.metrics.snapshot()
+                        for reader in self.readers
+                    },
+                ),
+                droppable=True,
+            )
+
+    async def take_step(self, pressure: float) -> None:
+        """read a step from every port and send its results to every viewer"""
+        try:
+            await self.engine.read_all_steps()
+            for reader in self.readers:
+                reader.ready_for_avg()
+        except Exception as e:
+            self.broadcast_error(protocol.STEP_COMMAND, str(e))
+            return
+
+        for reader_index, reader in enumerate(self.readers):
+            avgs, stds = reader.store.finish_step(pressure)
+            if self.session_writer:
+                self.session_writer.write_reader_step(reader)
+            self.broadcast(
+                protocol.encode_step(
+                    reader_index,
+                    reader.store.num_steps - 1,
+                    pressure,
+                    avgs,
+                    stds,
+                    reader.store.get_num_rejected()[-1],
+                    reader.store.get_settled()[-1],
+                )
+            )
+
+    def calibrate(self) -> None:
+        """fit every reader's steps and record the fits, the viewers then show them"""
+        fitted = []
+        for reader in self.readers:
+            try:
+                fit = reader.get_linear_fit()
+            except ValueError:
+                continue
+            fitted.append((reader.serial.port, reader.get_pt_name(), fit))
+            if self.session_writer:
+                self.session_writer.write_fit(reader.get_pt_id(), fit)
+
+        if not fitted:
+            self.broadcast_error(
+                protocol.CALIBRATE_COMMAND, "Take readings at 2 pressures first"
+            )
+            return
+
+        try:
+            self.history_calibration_id = headless.record_history(
+                self.config,
+                fitted,
+                self.session_path,
+                history.INTERACTIVE,
+                self.history_calibration_id,
+            )
+        except (sqlite3.Error, OSError) as e:
+            # the calibration itself is still in the session
+            self.broadcast_error(
+                protocol.CALIBRATE_COMMAND,
+                f"Couldn't save the calibration to the history: {e}",
+            )
+        self.broadcast(protocol.encode(protocol.CALIBRATED, b""))
+
+    def handle_command(self, viewer: asyncio.StreamWriter, payload: bytes) -> None:
+        name = None
+        try:
+            command = json.loads(payload)
+            name = command.get("command")
+            if name == protocol.STEP_COMMAND:
+                pressure = float(command["pressure"])
+        except (ValueError, KeyError, TypeError, AttributeError) as e:
+            # a broken command only fails itself, the viewer stays connected
+            error = f"Malformed command: {e!r}"
+        else:
+            if name == protocol.STEP_COMMAND:
+                if self.is_stepping():
+                    error = "Wait for the current step to finish"
+                else:
+                    self.step_task = asyncio.ensure_future(self.take_step(pressure))
+                    return
+            elif name == protocol.CALIBRATE_COMMAND:
+                if self.is_stepping():
+                    error = "Wait for the current step to finish before calibrating"
+                else:
+                    self.calibrate()
+                    return
+            else:
+                error = f"Unknown command {name}"
+
+        # only the viewer that asked needs to know
+        self._send(
+            viewer,
+            protocol.encode_json(protocol.ERROR, {"command": name, "message": error}),
+        )
+
+    async def serve_viewer(
+        self, stream: asyncio.StreamReader, viewer: asyncio.StreamWriter
+    ) -> None:
+        viewer.write(protocol.encode_json(protocol.HELLO, self.get_hello()))
+        self.viewers.add(viewer)
+        try:
+            while True:
+                message_type, payload = await protocol.read_message(stream)
+                if message_type == protocol.COMMAND:
+                    self.handle_command(viewer, payload)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            # the viewer went away
+            pass
+        finally:
+            self.viewers.discard(viewer)
+            viewer.close()
+
+    async def _broadcast_samples(self) -> None:
+        while True:
+            await asyncio.sleep(1 / BROADCAST_RATE)
+            self.send_new_samples()
+
+    async def _broadcast_metrics(self) -> None:
+        while True:
+            await asyncio.sleep(METRICS_INTERVAL)
+            self.send_metrics()
+
+    async def serve(self) -> None:
+        """sample every port and serve viewers until cancelled"""
+        remove_stale_socket(self.socket_path)
+        server = await asyncio.start_unix_server(
+            self.serve_viewer, path=self.socket_path
+        )
+        background_tasks = [
+            asyncio.ensure_future(self.engine.run_continuous()),
+            asyncio.ensure_future(self._broadcast_samples()),
+            asyncio.ensure_future(self._broadcast_metrics()),
+        ]
+        if self.metrics_exporter:
+            background_tasks.append(asyncio.ensure_future(self.metrics_exporter.run()))
+
+        # stop cleanly when terminated, e.g. by a service manager
+        terminated = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        loop.add_signal_handler(signal.SIGTERM, terminated.set)
+        stopping = asyncio.ensure_future(terminated.wait())
+        try:
+            # sampling only stops if a port fails
+            await asyncio.wait(
+                (background_tasks[0], stopping), return_when=asyncio.FIRST_COMPLETED
+            )
+            if background_tasks[0].done():
+                background_tasks[0].result()
+        finally:
+            loop.remove_signal_handler(signal.SIGTERM)
+            server.close()
+            for viewer in self.viewers:
+                viewer.close()
+            tasks = [*background_tasks, stopping]
+            if self.step_task:
+                tasks.append(self.step_task)
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            if os.path.exists(self.socket_path):
+                os.unlink(self.socket_path)
+
+    def close(self) -> None:
+        if self.session_writer:
+            self.session_writer.close()
+
+
+def run(
+    config_path: str,
+    socket_path: str,
+    session_path: str | None = None,
+    metrics_path: str | None = None,
+    capture_prefix: str | None = None,
+) -> None:
+    """run the daemon for the boards in a headless config until interrupted. See headless.apply_capture_options for
+    recording every port's bytes
+    """
+    config = headless.load_config(config_path)
+    headless.apply_capture_options(config, [], capture_prefix)
+    acquisition_daemon = AcquisitionDaemon(
+        config, socket_path, session_path, metrics_path
+    )
+    try:
+        asyncio.run(acquisition_daemon.serve())
+    finally:
+        acquisition_daemon.close()
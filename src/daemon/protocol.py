@@ -0,0 +1,156 @@
+"""
+The messages between the acquisition daemon and its viewers over the daemon's Unix domain socket. Every message is
+
+    type        uint8, one of the message types below
+    length      uint32, bytes of payload that follow
+    payload
+
+all little endian. Samples, progress and step results are packed numpy arrays so that they cost next to nothing to
+encode once and send to every viewer. Messages that are rare (the hello, commands, metrics and errors) are JSON.
+
+    HELLO       the daemon's config, its readers and every step taken so far, sent to a viewer as it attaches
+    SAMPLES     new samples of one reader
+    PROGRESS    how far through the current step every reader is
+    STEP        the results of one reader's step, sent to every viewer whoever asked for the step
+    METRICS     every reader's metrics snapshot, by reader id
+    CALIBRATED  the steps have been fit and the fits recorded
+    ERROR       a step or calibration failed, {"command": ..., "message": ...}
+    COMMAND     from a viewer, {"command": "step", "pressure": p} or {"command": "calibrate"}
+"""
+
+import asyncio, json, socket, struct
+
+import numpy as np
+
+HEADER = struct.Struct("<BI")
+
+# daemon -> viewer
+HELLO = 1
+SAMPLES = 2
+PROGRESS = 3
+STEP = 4
+METRICS = 5
+CALIBRATED = 6
+ERROR = 7
+# viewer -> daemon
+COMMAND = 8
+
+# commands
+STEP_COMMAND = "step"
+CALIBRATE_COMMAND = "calibrate"
+
+SAMPLES_HEADER = struct.Struct("<HI")
+PROGRESS_ENTRY = struct.Struct("<Hf")
+STEP_HEADER = struct.Struct("<HId?")
+
+
+def encode(message_type: int, payload: bytes) -> bytes:
+    return HEADER.pack(message_type, len(payload)) + payload
+
+
+def encode_json(message_type: int, value) -> bytes:
+    return encode(message_type, json.dumps(value).encode())
+
+
+def encode_samples(
+    reader_index: int, timestamps: np.ndarray, rows: np.ndarray
+) -> bytes:
+    """a batch of samples of one reader: float64 timestamps, then the float64 rows"""
+    return encode(
+        SAMPLES,
+        SAMPLES_HEADER.pack(reader_index, len(rows))
+        + np.ascontiguousarray(timestamps, dtype="<f8").tobytes()
+        + np.ascontiguousarray(rows, dtype="<f8").tobytes(),
+    )
+
+
+def decode_samples(
+    payload: bytes, num_sensors: list[int]
+) -> tuple[int, np.ndarray, np.ndarray]:
+    """(reader index, timestamps, rows)"""
+    reader_index, num_rows = SAMPLES_HEADER.unpack_from(payload)
+    timestamps = np.frombuffer(
+        payload, dtype="<f8", count=num_rows, offset=SAMPLES_HEADER.size
+    )
+    rows = np.frombuffer(
+        payload,
+        dtype="<f8",
+        count=num_rows * num_sensors[reader_index],
+        offset=SAMPLES_HEADER.size + timestamps.nbytes,
+    ).reshape(num_rows, num_sensors[reader_index])
+    return reader_index, timestamps, rows
+
+
+def encode_progress(progress: list[float]) -> bytes:
+    """how far through the current step every reader is"""
+    return encode(
+        PROGRESS,
+        b"".join(
+            PROGRESS_ENTRY.pack(reader_index, fraction)
+            for reader_index, fraction in enumerate(progress)
+        ),
+    )
+
+
+def decode_progress(payload: bytes) -> list[tuple[int, float]]:
+    return list(PROGRESS_ENTRY.iter_unpack(payload))
+
+
+def encode_step(
+    reader_index: int,
+    step: int,
+    pressure: float,
+    avgs: np.ndarray,
+    stds: np.ndarray,
+    num_rejected: np.ndarray,
+    settled: bool = True,
+) -> bytes:
+    """the results of one reader's step: float64 averages and standard deviations, then int64 rejected samples"""
+    return encode(
+        STEP,
+        STEP_HEADER.pack(reader_index, step, pressure, settled)
+        + np.ascontiguousarray(avgs, dtype="<f8").tobytes()
+        + np.ascontiguousarray(stds, dtype="<f8").tobytes()
+        + np.ascontiguousarray(num_rejected, dtype="<i8").tobytes(),
+    )
+
+
+def decode_step(
+    payload: bytes, num_sensors: list[int]
+) -> tuple[int, int, float, bool, np.ndarray, np.ndarray, np.ndarray]:
+    """(reader index, step, pressure, whether it settled, averages, standard deviations, rejected samples)"""
+    reader_index, step, pressure, settled = STEP_HEADER.unpack_from(payload)
+    count = num_sensors[reader_index]
+    arrays = [
+        np.frombuffer(
+            payload,
+            dtype=dtype,
+            count=count,
+            offset=STEP_HEADER.size + 8 * index * count,
+        )
+        for index, dtype in enumerate(("<f8", "<f8", "<i8"))
+    ]
+    return reader_index, step, pressure, settled, *arrays
+
+
+async def read_message(stream: asyncio.StreamReader) -> tuple[int, bytes]:
+    """the next (type, payload), raises asyncio.IncompleteReadError once the other end has gone"""
+    message_type, length = HEADER.unpack(await stream.readexactly(HEADER.size))
+    return message_type, await stream.readexactly(length)
+
+
+def _receive_exactly(sock: socket.socket, num_bytes: int) -> bytes:
+    data = bytearray()
+    while len(data) < num_bytes:
+        chunk = sock.recv(num_bytes - len(data))
+        if not chunk:
+            raise ConnectionError("The daemon closed the connection")
+        data += chunk
+
+    return bytes(data)
+
+
+def receive_message(sock: socket.socket) -> tuple[int, bytes]:
+    """read_message for a blocking socket, before there is an event loop to read it on"""
+    message_type, length = HEADER.unpack(_receive_exactly(sock, HEADER.size))
+    return message_type, _receive_exactly(sock, length)
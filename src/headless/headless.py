@@ -0,0 +1,334 @@
+import asyncio, json, math, time
+from typing import Callable
+
+from cal import cal, models, robust
+from history import history
+from serial_reader import (
+    serial_reader,
+    acquisition,
+    capture,
+    convergence,
+    frames,
+    metrics,
+)
+from profiling import profiler
+from session import session
+
+
+def load_config(path: str) -> dict:
+    """
+    Load a headless run config from a JSON file, e.g.
+
+        {
+            "baud_rate": 115200,
+            "num_readings_per_pt": 50,
+            "boards": [{"name": "High Voltage", "port": "/dev/ttyUSB0", "pt_count": 8}]
+        }
+
+    Optional keys: tolerance, min_readings_per_pt, settle_window (seconds of samples the drift of a step is judged
+    over when there is a tolerance), continuous, lookback, aligned (take every step from the same
+    window of time on every port, see serial_reader.alignment), timeout, averaging (one of
+    cal.robust.AVERAGING_METHODS), fit (one of cal.robust.FIT_METHODS), model_selection (one of
+    cal.models.CRITERIA) and replay_speed (how many times faster than recorded to replay, inf for as fast as
+    possible), and history (false to leave the run out of the calibration history, or the path of a history
+    database to add it to instead of the default). Boards can also have a capture file to record the port's bytes to,
+    a replay file to read them from instead of the port, and a protocol (one of serial_reader.frames.PROTOCOLS,
+    detected by default)
+    """
+    with open(path) as config_file:
+        config = json.load(config_file)
+
+    for key in ("baud_rate", "num_readings_per_pt", "boards"):
+        if key not in config:
+            raise ValueError(f"Config {path} is missing '{key}'")
+
+    for board in config["boards"]:
+        for key in ("name", "port", "pt_count"):
+            if key not in board:
+                raise ValueError(f"Board {board} in {path} is missing '{key}'")
+
+    return config
+
+
+def load_schedule(path: str) -> list[tuple[float, float]]:
+    """
+    Load a pressure schedule from a JSON list. Each entry is a pressure, or {"pressure": p, "dwell": s} to wait
+    s seconds for the rig to reach the pressure before taking readings. Returns a list of (pressure, dwell)
+    """
+    with open(path) as schedule_file:
+        entries = json.load(schedule_file)
+
+    schedule = []
+    for entry in entries:
+        if isinstance(entry, dict):
+            schedule.append((float(entry["pressure"]), float(entry.get("dwell", 0))))
+        else:
+            schedule.append((float(entry), 0.0))
+
+    if len(schedule) < 2:
+        raise ValueError("At least 2 pressures are required for a calibration")
+
+    return schedule
+
+
+def apply_capture_options(
+    config: dict,
+    schedule: list[tuple[float, float]],
+    capture_prefix: str | None = None,
+    replay_prefix: str | None = None,
+    replay_speed: float = 1.0,
+) -> list[tuple[float, float]]:
+    """record every board's bytes to <capture_prefix>-<board id>.cap, or replay them from
+    <replay_prefix>-<board id>.cap. Returns the schedule to run, without any dwells when replaying as fast as possible
+    """
+    for board in config["boards"]:
+        board_id = serial_reader.make_id(board["name"])
+        if capture_prefix:
+            board["capture"] = f"{capture_prefix}-{board_id}.cap"
+        if replay_prefix:
+            board["replay"] = f"{replay_prefix}-{board_id}.cap"
+    if replay_prefix:
+        config["replay_speed"] = replay_speed
+
+    replaying = any("replay" in board for board in config["boards"])
+    if replaying and math.isinf(config.get("replay_speed", 1.0)):
+        # a step's bytes are all there as soon as it starts, there is nothing to wait for
+        return [(pressure, 0.0) for pressure, _ in schedule]
+
+    return schedule
+
+
+def create_readers(
+    config: dict, ports: list | None = None
+) -> list[serial_reader.SerialReader]:
+    """a reader per board, reading the given stand-ins for the boards' ports if there are any"""
+    criteria = None
+    if config.get("tolerance", 0) > 0:
+        criteria = convergence.ConvergenceCriteria(
+            config["tolerance"],
+            config.get("min_readings_per_pt", 5),
+            config["num_readings_per_pt"],
+            config.get("settle_window", convergence.DEFAULT_SETTLE_WINDOW),
+        )
+
+    return [
+        serial_reader.SerialReader(
+            serial_port=board["port"],
+            baud_rate=int(config["baud_rate"]),
+            num_sensors=int(board["pt_count"]),
+            num_readings_per_pt=int(config["num_readings_per_pt"]),
+            name=board["name"],
+            criteria=criteria,
+            averaging=config.get("averaging", robust.MEAN),
+            fit_method=config.get("fit", robust.LEAST_SQUARES),
+            model_selection=config.get("model_selection", models.AICC),
+            port=(
+                ports[board_no]
+                if ports
+                else (
+                    capture.ReplayPort(board["replay"], config.get("replay_speed", 1.0))
+                    if "replay" in board
+                    else None
+                )
+            ),
+            capture_path=None if ports else board.get("capture"),
+            protocol=board.get("protocol", frames.AUTO),
+        )
+        for board_no, board in enumerate(config["boards"])
+    ]
+
+
+@profiler.traced
+async def run_calibration(
+    engine: acquisition.AcquisitionEngine,
+    schedule: list[tuple[float, float]],
+    on_step_start: Callable[[float], None] | None = None,
+    session_writer: session.SessionWriter | None = None,
+    metrics_exporter: metrics.MetricsExporter | None = None,
+) -> list[float]:
+    """take a step at every pressure in the schedule, returns how long each step took to read"""
+    background_tasks = []
+    if engine.continuous:
+        background_tasks.append(asyncio.ensure_future(engine.run_continuous()))
+    if metrics_exporter:
+        background_tasks.append(asyncio.ensure_future(metrics_exporter.run()))
+
+    step_latencies = []
+    try:
+        for pressure, dwell in schedule:
+            if on_step_start:
+                on_step_start(pressure)
+            if dwell > 0:
+                await asyncio.sleep(dwell)
+
+            step_started_at = time.perf_counter()
+            await engine.read_all_steps()
+            step_latencies.append(time.perf_counter() - step_started_at)
+
+            for reader in engine.readers:
+                reader.ready_for_avg()
+                reader.calculate_avg(pressure)
+                if session_writer:
+                    session_writer.write_reader_step(reader)
+    finally:
+        for task in background_tasks:
+            task.cancel()
+        # let the tasks finish up, e.g. the final metrics export
+        await asyncio.gather(*background_tasks, return_exceptions=True)
+
+    return step_latencies
+
+
+def build_results(readers: list[serial_reader.SerialReader]) -> dict:
+    """collect the step averages and the fitted calibration of every reader"""
+    results = {"boards": []}
+    for reader in readers:
+        board = {
+            "name": reader.get_pt_name(),
+            "port": reader.serial.port,
+            "pressures": reader.store.get_pressures().tolist(),
+            "averages": reader.store.get_avgs().tolist(),
+            "stds": reader.store.get_stds().tolist(),
+            "rejected_samples": reader.store.get_num_rejected().tolist(),
+            # steps taken before the signal had settled
+            "unsettled_steps": [
+                step
+                for step, settled in enumerate(reader.store.get_settled().tolist())
+                if not settled
+            ],
+            "rejected_lines": reader.rejected_lines,
+            "dropped_frames": reader.metrics.dropped_frames,
+        }
+        try:
+            board["fit"] = reader.get_linear_fit().to_dict()
+            board["models"] = reader.get_model_fit().to_dict()
+        except ValueError as e:
+            board["error"] = str(e)
+
+        results["boards"].append(board)
+
+    return results
+
+
+def record_history(
+    config: dict,
+    boards: list[tuple[str, str, cal.LinearFit]],
+    session_path: str | None,
+    source: str = history.HEADLESS,
+    calibration_id: int | None = None,
+) -> int | None:
+    """add the fit of every board, as (port, name, fit), to the calibration history, replacing an earlier
+    calibration if given its id. Replays are left out, they would count the same calibration twice. Returns the
+    calibration's id, None if it was left out
+    """
+    history_path = config.get("history")
+    if history_path is False or any("replay" in board for board in config["boards"]):
+        return None
+
+    calibration_history = history.CalibrationHistory(history_path)
+    try:
+        return calibration_history.record_calibration(
+            [
+                (history.get_board_key(port, name), name, fit)
+                for port, name, fit in boards
+            ],
+            source,
+            session_path,
+            calibration_id,
+        )
+    finally:
+        calibration_history.close()
+
+
+def create_engine(
+    config: dict, readers: list[serial_reader.SerialReader]
+) -> acquisition.AcquisitionEngine:
+    return acquisition.AcquisitionEngine(
+        readers,
+        timeout=config.get("timeout"),
+        continuous=config.get("continuous", False),
+        lookback=config.get("lookback", 0),
+        aligned=config.get("aligned", False),
+    )
+
+
+def write_results(results: dict, output_path: str | None) -> None:
+    if output_path:
+        with open(output_path, "w") as output_file:
+            json.dump(results, output_file, indent=2)
+    else:
+        print(json.dumps(results, indent=2))
+
+
+def run(
+    config_path: str,
+    schedule_path: str,
+    output_path: str | None,
+    session_path: str | None = None,
+    metrics_path: str | None = None,
+    capture_prefix: str | None = None,
+    replay_prefix: str | None = None,
+    replay_speed: float = 1.0,
+) -> dict:
+    """run a whole calibration without any prompts or UI, writing the results as JSON.
+    With a session, every step is recorded as it finishes and an interrupted session picks up where it left off.
+    With a metrics path, the metrics of every port are written to it periodically while the calibration runs.
+    See apply_capture_options for capturing and replaying the bytes of every port
+    """
+    config = load_config(config_path)
+    schedule = apply_capture_options(
+        config,
+        load_schedule(schedule_path),
+        capture_prefix,
+        replay_prefix,
+        replay_speed,
+    )
+    readers = create_readers(config)
+    engine = create_engine(config, readers)
+
+    session_writer = None
+    num_completed_steps = 0
+    if session_path:
+        session_writer = session.SessionWriter(
+            session_path,
+            [session.describe_reader(reader) for reader in readers],
+            config,
+        )
+        num_completed_steps = session_writer.restore(readers)
+
+    started_at = time.perf_counter()
+    try:
+        metrics_exporter = None
+        if metrics_path:
+            metrics_exporter = metrics.MetricsExporter(readers, metrics_path)
+
+        step_latencies = asyncio.run(
+            run_calibration(
+                engine,
+                schedule[num_completed_steps:],
+                session_writer=session_writer,
+                metrics_exporter=metrics_exporter,
+            )
+        )
+
+        results = build_results(readers)
+        fitted = []
+        for reader in readers:
+            try:
+                fit = reader.get_linear_fit()
+            except ValueError:
+                continue
+            fitted.append((reader.serial.port, reader.get_pt_name(), fit))
+            if session_writer:
+                session_writer.write_fit(reader.get_pt_id(), fit)
+        record_history(config, fitted, session_path)
+    finally:
+        if session_writer:
+            session_writer.close()
+
+    results["step_latencies_s"] = step_latencies
+    results["step_skews"] = [skew.to_dict() for skew in engine.step_skews]
+    results["total_wall_time_s"] = time.perf_counter() - started_at
+
+    write_results(results, output_path)
+    return results
@@ -0,0 +1,417 @@
+import asyncio, multiprocessing, time
+from multiprocessing import connection, shared_memory
+from typing import Callable
+
+import numpy as np
+
+from cal import cal, models, robust
+from headless import headless
+from profiling import profiler
+from serial_reader import serial_reader, alignment, metrics
+from session import session
+
+# seconds a board process has to start up and open its port before the first step
+STARTUP_TIMEOUT = 60.0
+
+
+class SharedBoardArrays:
+    """The step results of one board, kept in a single shared memory block.
+
+    The worker process reading the board writes into it and the coordinator reads it directly, so samples and averages
+    never have to be pickled between processes
+    """
+
+    def __init__(
+        self,
+        num_steps: int,
+        num_sensors: int,
+        num_readings_per_pt: int,
+        name: str | None = None,
+    ):
+        layout = {
+            "avgs": ((num_steps, num_sensors), np.float64),
+            "stds": ((num_steps, num_sensors), np.float64),
+            "num_rejected": ((num_steps, num_sensors), np.int64),
+            "samples": ((num_steps, num_readings_per_pt, num_sensors), np.float64),
+            "timestamps": ((num_steps, num_readings_per_pt), np.float64),
+            "counts": ((num_steps,), np.int64),
+            "latencies": ((num_steps,), np.float64),
+            "settled": ((num_steps,), np.bool_),
+            "rejected_lines": ((1,), np.int64),
+            "dropped_frames": ((1,), np.int64),
+        }
+        size = sum(
+            int(np.prod(shape)) * np.dtype(dtype).itemsize
+            for shape, dtype in layout.values()
+        )
+
+        # the coordinator creates the block, workers attach to it by name
+        self.shm = shared_memory.SharedMemory(
+            name=name, create=name is None, size=max(1, size)
+        )
+        self.fields = []
+        offset = 0
+        for field, (shape, dtype) in layout.items():
+            setattr(
+                self,
+                field,
+                np.ndarray(shape, dtype=dtype, buffer=self.shm.buf, offset=offset),
+            )
+            self.fields.append(field)
+            offset += int(np.prod(shape)) * np.dtype(dtype).itemsize
+
+    def close(self) -> None:
+        # the views into the block have to go before it can be closed
+        for field in self.fields:
+            setattr(self, field, None)
+        self.shm.close()
+
+    def unlink(self) -> None:
+        self.shm.unlink()
+
+
+async def _run_board(
+    config: dict,
+    schedule: list[tuple[float, float]],
+    first_step: int,
+    arrays: SharedBoardArrays,
+    coordinator: connection.Connection,
+    metrics_path: str | None,
+) -> None:
+    reader = headless.create_readers(config)[0]
+    engine = headless.create_engine(config, [reader])
+    loop = asyncio.get_running_loop()
+
+    background_tasks = []
+    if engine.continuous:
+        background_tasks.append(asyncio.ensure_future(engine.run_continuous()))
+    if metrics_path:
+        # every board process writes its own metrics
+        exporter = metrics.MetricsExporter(
+            [reader], f"{metrics_path}-{reader.get_pt_id()}"
+        )
+        background_tasks.append(asyncio.ensure_future(exporter.run()))
+
+    try:
+        coordinator.send(None)
+        for step in range(first_step, len(schedule)):
+            pressure, _ = schedule[step]
+            # wait for the coordinator to bring the rig up to pressure, sampling in the meantime if continuous
+            await loop.run_in_executor(None, coordinator.recv)
+
+            step_started_at = time.perf_counter()
+            await engine.read_all_steps()
+            reader.ready_for_avg()
+
+            count = reader.store.count
+            arrays.samples[step, :count] = reader.store.get_step_readings()
+            arrays.timestamps[step, :count] = reader.store.get_step_timestamps()
+            arrays.counts[step] = count
+            arrays.avgs[step], arrays.stds[step] = reader.store.finish_step(pressure)
+            arrays.num_rejected[step] = reader.store.get_num_rejected()[-1]
+            arrays.settled[step] = reader.store.get_settled()[-1]
+            arrays.latencies[step] = time.perf_counter() - step_started_at
+            arrays.rejected_lines[0] = reader.rejected_lines
+            arrays.dropped_frames[0] = reader.metrics.dropped_frames
+
+            coordinator.send(None)
+    finally:
+        for task in background_tasks:
+            task.cancel()
+        await asyncio.gather(*background_tasks, return_exceptions=True)
+
+
+def _calibrate_board(
+    config: dict,
+    schedule: list[tuple[float, float]],
+    first_step: int,
+    shm_name: str,
+    coordinator: connection.Connection,
+    metrics_path: str | None,
+    profile_path: str | None,
+) -> None:
+    """worker process entry point, calibrates the single board in the config. It tells the coordinator when it is
+    ready and when it has finished each step by sending None, and why it failed by sending the error message
+    """
+    board = config["boards"][0]
+    if profile_path:
+        profiler.enable()
+
+    arrays = None
+    try:
+        arrays = SharedBoardArrays(
+            len(schedule),
+            int(board["pt_count"]),
+            int(config["num_readings_per_pt"]),
+            shm_name,
+        )
+        asyncio.run(
+            _run_board(config, schedule, first_step, arrays, coordinator, metrics_path)
+        )
+    except EOFError:
+        # the coordinator stopped the calibration, e.g. because another board failed
+        pass
+    except Exception as e:
+        try:
+            coordinator.send(str(e))
+        except OSError:
+            # the coordinator has already gone
+            pass
+    finally:
+        if arrays:
+            arrays.close()
+        coordinator.close()
+        if profile_path:
+            profiler.write(f"{profile_path}-{serial_reader.make_id(board['name'])}")
+
+
+def _wait_for_boards(
+    boards: list[dict],
+    processes: list[multiprocessing.Process],
+    connections: list[connection.Connection],
+    timeout: float | None = None,
+) -> None:
+    """wait for every board process to report that it is ready or has finished its step. Raises as soon as one of
+    them fails, or dies without saying why (e.g. killed for running out of memory), rather than waiting for it forever
+    """
+    pending = set(range(len(boards)))
+    while pending:
+        ready = connection.wait(
+            [connections[index] for index in pending]
+            + [processes[index].sentinel for index in pending],
+            timeout,
+        )
+        if not ready:
+            names = ", ".join(boards[index]["name"] for index in sorted(pending))
+            raise RuntimeError(f"Timed out after {timeout}s waiting for {names}")
+
+        for index in list(pending):
+            board_connection = connections[index]
+            if board_connection not in ready and processes[index].sentinel not in ready:
+                continue
+
+            try:
+                error = board_connection.recv()
+            except (EOFError, OSError):
+                processes[index].join()
+                raise RuntimeError(
+                    f"The process calibrating {boards[index]['name']} died (exit code {processes[index].exitcode})"
+                )
+            if error is not None:
+                raise RuntimeError(
+                    f"Calibrating {boards[index]['name']} failed: {error}"
+                )
+            pending.discard(index)
+
+
+def run(
+    config_path: str,
+    schedule_path: str,
+    output_path: str | None,
+    session_path: str | None = None,
+    metrics_path: str | None = None,
+    profile_path: str | None = None,
+    on_step_start: Callable[[float], None] | None = None,
+    capture_prefix: str | None = None,
+    replay_prefix: str | None = None,
+    replay_speed: float = 1.0,
+) -> dict:
+    """calibrate every board in the config in its own process, then fit all of them in one batched regression.
+    Each board's metrics and profile are written to <metrics_path>-<board id> and <profile_path>-<board id>
+    """
+    config = headless.load_config(config_path)
+    schedule = headless.apply_capture_options(
+        config,
+        headless.load_schedule(schedule_path),
+        capture_prefix,
+        replay_prefix,
+        replay_speed,
+    )
+    boards = config["boards"]
+    board_ids = [serial_reader.make_id(board["name"]) for board in boards]
+
+    context = multiprocessing.get_context("spawn")
+    all_arrays = [
+        SharedBoardArrays(
+            len(schedule), int(board["pt_count"]), int(config["num_readings_per_pt"])
+        )
+        for board in boards
+    ]
+
+    session_writer = None
+    first_step = 0
+    if session_path:
+        session_writer = session.SessionWriter(
+            session_path,
+            [
+                {
+                    "id": board_id,
+                    "name": board["name"],
+                    "num_sensors": int(board["pt_count"]),
+                    "port": board["port"],
+                }
+                for board_id, board in zip(board_ids, boards)
+            ],
+            config,
+        )
+        # the board processes only take the steps that are left, the results of the completed ones come from the
+        # session. Their samples and latencies aren't needed, and are left out of the per-step outputs
+        first_step = session_writer.restore([])
+        for board_id, arrays in zip(board_ids, all_arrays):
+            for step in session_writer.get_completed_steps(board_id):
+                arrays.avgs[step["step"]] = step["avgs"]
+                arrays.stds[step["step"]] = step["stds"]
+                arrays.num_rejected[step["step"]] = step.get("num_rejected", 0)
+                arrays.settled[step["step"]] = step.get("settled", True)
+
+    started_at = time.perf_counter()
+    try:
+        # a pipe to each board process, to start its steps and hear back when it has finished them
+        connections = []
+        processes = []
+        for board, arrays in zip(boards, all_arrays):
+            coordinator_connection, board_connection = context.Pipe()
+            connections.append(coordinator_connection)
+            processes.append(
+                context.Process(
+                    target=_calibrate_board,
+                    args=(
+                        {**config, "boards": [board]},
+                        schedule,
+                        first_step,
+                        arrays.shm.name,
+                        board_connection,
+                        metrics_path,
+                        profile_path,
+                    ),
+                    daemon=True,
+                )
+            )
+            processes[-1].start()
+            # only the board process keeps its end open, so the pipe closes if the process dies
+            board_connection.close()
+
+        try:
+            _wait_for_boards(boards, processes, connections, STARTUP_TIMEOUT)
+            for step in range(first_step, len(schedule)):
+                pressure, dwell = schedule[step]
+                if on_step_start:
+                    on_step_start(pressure)
+                if dwell > 0:
+                    time.sleep(dwell)
+
+                for board_connection in connections:
+                    try:
+                        board_connection.send(step)
+                    except OSError:
+                        # the board process is gone, waiting for it says why
+                        pass
+                # a step takes as long as the boards need, a board that goes quiet times out in its own process
+                _wait_for_boards(boards, processes, connections)
+
+                if session_writer:
+                    for board_id, arrays in zip(board_ids, all_arrays):
+                        count = arrays.counts[step]
+                        session_writer.write_step(
+                            board_id,
+                            pressure,
+                            arrays.timestamps[step, :count],
+                            arrays.samples[step, :count],
+                            arrays.avgs[step],
+                            arrays.stds[step],
+                            arrays.settled[step],
+                            arrays.num_rejected[step],
+                        )
+        finally:
+            # the board processes stop as soon as their pipe closes
+            for board_connection in connections:
+                board_connection.close()
+            for process in processes:
+                process.join(timeout=10)
+                if process.is_alive():
+                    process.terminate()
+
+        fits = fit_boards(schedule, all_arrays, config.get("fit", robust.LEAST_SQUARES))
+        results = build_results(config, schedule, all_arrays, fits, first_step)
+        # the monotonic clock is the same in every process, so the boards' timestamps can be compared directly
+        results["step_skews"] = [
+            alignment.measure_skew(
+                board_ids,
+                [
+                    arrays.timestamps[step, : arrays.counts[step]]
+                    for arrays in all_arrays
+                ],
+            ).to_dict()
+            for step in range(first_step, len(schedule))
+        ]
+        if session_writer:
+            for board_id, fit in zip(board_ids, fits):
+                session_writer.write_fit(board_id, fit)
+        headless.record_history(
+            config,
+            [(board["port"], board["name"], fit) for board, fit in zip(boards, fits)],
+            session_path,
+        )
+    finally:
+        if session_writer:
+            session_writer.close()
+        for arrays in all_arrays:
+            arrays.close()
+            arrays.unlink()
+
+    results["total_wall_time_s"] = time.perf_counter() - started_at
+    headless.write_results(results, output_path)
+    return results
+
+
+def fit_boards(
+    schedule: list[tuple[float, float]],
+    all_arrays: list[SharedBoardArrays],
+    fit_method: str = robust.LEAST_SQUARES,
+) -> list[cal.LinearFit]:
+    """fit every sensor on every board in one regression, then split the fits up by board"""
+    pressures = np.array([pressure for pressure, _ in schedule])
+    fit = robust.fit_steps(
+        pressures, np.hstack([arrays.avgs for arrays in all_arrays]), fit_method
+    )
+
+    board_ends = np.cumsum([arrays.avgs.shape[1] for arrays in all_arrays])
+    return [
+        fit.subset(slice(end - arrays.avgs.shape[1], end))
+        for arrays, end in zip(all_arrays, board_ends)
+    ]
+
+
+def build_results(
+    config: dict,
+    schedule: list[tuple[float, float]],
+    all_arrays: list[SharedBoardArrays],
+    fits: list[cal.LinearFit],
+    first_step: int = 0,
+) -> dict:
+    pressures = [pressure for pressure, _ in schedule]
+    results = {"boards": []}
+    for board, arrays, fit in zip(config["boards"], all_arrays, fits):
+        results["boards"].append(
+            {
+                "name": board["name"],
+                "port": board["port"],
+                "pressures": pressures,
+                "averages": arrays.avgs.tolist(),
+                "stds": arrays.stds.tolist(),
+                "rejected_samples": arrays.num_rejected.tolist(),
+                "unsettled_steps": np.flatnonzero(~arrays.settled).tolist(),
+                "rejected_lines": int(arrays.rejected_lines[0]),
+                "dropped_frames": int(arrays.dropped_frames[0]),
+                # only the steps taken in this run, not those resumed from a session
+                "step_latencies_s": arrays.latencies[first_step:].tolist(),
+                "fit": fit.to_dict(),
+                "models": models.fit_models(
+                    pressures,
+                    arrays.avgs,
+                    criterion=config.get("model_selection", models.AICC),
+                ).to_dict(),
+            }
+        )
+
+    return results
@@ -0,0 +1,356 @@
+"""
+Every calibration that has been done, kept in a SQLite database so that the drift of a sensor can be followed across
+sessions. Each sensor is identified by its board (the USB fingerprint of the board's port, or the board's name where
+there is none, see get_board_key) and its channel on that board.
+
+    calibrations   one row per calibration: when, where it came from (interactive or headless) and its session
+    sensor_fits    one row per sensor per calibration, indexed by (board, channel, created) so that the history of
+                   a sensor is a single index range scan
+"""
+
+import os, sqlite3, time
+from dataclasses import dataclass
+
+import numpy as np
+
+from cal import cal, robust
+from config import presets
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS calibrations (
+    id INTEGER PRIMARY KEY,
+    created REAL NOT NULL,
+    source TEXT NOT NULL,
+    session TEXT
+);
+CREATE TABLE IF NOT EXISTS sensor_fits (
+    calibration_id INTEGER NOT NULL REFERENCES calibrations (id) ON DELETE CASCADE,
+    board TEXT NOT NULL,
+    board_name TEXT NOT NULL,
+    channel INTEGER NOT NULL,
+    created REAL NOT NULL,
+    slope REAL NOT NULL,
+    intercept REAL NOT NULL,
+    r_squared REAL,
+    residual_rms REAL,
+    slope_stderr REAL,
+    intercept_stderr REAL,
+    num_outlier_steps INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS sensor_fits_by_sensor
+    ON sensor_fits (board, channel, created, board_name, slope, intercept, num_outlier_steps);
+CREATE INDEX IF NOT EXISTS sensor_fits_by_calibration ON sensor_fits (calibration_id);
+"""
+
+INTERACTIVE = "interactive"
+HEADLESS = "headless"
+
+SECONDS_PER_DAY = 24 * 60 * 60
+# drift is reported as the change over this many days
+DRIFT_PERIOD_DAYS = 30
+# calibrations whose slope or intercept is further than this many (robust) standard deviations from the sensor's
+# median are flagged
+OUTLIER_SIGMAS = 3.5
+
+
+def get_history_path() -> str:
+    return os.path.join(presets.get_config_dir(), "history.sqlite3")
+
+
+def get_board_key(port: str, name: str) -> str:
+    """the USB fingerprint of the device on the port, so that a board is recognised whichever port and name it is used
+    with, or the board's name for ports that aren't USB
+    """
+    from config import discovery
+    from serial.tools import list_ports
+
+    for port_info in list_ports.comports():
+        if port_info.device == port:
+            fingerprint = discovery.get_fingerprint(port_info)
+            if fingerprint:
+                return fingerprint
+
+    return f"name:{name}"
+
+
+def _to_json(value: float) -> float | None:
+    return None if np.isnan(value) else float(value)
+
+
+def _get_flags(values: np.ndarray) -> np.ndarray:
+    """values further than OUTLIER_SIGMAS from the median, by the median absolute deviation"""
+    median = np.median(values)
+    spread = robust.MAD_TO_STD * np.median(np.abs(values - median))
+    if spread == 0:
+        return np.zeros(len(values), dtype=bool)
+
+    return np.abs(values - median) > OUTLIER_SIGMAS * spread
+
+
+@dataclass
+class SensorHistory:
+    """The calibrations of one sensor, oldest first"""
+
+    board: str
+    board_name: str
+    channel: int
+    # unix times
+    created: np.ndarray
+    slopes: np.ndarray
+    intercepts: np.ndarray
+    num_outlier_steps: np.ndarray
+
+    def get_slope_deltas(self) -> np.ndarray:
+        """change in slope since the previous calibration, NaN for the first"""
+        return np.concatenate(([np.nan], np.diff(self.slopes)))
+
+    def get_intercept_deltas(self) -> np.ndarray:
+        return np.concatenate(([np.nan], np.diff(self.intercepts)))
+
+    def get_off_calibrations(self) -> np.ndarray:
+        """calibrations whose slope or intercept is far off the sensor's usual"""
+        return _get_flags(self.slopes) | _get_flags(self.intercepts)
+
+    def get_outliers(self) -> np.ndarray:
+        """calibrations that are off, or that had outlier steps of their own"""
+        return self.get_off_calibrations() | (self.num_outlier_steps > 0)
+
+    def get_drift(self) -> tuple[float, float]:
+        """(slope, intercept) change per DRIFT_PERIOD_DAYS going by a line through the calibrations that aren't
+        off, NaN without 2 calibrations at different times
+        """
+        kept = ~self.get_off_calibrations()
+        days = self.created[kept] / SECONDS_PER_DAY
+        if len(np.unique(days)) < 2:
+            return np.nan, np.nan
+
+        trend = cal.calculate_linear_regressions(
+            days, np.column_stack((self.slopes[kept], self.intercepts[kept]))
+        )
+        slope_drift, intercept_drift = trend.slopes * DRIFT_PERIOD_DAYS
+        return float(slope_drift), float(intercept_drift)
+
+    def to_dict(self) -> dict:
+        outliers = self.get_outliers()
+        slope_drift, intercept_drift = self.get_drift()
+        slope_deltas = self.get_slope_deltas()
+        intercept_deltas = self.get_intercept_deltas()
+        return {
+            "board": self.board,
+            "board_name": self.board_name,
+            "channel": self.channel,
+            f"slope_drift_per_{DRIFT_PERIOD_DAYS}_days": _to_json(slope_drift),
+            f"intercept_drift_per_{DRIFT_PERIOD_DAYS}_days": _to_json(intercept_drift),
+            "calibrations": [
+                {
+                    "created": time.strftime(
+                        "%Y-%m-%dT%H:%M:%S", time.localtime(self.created[index])
+                    ),
+                    "slope": float(self.slopes[index]),
+                    "intercept": float(self.intercepts[index]),
+                    "slope_delta": _to_json(slope_deltas[index]),
+                    "intercept_delta": _to_json(intercept_deltas[index]),
+                    "outlier_steps": int(self.num_outlier_steps[index]),
+                    "outlier": bool(outliers[index]),
+                }
+                for index in range(len(self.created))
+            ],
+        }
+
+    def summarise(self) -> dict:
+        """the drift of the sensor without every calibration"""
+        slope_drift, intercept_drift = self.get_drift()
+        return {
+            "board": self.board,
+            "board_name": self.board_name,
+            "channel": self.channel,
+            "num_calibrations": len(self.created),
+            "first_slope": float(self.slopes[0]),
+            "last_slope": float(self.slopes[-1]),
+            "first_intercept": float(self.intercepts[0]),
+            "last_intercept": float(self.intercepts[-1]),
+            f"slope_drift_per_{DRIFT_PERIOD_DAYS}_days": _to_json(slope_drift),
+            f"intercept_drift_per_{DRIFT_PERIOD_DAYS}_days": _to_json(intercept_drift),
+            "num_outliers": int(self.get_outliers().sum()),
+        }
+
+
+class CalibrationHistory:
+    def __init__(self, path: str | None = None):
+        path = path or get_history_path()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.connection = sqlite3.connect(path)
+        self.connection.execute("PRAGMA foreign_keys = ON")
+        # readers don't block the writer and vice versa, e.g. a query while a calibration is being recorded
+        self.connection.execute("PRAGMA journal_mode = WAL")
+        self.connection.executescript(SCHEMA)
+
+    def close(self) -> None:
+        self.connection.close()
+
+    def record_calibration(
+        self,
+        boards: list[tuple[str, str, cal.LinearFit]],
+        source: str,
+        session_path: str | None = None,
+        calibration_id: int | None = None,
+    ) -> int:
+        """
+        Record the fit of every sensor of every board, as (board key, board name, fit), in one transaction.
+
+        Passing the id of an earlier calibration replaces it, e.g. when the same run is calibrated again after
+        another step. Returns the calibration's id
+        """
+        created = time.time()
+        with self.connection:
+            if calibration_id is None:
+                calibration_id = self.connection.execute(
+                    "INSERT INTO calibrations (created, source, session) VALUES (?, ?, ?)",
+                    (created, source, session_path),
+                ).lastrowid
+            else:
+                self.connection.execute(
+                    "UPDATE calibrations SET created = ? WHERE id = ?",
+                    (created, calibration_id),
+                )
+                self.connection.execute(
+                    "DELETE FROM sensor_fits WHERE calibration_id = ?",
+                    (calibration_id,),
+                )
+
+            for board, board_name, fit in boards:
+                num_outlier_steps = (
+                    fit.outlier_steps.sum(axis=0)
+                    if fit.outlier_steps is not None
+                    else np.zeros(len(fit.slopes), dtype=int)
+                )
+                # NaN (e.g. the standard errors of a 2 point fit) is stored as NULL
+                columns = [
+                    [None if np.isnan(value) else value for value in values.tolist()]
+                    for values in (
+                        fit.r_squared,
+                        fit.residual_rms,
+                        fit.slope_stderr,
+                        fit.intercept_stderr,
+                    )
+                ]
+                self.connection.executemany(
+                    "INSERT INTO sensor_fits VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    [
+                        (
+                            calibration_id,
+                            board,
+                            board_name,
+                            channel,
+                            created,
+                            float(fit.slopes[channel]),
+                            float(fit.intercepts[channel]),
+                            *(column[channel] for column in columns),
+                            int(num_outlier_steps[channel]),
+                        )
+                        for channel in range(len(fit.slopes))
+                    ],
+                )
+
+        return calibration_id
+
+    def get_boards(self) -> list[dict]:
+        """every board with a calibration, with its most recent name"""
+        rows = self.connection.execute("""
+            SELECT board, board_name, COUNT(DISTINCT channel), COUNT(DISTINCT calibration_id), MAX(created)
+            FROM sensor_fits GROUP BY board
+            """).fetchall()
+        return [
+            {
+                "board": board,
+                "board_name": board_name,
+                "num_channels": num_channels,
+                "num_calibrations": num_calibrations,
+                "last_calibrated": time.strftime(
+                    "%Y-%m-%dT%H:%M:%S", time.localtime(last_calibrated)
+                ),
+            }
+            for board, board_name, num_channels, num_calibrations, last_calibrated in rows
+        ]
+
+    def find_board(self, board: str) -> str:
+        """the key of a board given its key or (most recent) name"""
+        row = self.connection.execute(
+            """
+            SELECT board FROM sensor_fits WHERE board = ? OR board_name = ?
+            ORDER BY created DESC LIMIT 1
+            """,
+            (board, board),
+        ).fetchone()
+        if row is None:
+            raise ValueError(f"No calibrations of board {board}")
+
+        return row[0]
+
+    def _get_histories(
+        self, where: str, parameters: tuple, since: float | None
+    ) -> list[SensorHistory]:
+        if since is not None:
+            where += " AND created >= ?"
+            parameters += (since,)
+
+        rows = self.connection.execute(
+            f"""
+            SELECT board, board_name, channel, created, slope, intercept, num_outlier_steps
+            FROM sensor_fits WHERE {where} ORDER BY board, channel, created
+            """,
+            parameters,
+        ).fetchall()
+        if not rows:
+            return []
+
+        boards = np.array([row[0] for row in rows])
+        values = np.array([row[2:] for row in rows], dtype=np.float64)
+        channels = values[:, 0].astype(int)
+        # the sorted rows of each sensor are contiguous
+        starts = np.flatnonzero(
+            np.concatenate(
+                ([True], (boards[1:] != boards[:-1]) | (np.diff(channels) != 0))
+            )
+        )
+        ends = np.append(starts[1:], len(rows))
+
+        return [
+            SensorHistory(
+                str(boards[start]),
+                # the name the board was last calibrated as
+                rows[end - 1][1],
+                int(channels[start]),
+                values[start:end, 1],
+                values[start:end, 2],
+                values[start:end, 3],
+                values[start:end, 4].astype(int),
+            )
+            for start, end in zip(starts, ends)
+        ]
+
+    def get_sensor_history(
+        self, board: str, channel: int, since: float | None = None
+    ) -> SensorHistory:
+        """every calibration of a sensor, optionally only those since a unix time"""
+        board = self.find_board(board)
+        histories = self._get_histories(
+            "board = ? AND channel = ?", (board, channel), since
+        )
+        if not histories:
+            raise ValueError(f"No calibrations of channel {channel} of {board}")
+
+        return histories[0]
+
+    def get_drift_report(
+        self, board: str | None = None, since: float | None = None
+    ) -> list[dict]:
+        """the drift of every sensor, or every sensor of one board"""
+        if board is None:
+            histories = self._get_histories("1", (), since)
+        else:
+            histories = self._get_histories(
+                "board = ?", (self.find_board(board),), since
+            )
+
+        return [history.summarise() for history in histories]
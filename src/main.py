@@ -1,12 +1,22 @@
-from cli import cli
-from config import config_setter
-import sys
+import argparse, importlib, json, sys, threading
+
+from config import presets
+from profiling import profiler
 
 HV = "High Voltage"
 LV = "Low Voltage"
 
 
-def main() -> None:
+def preload_ui() -> None:
+    """import the UI in the background, so that it is ready by the time the prompts have been answered"""
+    threading.Thread(
+        target=importlib.import_module, args=("cli.cli",), daemon=True
+    ).start()
+
+
+def prompt_for_config() -> dict:
+    from config import config_setter
+
     # first get the config params
     config = config_setter.Config(hv=HV, lv=LV)
 
@@ -26,15 +36,303 @@ def main() -> None:
         print("No PTs to calibrate. Exiting.")
         sys.exit(1)
 
+    return answers
+
+
+def run_interactive(
+    session_path: str | None,
+    metrics_path: str | None,
+    preset: str | None,
+    capture_prefix: str | None,
+) -> None:
+    # a saved preset skips the prompts
+    try:
+        answers = presets.load_preset(preset) if preset else None
+    except ValueError as e:
+        print(f"Preset {preset} can't be used: {e}")
+        sys.exit(1)
+
+    if answers is None:
+        preload_ui()
+        answers = prompt_for_config()
+        if preset:
+            presets.save_preset(preset, answers)
+            print(f"Saved the set-up as preset '{preset}'")
+
+    # the UI is only loaded for interactive runs
+    from cli import cli
+
     app = cli.AutoCalCli(
         baud_rate=int(answers["baud_rate"]),
         num_readings_per_pressure=int(answers["num_readings_per_pt"]),
         pt_configs=answers["pt_configs"],
         hv=HV,
         lv=LV,
+        continuous=answers.get("continuous", False),
+        lookback=answers.get("lookback", 0.0),
+        aligned=answers.get("aligned", False),
+        tolerance=answers.get("tolerance", 0.0),
+        min_readings_per_pressure=int(answers.get("min_readings_per_pt", 0)),
+        settle_window=answers.get("settle_window", 0.5),
+        averaging=answers.get("averaging", "mean"),
+        fit_method=answers.get("fit", "least_squares"),
+        session_path=session_path,
+        metrics_path=metrics_path,
+        capture_prefix=capture_prefix,
     )
     app.run()
 
 
+def run_attached(socket_path: str) -> None:
+    """run the UI as a viewer of the acquisition daemon listening on the socket"""
+    from cli import cli
+    from daemon import client
+
+    try:
+        daemon_client = client.DaemonClient(socket_path)
+    except OSError as e:
+        print(f"Can't attach to the daemon on {socket_path}: {e}", file=sys.stderr)
+        sys.exit(1)
+
+    app = cli.AutoCalCli(
+        baud_rate=int(daemon_client.config["baud_rate"]),
+        num_readings_per_pressure=int(daemon_client.config["num_readings_per_pt"]),
+        pt_configs=daemon_client.config["boards"],
+        hv=HV,
+        lv=LV,
+        client=daemon_client,
+    )
+    app.run()
+
+
+def run_daemon(args: argparse.Namespace) -> None:
+    from daemon import daemon
+
+    try:
+        daemon.run(args.config, args.daemon, args.session, args.metrics, args.capture)
+    except KeyboardInterrupt:
+        pass
+    except (OSError, ValueError, TimeoutError, RuntimeError) as e:
+        print(f"Acquisition daemon failed: {e}", file=sys.stderr)
+        sys.exit(1)
+
+
+def run_headless(args: argparse.Namespace) -> None:
+    try:
+        # only the mode that is used gets imported
+        if args.processes:
+            from headless import rack
+
+            rack.run(
+                args.config,
+                args.schedule,
+                args.output,
+                args.session,
+                args.metrics,
+                args.profile,
+                capture_prefix=args.capture,
+                replay_prefix=args.replay,
+                replay_speed=args.replay_speed,
+            )
+        else:
+            from headless import headless
+
+            headless.run(
+                args.config,
+                args.schedule,
+                args.output,
+                args.session,
+                args.metrics,
+                args.capture,
+                args.replay,
+                args.replay_speed,
+            )
+    except (OSError, ValueError, TimeoutError, RuntimeError) as e:
+        print(f"Calibration failed: {e}", file=sys.stderr)
+        sys.exit(1)
+
+
+def print_discovered_boards(extra_ports: list[str]) -> None:
+    from config import discovery
+
+    boards = discovery.discover_boards(115200, extra_ports)
+    print(
+        json.dumps(
+            [
+                {
+                    "name": board.name or f"Board {board_no + 1}",
+                    "port": board.port,
+                    "pt_count": board.num_channels,
+                }
+                for board_no, board in enumerate(boards)
+            ],
+            indent=2,
+        )
+    )
+
+
+def print_history(board: str, channel: int | None, since: str | None) -> None:
+    import datetime
+    from history import history
+
+    since_time = datetime.datetime.fromisoformat(since).timestamp() if since else None
+    calibration_history = history.CalibrationHistory()
+    try:
+        if channel is not None:
+            report = calibration_history.get_sensor_history(
+                board, channel, since_time
+            ).to_dict()
+        elif board:
+            report = calibration_history.get_drift_report(board, since_time)
+        else:
+            report = {
+                "boards": calibration_history.get_boards(),
+                "sensors": calibration_history.get_drift_report(since=since_time),
+            }
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        sys.exit(1)
+    finally:
+        calibration_history.close()
+
+    print(json.dumps(report, indent=2))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Automated calibration for PTs and LCs"
+    )
+    parser.add_argument(
+        "--headless",
+        action="store_true",
+        help="calibrate without prompts or UI, using --config and --schedule",
+    )
+    parser.add_argument(
+        "--config", help="JSON file with the ports and reading settings"
+    )
+    parser.add_argument("--schedule", help="JSON list of pressures to step through")
+    parser.add_argument(
+        "--output", help="file to write the JSON results to (default: stdout)"
+    )
+    parser.add_argument(
+        "--session",
+        help="directory to record every step in, an interrupted session is resumed",
+    )
+    parser.add_argument(
+        "--processes",
+        action="store_true",
+        help="with --headless, read each board in its own process",
+    )
+    parser.add_argument(
+        "--profile",
+        help="path prefix to write a timing trace (<prefix>.trace.json) and collapsed stacks (<prefix>.folded) to on exit",
+    )
+    parser.add_argument(
+        "--preset",
+        help="skip the set-up prompts and use the saved preset with this name, or save the answers as it if there isn't one",
+    )
+    parser.add_argument(
+        "--list-presets", action="store_true", help="list the saved presets and exit"
+    )
+    parser.add_argument(
+        "--discover",
+        nargs="*",
+        metavar="PORT",
+        help="find the connected boards (and probe any extra PORTs), print them as the boards of a headless config and exit",
+    )
+    parser.add_argument(
+        "--metrics",
+        help="path prefix to periodically write per-port metrics to (<prefix>.prom and <prefix>.jsonl)",
+    )
+    parser.add_argument(
+        "--capture",
+        help="path prefix to record every byte read from each port to (<prefix>-<board id>.cap)",
+    )
+    parser.add_argument(
+        "--replay",
+        help="with --headless, read each board from the capture <prefix>-<board id>.cap instead of its port",
+    )
+    parser.add_argument(
+        "--replay-speed",
+        type=float,
+        default=1.0,
+        help="how many times faster than recorded to replay, inf for as fast as possible (default: 1)",
+    )
+    parser.add_argument(
+        "--daemon",
+        metavar="SOCKET",
+        help="run an acquisition daemon for the boards in --config, serving viewers on the Unix domain SOCKET",
+    )
+    parser.add_argument(
+        "--attach",
+        metavar="SOCKET",
+        help="run the UI as a viewer of the acquisition daemon on SOCKET, any number of viewers can attach",
+    )
+    parser.add_argument(
+        "--history",
+        nargs="?",
+        const="",
+        metavar="BOARD",
+        help="print the drift of every calibrated sensor, or of every sensor of a BOARD (name or fingerprint), and exit",
+    )
+    parser.add_argument(
+        "--channel",
+        type=int,
+        help="with --history BOARD, print every calibration of the channel with the change since the previous one",
+    )
+    parser.add_argument(
+        "--since",
+        help="with --history, only use calibrations since this date (YYYY-MM-DD)",
+    )
+    args = parser.parse_args()
+
+    if args.discover is not None:
+        print_discovered_boards(args.discover)
+        return
+
+    if args.history is not None:
+        if args.channel is not None and not args.history:
+            parser.error("--channel needs --history BOARD")
+        print_history(args.history, args.channel, args.since)
+        return
+
+    if args.list_presets:
+        for name, preset in presets.load_presets().items():
+            boards = ", ".join(
+                f"{board['name']} ({board['pt_count']} PTs)"
+                for board in preset["pt_configs"]
+            )
+            print(f"{name}: {boards}, {preset['num_readings_per_pt']} readings per pt")
+        return
+
+    if args.headless and (not args.config or not args.schedule):
+        parser.error("--headless needs both --config and --schedule")
+
+    if args.replay and not args.headless:
+        parser.error("--replay only works with --headless")
+
+    if args.daemon and not args.config:
+        parser.error("--daemon needs --config")
+
+    if args.attach and (args.session or args.metrics or args.capture):
+        parser.error("the daemon records the session, metrics and captures of --attach")
+
+    if args.profile:
+        profiler.enable()
+
+    try:
+        if args.headless:
+            run_headless(args)
+        elif args.daemon:
+            run_daemon(args)
+        elif args.attach:
+            run_attached(args.attach)
+        else:
+            run_interactive(args.session, args.metrics, args.preset, args.capture)
+    finally:
+        if args.profile:
+            profiler.write(args.profile)
+
+
 if __name__ == "__main__":
     main()
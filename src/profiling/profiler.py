@@ -0,0 +1,217 @@
+"""
+Lightweight timing spans for finding out where the time goes in a calibration run.
+
+Functions are wrapped with @traced (or a block with `with span(name)`), which records nothing and costs a single
+check while profiling is off. Once enable() has been called, every span records its start, duration and the
+thread / asyncio task it ran on, and write() dumps:
+
+    <prefix>.trace.json   Chrome trace event format, for chrome://tracing, Perfetto or speedscope
+    <prefix>.folded       collapsed stacks with the self time of each in microseconds, for flamegraph.pl or speedscope
+
+The trace only keeps the most recent MAX_EVENTS spans, so that a long run doesn't grow without bound. The self times
+of the collapsed stacks are added up as the spans finish, and cover the whole run
+"""
+
+import contextvars, functools, json, os, sys, threading, time
+from collections import defaultdict, deque
+from typing import Callable
+
+# code flag of an async def
+CO_COROUTINE = 0x80
+# spans kept for the trace, about 30 MB of them
+MAX_EVENTS = 200_000
+
+
+class _Span:
+    __slots__ = ("name", "path", "parent", "start", "child_time", "finished", "token")
+
+    def __init__(self, name: str, parent: "_Span | None"):
+        # tasks started from inside a span can outlive it, their spans belong to whatever is still running
+        while parent and parent.finished:
+            parent = parent.parent
+
+        self.name = name
+        self.path = f"{parent.path};{name}" if parent else name
+        self.parent = parent
+        self.child_time = 0
+        self.finished = False
+        self.start = time.perf_counter_ns()
+
+
+class Profiler:
+    """Collects the spans of a single process"""
+
+    def __init__(self, max_events: int = MAX_EVENTS):
+        self.started_at = time.perf_counter_ns()
+        # (name, start, duration, worker) of the most recent spans, in nanoseconds
+        self.events: deque[tuple[str, int, int, int]] = deque(maxlen=max_events)
+        # spans that were pushed out of events by newer ones
+        self.num_dropped = 0
+        # time spent in each stack of spans, excluding the spans below it
+        self.self_times: dict[str, int] = defaultdict(int)
+        # (thread, task) -> (worker id, worker name)
+        self.workers: dict[tuple[int | None, int | None], tuple[int, str]] = {}
+
+    def _get_worker(self) -> int:
+        """id of the thread, or of the asyncio task if there is one, so that concurrent tasks get their own track"""
+        thread = threading.current_thread()
+        # asyncio is only looked up, so that importing the profiler doesn't drag it in
+        asyncio = sys.modules.get("asyncio")
+        try:
+            task = asyncio.current_task() if asyncio else None
+        except RuntimeError:
+            task = None
+
+        key = (thread.ident, id(task) if task else None)
+        worker = self.workers.get(key)
+        if worker is None:
+            name = f"{thread.name} {task.get_name()}" if task else thread.name
+            worker = self.workers[key] = (len(self.workers) + 1, name)
+
+        return worker[0]
+
+    def record(self, span: _Span, end: int) -> None:
+        duration = end - span.start
+        if span.parent:
+            span.parent.child_time += duration
+
+        # children of a span can run concurrently on other tasks and add up to more than the span itself
+        self.self_times[span.path] += max(0, duration - span.child_time)
+        if len(self.events) == self.events.maxlen:
+            self.num_dropped += 1
+        self.events.append((span.name, span.start, duration, self._get_worker()))
+
+    def get_trace(self) -> dict:
+        pid = os.getpid()
+        trace_events: list[dict] = [
+            {
+                "name": "thread_name",
+                "ph": "M",
+                "pid": pid,
+                "tid": worker_id,
+                "args": {"name": name},
+            }
+            for worker_id, name in self.workers.values()
+        ]
+        trace_events += [
+            {
+                "name": name,
+                "cat": "autocal",
+                "ph": "X",
+                "ts": (start - self.started_at) / 1000,
+                "dur": duration / 1000,
+                "pid": pid,
+                "tid": worker_id,
+            }
+            for name, start, duration, worker_id in self.events
+        ]
+        return {
+            "traceEvents": trace_events,
+            "displayTimeUnit": "ms",
+            "otherData": {"dropped_spans": self.num_dropped},
+        }
+
+    def get_collapsed_stacks(self) -> str:
+        return "".join(
+            f"{path} {self_time // 1000}\n"
+            for path, self_time in sorted(self.self_times.items())
+            if self_time >= 1000
+        )
+
+    def write(self, prefix: str) -> None:
+        with open(f"{prefix}.trace.json", "w") as trace_file:
+            json.dump(self.get_trace(), trace_file)
+
+        with open(f"{prefix}.folded", "w") as folded_file:
+            folded_file.write(self.get_collapsed_stacks())
+
+
+_profiler: Profiler | None = None
+# the innermost span of the running thread or task
+_current_span: contextvars.ContextVar[_Span | None] = contextvars.ContextVar(
+    "current_span", default=None
+)
+
+
+def enable(max_events: int = MAX_EVENTS) -> None:
+    global _profiler
+    _profiler = Profiler(max_events)
+
+
+def is_enabled() -> bool:
+    return _profiler is not None
+
+
+def write(prefix: str) -> None:
+    """dump everything recorded so far to <prefix>.trace.json and <prefix>.folded"""
+    if _profiler:
+        _profiler.write(prefix)
+
+
+def _start_span(name: str, root: bool = False) -> _Span:
+    span = _Span(name, None if root else _current_span.get())
+    span.token = _current_span.set(span)
+    return span
+
+
+def _finish_span(span: _Span) -> None:
+    end = time.perf_counter_ns()
+    span.finished = True
+    _current_span.reset(span.token)
+    if _profiler:
+        _profiler.record(span, end)
+
+
+class span:
+    """time a block of code, e.g. `with profiler.span("fit"): ...`. A root span doesn't nest under the span it
+    was started in, for work that only happens to be running in the context of another span
+    """
+
+    __slots__ = ("name", "root", "current")
+
+    def __init__(self, name: str, root: bool = False):
+        self.name = name
+        self.root = root
+        self.current = None
+
+    def __enter__(self) -> None:
+        if _profiler:
+            self.current = _start_span(self.name, self.root)
+
+    def __exit__(self, *exc_info) -> None:
+        if self.current:
+            _finish_span(self.current)
+
+
+def traced(func: Callable) -> Callable:
+    """time every call of a function or coroutine function while profiling is on"""
+    name = func.__qualname__
+
+    # same as inspect.iscoroutinefunction, without importing inspect on startup
+    if func.__code__.co_flags & CO_COROUTINE:
+
+        @functools.wraps(func)
+        async def traced_coroutine(*args, **kwargs):
+            if _profiler is None:
+                return await func(*args, **kwargs)
+
+            current = _start_span(name)
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                _finish_span(current)
+
+        return traced_coroutine
+
+    @functools.wraps(func)
+    def traced_function(*args, **kwargs):
+        if _profiler is None:
+            return func(*args, **kwargs)
+
+        current = _start_span(name)
+        try:
+            return func(*args, **kwargs)
+        finally:
+            _finish_span(current)
+
+    return traced_function
@@ -0,0 +1,403 @@
+import asyncio, time
+from typing import Callable, Coroutine
+
+import numpy as np
+
+from profiling import profiler
+from serial_reader import serial_reader, alignment, convergence
+
+# how often to poll ports that can't be watched by the event loop (e.g. on Windows)
+POLL_INTERVAL = 0.01
+
+
+class AcquisitionEngine:
+    """Reads a pressure step from every serial port concurrently on a single asyncio event loop.
+
+    Ports are read without blocking: the loop is told to wake up when a port's file descriptor becomes readable,
+    so any number of ports can be serviced without a thread each.
+
+    In continuous mode every port is sampled all the time into its history, and a step is taken from the samples
+    of the last `lookback` seconds (topped up with new samples if there aren't enough) instead of waiting for N fresh ones.
+    Aligned steps are taken from the same window of time on every port (see serial_reader.alignment), and always
+    sample continuously
+    """
+
+    def __init__(
+        self,
+        readers: list[serial_reader.SerialReader],
+        timeout: float | None = None,
+        continuous: bool = False,
+        lookback: float = 0,
+        aligned: bool = False,
+    ):
+        self.readers = readers
+        # seconds a port may go without producing a single valid line before the step is aborted
+        self.timeout = timeout
+        self.continuous = continuous or aligned
+        self.lookback = lookback
+        self.aligned = aligned
+        # how far apart the ports' samples were in every step taken
+        self.step_skews: list[alignment.StepSkew] = []
+        # samples each port has towards the aligned step being taken
+        self.aligned_counts: dict[str, int] = {}
+        # set whenever continuous acquisition appends new samples to a reader's history
+        self.new_samples = {reader.get_pt_id(): asyncio.Event() for reader in readers}
+        # holds back each adaptive reader's samples until its signal has settled
+        self.settle_detectors: dict[str, convergence.SettleDetector] = {}
+
+    def _get_timeout(self, reader: serial_reader.SerialReader) -> float:
+        if self.timeout is not None:
+            return self.timeout
+
+        return reader.serial.timeout or 2
+
+    async def _wait_readable(
+        self, reader: serial_reader.SerialReader, timeout: float
+    ) -> None:
+        loop = asyncio.get_running_loop()
+        fd = reader.fileno()
+        if fd is None:
+            await asyncio.sleep(POLL_INTERVAL)
+            return
+
+        readable = loop.create_future()
+        try:
+            loop.add_reader(fd, lambda: readable.done() or readable.set_result(None))
+        except NotImplementedError:
+            # the running loop can't watch file descriptors, fall back to polling
+            await asyncio.sleep(POLL_INTERVAL)
+            return
+
+        # asyncio.wait rather than wait_for, which (before Python 3.12) can swallow a cancellation that arrives just
+        # as the port becomes readable and leave the task running
+        try:
+            done, _ = await asyncio.wait((readable,), timeout=timeout)
+        finally:
+            loop.remove_reader(fd)
+
+        if not done:
+            raise asyncio.TimeoutError
+
+    def _start_step(self, reader: serial_reader.SerialReader) -> None:
+        reader.store.clear_step()
+        if reader.criteria:
+            self.settle_detectors[reader.get_pt_id()] = convergence.SettleDetector(
+                reader.criteria, reader.get_num_pts()
+            )
+
+    def _add_step_rows(
+        self,
+        reader: serial_reader.SerialReader,
+        rows: np.ndarray,
+        timestamps: np.ndarray,
+        on_progress: Callable[[serial_reader.SerialReader, int], None] | None,
+    ) -> None:
+        if reader.criteria:
+            detector = self.settle_detectors[reader.get_pt_id()]
+            rows, timestamps = detector.push(rows, timestamps)
+            if detector.forced:
+                reader.store.step_settled = False
+
+        num_taken = reader.store.add_rows(rows, timestamps)
+        if on_progress:
+            on_progress(reader, num_taken)
+
+    def is_step_done(self, reader: serial_reader.SerialReader) -> bool:
+        if reader.store.is_full():
+            return True
+
+        if not reader.criteria:
+            return False
+
+        detector = self.settle_detectors.get(reader.get_pt_id())
+        return bool(
+            detector and detector.settled and reader.criteria.is_converged(reader.store)
+        )
+
+    def get_step_progress(self, reader: serial_reader.SerialReader) -> float:
+        """fraction of the way through the current step, for progress bars"""
+        if self.aligned and reader.store.count == 0:
+            return (
+                self.aligned_counts.get(reader.get_pt_id(), 0)
+                / reader.num_readings_per_pt
+            )
+
+        if not reader.criteria:
+            return reader.store.count / reader.num_readings_per_pt
+
+        detector = self.settle_detectors.get(reader.get_pt_id())
+        if not detector or not detector.settled:
+            return 0.0
+
+        return reader.criteria.get_progress(reader.store)
+
+    @profiler.traced
+    async def read_step(
+        self,
+        reader: serial_reader.SerialReader,
+        on_progress: Callable[[serial_reader.SerialReader, int], None] | None = None,
+    ) -> None:
+        """fill the reader's current step with fresh readings, or until it converges for adaptive readers"""
+        reader.reset_input()
+        self._start_step(reader)
+        timeout = self._get_timeout(reader)
+        loop = asyncio.get_running_loop()
+        step_started_at = last_valid_line = loop.time()
+
+        while not self.is_step_done(reader):
+            rows, timestamps = reader.poll()
+            if len(rows) > 0:
+                last_valid_line = loop.time()
+                self._add_step_rows(reader, rows, timestamps, on_progress)
+                # let the other ports and the UI have a turn, a port that never drains would hold the loop up
+                await asyncio.sleep(0)
+                continue
+
+            remaining = timeout - (loop.time() - last_valid_line)
+            if remaining <= 0:
+                raise TimeoutError(
+                    f"No valid set of {reader.get_num_pts()} readings from {reader.get_pt_name()} in {timeout}s ({reader.rejected_lines} lines rejected). Aborting..."
+                )
+
+            await self._back_off(reader, remaining)
+
+        reader.metrics.record_step(loop.time() - step_started_at)
+
+    @profiler.traced
+    async def _back_off(
+        self, reader: serial_reader.SerialReader, timeout: float
+    ) -> None:
+        """wait for more data after a read that didn't produce a single valid line"""
+        waiting_since = time.monotonic()
+        try:
+            await self._wait_readable(reader, timeout)
+        except asyncio.TimeoutError:
+            pass
+        reader.metrics.record_retry(time.monotonic() - waiting_since)
+
+    async def sample_continuously(self, reader: serial_reader.SerialReader) -> None:
+        """keep reading the port into its history until cancelled"""
+        reader.reset_input()
+        new_samples = self.new_samples[reader.get_pt_id()]
+        timeout = self._get_timeout(reader)
+
+        while True:
+            rows, _ = reader.poll()
+            if len(rows) > 0:
+                new_samples.set()
+                await asyncio.sleep(0)
+                continue
+
+            await self._back_off(reader, timeout)
+
+    @profiler.traced
+    async def read_step_from_history(
+        self,
+        reader: serial_reader.SerialReader,
+        on_progress: Callable[[serial_reader.SerialReader, int], None] | None = None,
+    ) -> None:
+        """fill the reader's current step from its history, waiting for new samples only if the lookback window is short"""
+        self._start_step(reader)
+        history = reader.history
+        new_samples = self.new_samples[reader.get_pt_id()]
+        timeout = self._get_timeout(reader)
+        step_started_at = last_new_sample = time.monotonic()
+
+        # only the most recent samples in the window are used
+        next_index = max(
+            history.index_at(last_new_sample - self.lookback),
+            history.total - reader.num_readings_per_pt,
+        )
+
+        while not self.is_step_done(reader):
+            timestamps, rows = history.get_range(next_index)
+            next_index = history.total
+            if len(rows) > 0:
+                last_new_sample = time.monotonic()
+                self._add_step_rows(reader, rows, timestamps, on_progress)
+                await asyncio.sleep(0)
+                continue
+
+            remaining = timeout - (time.monotonic() - last_new_sample)
+            if remaining <= 0:
+                raise TimeoutError(
+                    f"No new readings from {reader.get_pt_name()} in {timeout}s ({reader.rejected_lines} lines rejected). Aborting..."
+                )
+
+            new_samples.clear()
+            # see _wait_readable for why this isn't wait_for
+            waiter = asyncio.ensure_future(new_samples.wait())
+            try:
+                await asyncio.wait((waiter,), timeout=remaining)
+            finally:
+                waiter.cancel()
+
+        reader.metrics.record_step(time.monotonic() - step_started_at)
+
+    @profiler.traced
+    async def read_aligned_step(
+        self,
+        on_progress: Callable[[serial_reader.SerialReader, int], None] | None = None,
+    ) -> alignment.StepSkew:
+        """fill every reader's current step from the most recent window of time in which every port has a full step of
+        samples it can use. A tolerance doesn't end aligned steps early.
+
+        Without a lookback, a port's samples can be used from the end of its first read that completed after the step
+        started: that read may hold lines the board sent before the pressure changed, and they are stamped with the
+        time they were read at. With a lookback, the samples of the last `lookback` seconds before the step started
+        are taken to be at the new pressure already. Adaptive readers hold their samples back until they settle
+        """
+        for reader in self.readers:
+            self._start_step(reader)
+        histories = [reader.history for reader in self.readers]
+        num_samples = [reader.num_readings_per_pt for reader in self.readers]
+        step_started_at = time.monotonic()
+        last_new_samples = {
+            reader.get_pt_id(): step_started_at for reader in self.readers
+        }
+        totals = {reader.get_pt_id(): reader.history.total for reader in self.readers}
+        # sequence index of the first sample of each port that can be used for the step, None until it is known
+        first_indices: dict[str, int | None] = {
+            reader.get_pt_id(): (
+                reader.history.index_at(step_started_at - self.lookback)
+                if self.lookback
+                else None
+            )
+            for reader in self.readers
+        }
+        # sequence index after each port's first read since the step started, None until there has been one
+        fresh_indices: dict[str, int | None] = {
+            reader.get_pt_id(): None for reader in self.readers
+        }
+        self.aligned_counts = {}
+
+        def get_first_indices() -> list[int | None]:
+            return [first_indices[reader.get_pt_id()] for reader in self.readers]
+
+        while (
+            window := alignment.find_common_window(
+                histories, num_samples, get_first_indices()
+            )
+        ) is None:
+            now = time.monotonic()
+            for reader in self.readers:
+                pt_id = reader.get_pt_id()
+                if reader.history.total != totals[pt_id]:
+                    totals[pt_id] = reader.history.total
+                    last_new_samples[pt_id] = now
+                    if first_indices[pt_id] is None:
+                        self._find_first_aligned(reader, fresh_indices, first_indices)
+                    self.aligned_counts[pt_id] = min(
+                        alignment.count_since(reader.history, first_indices[pt_id]),
+                        reader.num_readings_per_pt,
+                    )
+                    if on_progress:
+                        on_progress(reader, 0)
+
+                timeout = self._get_timeout(reader)
+                if now - last_new_samples[pt_id] > timeout:
+                    raise TimeoutError(
+                        f"No new readings from {reader.get_pt_name()} in {timeout}s ({reader.rejected_lines} lines rejected). Aborting..."
+                    )
+
+            # whichever port has new samples first, see _wait_readable for why this isn't wait_for
+            waiters = []
+            for reader in self.readers:
+                new_samples = self.new_samples[reader.get_pt_id()]
+                new_samples.clear()
+                waiters.append(asyncio.ensure_future(new_samples.wait()))
+            try:
+                await asyncio.wait(
+                    waiters,
+                    timeout=min(map(self._get_timeout, self.readers)),
+                    return_when=asyncio.FIRST_COMPLETED,
+                )
+            finally:
+                for waiter in waiters:
+                    waiter.cancel()
+
+        start, end = window
+        num_missing = []
+        for reader in self.readers:
+            timestamps, rows, reader_missing = alignment.select_window(
+                reader.history, start, end, reader.num_readings_per_pt
+            )
+            reader.store.add_rows(rows, timestamps)
+            num_missing.append(reader_missing)
+            if on_progress:
+                on_progress(reader, len(rows))
+            reader.metrics.record_step(time.monotonic() - step_started_at)
+        self.aligned_counts = {}
+
+        skew = self.measure_skew()
+        skew.window = window
+        skew.num_missing = num_missing
+        return skew
+
+    def _find_first_aligned(
+        self,
+        reader: serial_reader.SerialReader,
+        fresh_indices: dict[str, int | None],
+        first_indices: dict[str, int | None],
+    ) -> None:
+        """work out the first of a reader's samples that can be used for an aligned step, from its new samples. For
+        adaptive readers that is the first sample its settle detector let through
+        """
+        pt_id = reader.get_pt_id()
+        history = reader.history
+        if fresh_indices[pt_id] is None:
+            # the first read since the step started may hold lines the board sent before it
+            fresh_indices[pt_id] = history.total
+            if not reader.criteria:
+                first_indices[pt_id] = history.total
+            return
+
+        detector = self.settle_detectors[pt_id]
+        timestamps, rows = history.get_range(fresh_indices[pt_id])
+        fresh_indices[pt_id] = history.total
+        _, settled_timestamps = detector.push(rows, timestamps)
+        if detector.forced:
+            reader.store.step_settled = False
+        if len(settled_timestamps) > 0:
+            first_indices[pt_id] = history.index_at(settled_timestamps[0])
+
+    def measure_skew(self) -> alignment.StepSkew:
+        """how far apart the samples of the current step were on every port"""
+        return alignment.measure_skew(
+            [reader.get_pt_id() for reader in self.readers],
+            [reader.store.get_step_timestamps() for reader in self.readers],
+        )
+
+    async def _run_for_all_readers(
+        self,
+        make_task: Callable[[serial_reader.SerialReader], Coroutine],
+    ) -> None:
+        """run a task per reader. If any of them fails the others are cancelled"""
+        tasks = [asyncio.ensure_future(make_task(reader)) for reader in self.readers]
+        try:
+            done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_EXCEPTION)
+        finally:
+            for task in tasks:
+                task.cancel()
+
+        for task in done:
+            if task.exception():
+                raise task.exception()  # type: ignore[misc]
+
+    async def run_continuous(self) -> None:
+        """sample every port into its history until cancelled"""
+        await self._run_for_all_readers(self.sample_continuously)
+
+    @profiler.traced
+    async def read_all_steps(
+        self,
+        on_progress: Callable[[serial_reader.SerialReader, int], None] | None = None,
+    ) -> None:
+        """read the current step from every port at once"""
+        if self.aligned:
+            self.step_skews.append(await self.read_aligned_step(on_progress))
+            return
+
+        read_step = self.read_step_from_history if self.continuous else self.read_step
+        await self._run_for_all_readers(lambda reader: read_step(reader, on_progress))
+        self.step_skews.append(self.measure_skew())
@@ -0,0 +1,143 @@
+"""
+Steps that cover the same stretch of time on every port. Each port's samples are stamped with the host's monotonic
+clock as they arrive (see SerialReader.poll), so the samples of different ports can be lined up against each other.
+
+An aligned step is taken from the most recent window in which every port has at least num_readings_per_pt samples
+it can use for the step (see AcquisitionEngine.read_aligned_step for which those are).
+Ports that sample faster than the slowest one have more samples than that in the window, and contribute
+num_readings_per_pt of them spread evenly across it, so that every port's average stands for the same interval.
+
+How far apart the ports' steps were is reported for every step, aligned or not, as the skew between the mean times
+of their samples (the moment each average stands for), and between their first and last samples
+"""
+
+from dataclasses import dataclass
+
+import numpy as np
+
+from serial_reader import sample_history
+
+
+def find_common_window(
+    histories: list[sample_history.SampleHistory],
+    num_samples: list[int],
+    first_indices: list[int | None],
+) -> tuple[float, float] | None:
+    """(start, end) of the most recent window in which every history has at least its number of samples from its
+    first usable sequence index on, None if there isn't one yet (or a history has no usable samples yet)
+    """
+    if any(first is None for first in first_indices):
+        return None
+
+    latest = [history.latest_timestamp() for history in histories]
+    if any(timestamp is None for timestamp in latest):
+        return None
+
+    # no port has anything to say about the time after its latest sample
+    end = min(latest)
+    start = end
+    for history, count, first_usable in zip(histories, num_samples, first_indices):
+        first = history.index_after(end) - count
+        if first < max(history.oldest_index(), first_usable):
+            return None
+        start = min(start, history.get_timestamp(first))
+
+    return start, end
+
+
+def count_since(history: sample_history.SampleHistory, first_index: int | None) -> int:
+    if first_index is None:
+        return 0
+
+    return history.total - max(first_index, history.oldest_index())
+
+
+def select_window(
+    history: sample_history.SampleHistory, start: float, end: float, num_samples: int
+) -> tuple[np.ndarray, np.ndarray, int]:
+    """
+    Take num_samples samples spread evenly over [start, end] from a history with at least that many in the window.
+
+    Returns:
+        (timestamps, rows, num_missing): the samples taken, and how many samples the board's sequence numbers say
+        are missing from the window (0 for boards without sequence numbers)
+    """
+    first = history.index_at(start)
+    last = history.index_after(end)
+    timestamps, rows = history.get_range(first, last)
+    sequences = history.get_sequences(first, last)
+
+    num_missing = 0
+    if len(sequences) and sequences.min() >= 0:
+        num_missing = max(0, int(sequences[-1] - sequences[0] + 1) - len(sequences))
+
+    # at least as many samples as are taken, so the rounded positions are all different
+    keep = np.linspace(0, len(rows) - 1, num_samples).round().astype(int)
+    return timestamps[keep], rows[keep], num_missing
+
+
+@dataclass
+class StepSkew:
+    """When each port's samples of a step were taken, relative to the other ports"""
+
+    reader_ids: list[str]
+    # monotonic times of each port's first and last sample, and the mean time of its samples
+    starts: np.ndarray
+    ends: np.ndarray
+    centres: np.ndarray
+    # the window every port was averaged over, for aligned steps
+    window: tuple[float, float] | None = None
+    # samples missing from each port's window going by its sequence numbers, for aligned steps
+    num_missing: list[int] | None = None
+
+    def get_skew(self) -> float:
+        """seconds between the moments the ports' averages stand for"""
+        return float(np.nanmax(self.centres) - np.nanmin(self.centres))
+
+    def get_start_skew(self) -> float:
+        return float(np.nanmax(self.starts) - np.nanmin(self.starts))
+
+    def get_end_skew(self) -> float:
+        return float(np.nanmax(self.ends) - np.nanmin(self.ends))
+
+    def to_dict(self) -> dict:
+        # monotonic times mean nothing on their own, so everything is relative to the first port to start
+        origin = float(np.nanmin(self.starts))
+        skew = {
+            "skew_s": self.get_skew(),
+            "start_skew_s": self.get_start_skew(),
+            "end_skew_s": self.get_end_skew(),
+            "readers": {
+                reader_id: {
+                    "start_s": float(self.starts[index] - origin),
+                    "end_s": float(self.ends[index] - origin),
+                    "centre_s": float(self.centres[index] - origin),
+                }
+                for index, reader_id in enumerate(self.reader_ids)
+            },
+        }
+        if self.window:
+            skew["window_s"] = self.window[1] - self.window[0]
+        if self.num_missing is not None:
+            for reader_id, num_missing in zip(self.reader_ids, self.num_missing):
+                skew["readers"][reader_id]["missing_samples"] = num_missing
+
+        return skew
+
+
+def measure_skew(reader_ids: list[str], step_timestamps: list[np.ndarray]) -> StepSkew:
+    """the skew of a step from the timestamps of every port's samples. Ports without any (e.g. in a failed step) are
+    NaN, and left out of the skews
+    """
+    return StepSkew(
+        reader_ids,
+        *(
+            np.array(
+                [
+                    summarise(timestamps) if len(timestamps) else np.nan
+                    for timestamps in step_timestamps
+                ]
+            )
+            for summarise in (np.min, np.max, np.mean)
+        ),
+    )
@@ -0,0 +1,231 @@
+"""
+Recording of the raw bytes read from a port, so that a misbehaving board can be looked at (and the whole calibration
+re-run through new parsing and fitting code) after the fact.
+
+A capture file is a short header followed by one record per chunk of bytes read:
+
+    "ACAPTURE"                      magic
+    uint32 header length, header    JSON: port, baud rate and when the capture was started
+    records                         float64 monotonic time, uint8 kind, uint32 length, then `length` bytes
+
+Records are little endian. A RESET record (no bytes) marks where the input buffer was cleared, e.g. at the start of
+every step, so a replay hands out exactly the bytes that were read between two resets
+"""
+
+import datetime, json, math, struct, time
+
+import numpy as np
+
+MAGIC = b"ACAPTURE"
+HEADER_LENGTH = struct.Struct("<I")
+RECORD = struct.Struct("<dBI")
+DATA = 0
+RESET = 1
+
+
+class CaptureWriter:
+    """Appends the records of a capture file. Writes are buffered and flushed at every reset, so a crash loses at
+    most the current step
+    """
+
+    def __init__(self, path: str, port: str, baud_rate: int):
+        self.file = open(path, "wb")
+        header = json.dumps(
+            {
+                "port": port,
+                "baud_rate": baud_rate,
+                "started": datetime.datetime.now().isoformat(),
+            }
+        ).encode()
+        self.file.write(MAGIC + HEADER_LENGTH.pack(len(header)) + header)
+
+    def write_data(self, data: bytes | memoryview) -> None:
+        self.file.write(RECORD.pack(time.monotonic(), DATA, len(data)))
+        self.file.write(data)
+
+    def write_reset(self) -> None:
+        self.file.write(RECORD.pack(time.monotonic(), RESET, 0))
+        self.file.flush()
+
+    def close(self) -> None:
+        if not self.file.closed:
+            self.file.close()
+
+
+class CapturingPort:
+    """Wraps a serial port and records every byte read from it, otherwise behaving exactly like the port"""
+
+    def __init__(self, serial, path: str):
+        self.serial = serial
+        self.writer = CaptureWriter(path, serial.port, serial.baudrate)
+
+    def __getattr__(self, name: str):
+        return getattr(self.serial, name)
+
+    def read(self, size: int = 1) -> bytes:
+        data = self.serial.read(size)
+        if data:
+            self.writer.write_data(data)
+        return data
+
+    def readinto(self, buffer) -> int:
+        count = self.serial.readinto(buffer)
+        if count:
+            self.writer.write_data(buffer[:count])
+        return count
+
+    def reset_input_buffer(self) -> None:
+        self.serial.reset_input_buffer()
+        self.writer.write_reset()
+
+    def close(self) -> None:
+        self.serial.close()
+        self.writer.close()
+
+
+class Capture:
+    """The contents of a capture file, with the data of every chunk joined into one stream"""
+
+    def __init__(self, path: str):
+        with open(path, "rb") as capture_file:
+            contents = capture_file.read()
+
+        if not contents.startswith(MAGIC):
+            raise ValueError(f"{path} is not a capture file")
+
+        offset = len(MAGIC)
+        (header_length,) = HEADER_LENGTH.unpack_from(contents, offset)
+        offset += HEADER_LENGTH.size
+        self.header = json.loads(contents[offset : offset + header_length])
+        offset += header_length
+
+        chunks = []
+        data_times = []
+        reset_times = []
+        # where each reset falls in the stream
+        reset_positions = []
+        position = 0
+        while offset + RECORD.size <= len(contents):
+            timestamp, kind, length = RECORD.unpack_from(contents, offset)
+            offset += RECORD.size
+            if offset + length > len(contents):
+                # the last record was cut off by a crash
+                break
+
+            if kind == RESET:
+                reset_times.append(timestamp)
+                reset_positions.append(position)
+            else:
+                chunks.append(contents[offset : offset + length])
+                data_times.append(timestamp)
+                position += length
+            offset += length
+
+        self.stream = b"".join(chunks)
+        self.data_times = np.array(data_times, dtype=np.float64)
+        # stream position at the end of every chunk
+        self.data_ends = np.cumsum([len(chunk) for chunk in chunks], dtype=np.int64)
+        self.reset_times = np.array(reset_times, dtype=np.float64)
+        self.reset_positions = np.array(reset_positions, dtype=np.int64)
+
+
+class ReplayPort:
+    """Stands in for a serial port, handing out the bytes of a capture at the speed they were recorded (or `speed`
+    times as fast, inf for as fast as possible).
+
+    The bytes after a RESET record only become available once the reader clears its input buffer, like it did when
+    the capture was made, so every step gets the same bytes it got at the time however fast the replay is
+    """
+
+    def __init__(self, path: str, speed: float = 1.0, timeout: float = 2):
+        self.capture = Capture(path)
+        self.port = self.capture.header["port"]
+        self.baudrate = self.capture.header["baud_rate"]
+        self.timeout = timeout
+        self.speed = speed
+        self.position = 0
+        self.next_reset = 0
+        # the replay's clock runs from here, and is restarted at every reset
+        self.started_at = time.monotonic()
+        self.recorded_start = (
+            self.capture.data_times[0] if len(self.capture.data_times) else 0.0
+        )
+
+    def _get_limit(self) -> int:
+        """stream position up to which bytes have arrived"""
+        limit = len(self.capture.stream)
+        if self.next_reset < len(self.capture.reset_positions):
+            limit = int(self.capture.reset_positions[self.next_reset])
+
+        if not math.isinf(self.speed):
+            replay_time = (
+                self.recorded_start + (time.monotonic() - self.started_at) * self.speed
+            )
+            num_arrived = np.searchsorted(
+                self.capture.data_times, replay_time, side="right"
+            )
+            limit = min(
+                limit,
+                int(self.capture.data_ends[num_arrived - 1]) if num_arrived else 0,
+            )
+
+        return max(limit, self.position)
+
+    @property
+    def in_waiting(self) -> int:
+        return self._get_limit() - self.position
+
+    def _get_wait_time(self) -> float:
+        """seconds until the next chunk arrives, inf if it won't without a reset (or there are no chunks left)"""
+        if self.next_reset < len(self.capture.reset_positions) and self.position >= int(
+            self.capture.reset_positions[self.next_reset]
+        ):
+            return math.inf
+
+        next_chunk = np.searchsorted(
+            self.capture.data_ends, self.position, side="right"
+        )
+        if next_chunk >= len(self.capture.data_times):
+            return math.inf
+
+        recorded_wait = self.capture.data_times[next_chunk] - self.recorded_start
+        return max(
+            0.0, recorded_wait / self.speed - (time.monotonic() - self.started_at)
+        )
+
+    def read(self, size: int = 1) -> bytes:
+        """like Serial.read, waits up to the timeout for the first byte"""
+        if self.in_waiting == 0:
+            wait_time = self._get_wait_time()
+            if wait_time == math.inf:
+                # nothing more is coming, only wait as long as a port would when replaying in real time
+                if not math.isinf(self.speed):
+                    time.sleep(self.timeout)
+                return b""
+            time.sleep(min(wait_time, self.timeout))
+
+        size = min(size, self.in_waiting)
+        data = self.capture.stream[self.position : self.position + size]
+        self.position += size
+        return data
+
+    def readinto(self, buffer) -> int:
+        count = min(len(buffer), self.in_waiting)
+        buffer[:count] = self.capture.stream[self.position : self.position + count]
+        self.position += count
+        return count
+
+    def reset_input_buffer(self) -> None:
+        """skip to the next reset in the capture, and carry on the replay's clock from there"""
+        if self.next_reset >= len(self.capture.reset_positions):
+            return
+
+        self.position = max(
+            self.position, int(self.capture.reset_positions[self.next_reset])
+        )
+        self.recorded_start = self.capture.reset_times[self.next_reset]
+        self.started_at = time.monotonic()
+        self.next_reset += 1
+
+    def close(self) -> None:
+        pass
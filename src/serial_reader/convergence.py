@@ -0,0 +1,136 @@
+import numpy as np
+
+from cal import cal
+from profiling import profiler
+from serial_reader import reading_store
+
+# seconds of samples the drift of a step is measured over
+DEFAULT_SETTLE_WINDOW = 0.5
+
+
+class ConvergenceCriteria:
+    """Decides when a pressure step has settled and when enough readings have been taken.
+
+    A step is settled once a straight line through the last `settle_window` seconds of samples of every PT shows no
+    real drift, and it is done once every PT's standard error of the mean is below the tolerance (or `max_readings`
+    is reached). A step that still hasn't settled once the window has filled and `max_readings` samples have been
+    seen is taken anyway, and marked as unsettled
+    """
+
+    def __init__(
+        self,
+        tolerance: float,
+        min_readings: int,
+        max_readings: int,
+        settle_window: float = DEFAULT_SETTLE_WINDOW,
+    ):
+        if min_readings < 3:
+            raise ValueError("At least 3 readings are needed to detect drift")
+
+        if settle_window <= 0:
+            raise ValueError(f"Settle window ({settle_window}s) must be positive")
+
+        if max_readings < min_readings:
+            raise ValueError(
+                f"Max readings ({max_readings}) must not be less than min readings ({min_readings})"
+            )
+
+        self.tolerance = tolerance
+        self.min_readings = min_readings
+        self.max_readings = max_readings
+        self.settle_window = settle_window
+
+    def is_settled(self, window: np.ndarray, timestamps: np.ndarray) -> bool:
+        """check the (n x num_sensors) block of the samples of the last settle_window seconds for drift"""
+        if len(window) < self.min_readings:
+            return False
+
+        elapsed = timestamps - timestamps[0]
+        fit = cal.calculate_linear_regressions(elapsed, window)
+        drift = np.abs(fit.slopes) * elapsed[-1]
+        # drift that is within the tolerance or indistinguishable from noise is fine
+        return bool(
+            np.all(
+                (drift <= self.tolerance) | (np.abs(fit.slopes) <= 3 * fit.slope_stderr)
+            )
+        )
+
+    def get_sem(self, store: reading_store.ReadingStore) -> np.ndarray:
+        if store.count < 2:
+            return np.full(store.num_sensors, np.inf)
+
+        return store.get_std() / np.sqrt(store.count)
+
+    def is_converged(self, store: reading_store.ReadingStore) -> bool:
+        if store.count >= self.max_readings:
+            return True
+
+        if store.count < self.min_readings:
+            return False
+
+        return bool(np.all(self.get_sem(store) <= self.tolerance))
+
+    def get_progress(self, store: reading_store.ReadingStore) -> float:
+        """how close the step is to converging, between 0 and 1"""
+        count_progress = min(1.0, store.count / self.min_readings)
+        sem = self.get_sem(store)
+        with np.errstate(divide="ignore"):
+            sem_progress = float(np.min(np.minimum(1.0, self.tolerance / sem)))
+
+        return max(min(count_progress, sem_progress), store.count / self.max_readings)
+
+
+class SettleDetector:
+    """Holds back the samples of a step until the signal has settled after a pressure change"""
+
+    def __init__(self, criteria: ConvergenceCriteria, num_sensors: int):
+        self.criteria = criteria
+        self.window = np.empty((0, num_sensors), dtype=np.float64)
+        self.window_timestamps = np.empty(0, dtype=np.float64)
+        # monotonic time of the first sample pushed, drift can't be judged (nor the step forced) until settle_window
+        # seconds have passed
+        self.first_timestamp: float | None = None
+        self.num_seen = 0
+        self.settled = False
+        # set when the step was let through because max_readings samples went by without it settling
+        self.forced = False
+
+    @profiler.traced
+    def push(
+        self, rows: np.ndarray, timestamps: np.ndarray
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """returns the (rows, timestamps) that can be used for the step, which is nothing until the signal settles"""
+        if self.settled:
+            return rows, timestamps
+
+        if len(rows) == 0:
+            return rows, timestamps
+        if self.first_timestamp is None:
+            self.first_timestamp = float(timestamps[0])
+
+        self.num_seen += len(rows)
+        self.window = np.concatenate((self.window, rows))
+        self.window_timestamps = np.concatenate((self.window_timestamps, timestamps))
+        window_start = self.window_timestamps[-1] - self.criteria.settle_window
+        first = int(np.searchsorted(self.window_timestamps, window_start))
+        self.window = self.window[first:]
+        self.window_timestamps = self.window_timestamps[first:]
+
+        if window_start < self.first_timestamp:
+            return rows[:0], timestamps[:0]
+
+        if self.criteria.is_settled(self.window, self.window_timestamps):
+            self.settled = True
+        elif self.num_seen >= self.criteria.max_readings:
+            # don't hold the step up forever on a channel that never settles, but don't pass it off as settled
+            self.settled = True
+            self.forced = True
+
+        if self.settled:
+            # the latest samples are the closest to the settled signal
+            return (
+                self.window[-self.criteria.max_readings :],
+                self.window_timestamps[-self.criteria.max_readings :],
+            )
+
+        return rows[:0], timestamps[:0]
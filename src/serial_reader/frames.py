@@ -0,0 +1,243 @@
+"""
+Binary frames, for boards with more channels than "v1, v2, ..." lines can carry at the baud rate. Every frame is
+
+    sync word   0xA5 0x5A
+    sequence    uint16, one more than the previous frame's (wrapping around), so dropped frames show up as gaps
+    channels    uint8, number of values
+    value type  uint8, FLOAT32 or INT32
+    values      channels x 4 bytes
+    crc         uint32, CRC-32 (as zlib.crc32) of everything from the sequence to the last value
+
+all little endian. A board always sends frames of the same size, so runs of them are decoded in bulk with
+np.frombuffer and the decoder only searches byte by byte for the sync word after a corrupted frame
+"""
+
+import struct, zlib
+
+import numpy as np
+
+from profiling import profiler
+
+SYNC = b"\xa5\x5a"
+HEADER = struct.Struct("<2sHBB")
+CRC = struct.Struct("<I")
+VALUE_SIZE = 4
+SEQUENCE_MODULUS = 1 << 16
+
+# value types
+FLOAT32 = 0
+INT32 = 1
+VALUE_DTYPES = {FLOAT32: "<f4", INT32: "<i4"}
+
+# what a port speaks, AUTO works it out from the first bytes received
+AUTO = "auto"
+ASCII = "ascii"
+BINARY = "binary"
+PROTOCOLS = (AUTO, ASCII, BINARY)
+
+
+def get_frame_size(num_channels: int) -> int:
+    return HEADER.size + num_channels * VALUE_SIZE + CRC.size
+
+
+def get_frame_dtype(num_channels: int, value_type: int) -> np.dtype:
+    return np.dtype(
+        [
+            ("sync", "S2"),
+            ("sequence", "<u2"),
+            ("num_channels", "u1"),
+            ("value_type", "u1"),
+            ("values", VALUE_DTYPES[value_type], (num_channels,)),
+            ("crc", "<u4"),
+        ]
+    )
+
+
+def encode_frames(
+    values: np.ndarray, first_sequence: int = 0, value_type: int = FLOAT32
+) -> bytes:
+    """pack rows of values, shape (n_frames, n_channels), into consecutive frames"""
+    num_frames, num_channels = values.shape
+    frames = np.zeros(num_frames, dtype=get_frame_dtype(num_channels, value_type))
+    frames["sync"] = SYNC
+    frames["sequence"] = (first_sequence + np.arange(num_frames)) % SEQUENCE_MODULUS
+    frames["num_channels"] = num_channels
+    frames["value_type"] = value_type
+    frames["values"] = values
+
+    data = memoryview(frames).cast("B")
+    frame_size = get_frame_size(num_channels)
+    for index in range(num_frames):
+        start = index * frame_size
+        frames["crc"][index] = zlib.crc32(
+            data[start + len(SYNC) : start + frame_size - CRC.size]
+        )
+
+    return frames.tobytes()
+
+
+class FrameDecoder:
+    """Pulls the frames of one board out of the bytes read from its port"""
+
+    def __init__(self, num_channels: int):
+        self.num_channels = num_channels
+        self.frame_size = get_frame_size(num_channels)
+        self.dtypes = {
+            value_type: get_frame_dtype(num_channels, value_type)
+            for value_type in VALUE_DTYPES
+        }
+        # sequence number of the last frame decoded, None until one has been since the last reset
+        self.last_sequence: int | None = None
+        # frames the board has sent since the decoder was created going by the sequence numbers, so that they keep
+        # counting up once the 16 bit sequence number wraps around
+        self.num_sent = 0
+
+    def reset(self) -> None:
+        """frames missed while the input was being thrown away don't count as dropped"""
+        self.last_sequence = None
+
+    def _count_valid_crcs(
+        self, data: memoryview, start: int, frames: np.ndarray
+    ) -> int:
+        """number of frames from the first one that have a valid CRC.
+
+        zlib can only checksum one buffer at a time, so this is a Python loop over the frames, and it is what limits
+        decoding: about 1.5M frames/s of 8 channels, against about 10M/s for the rest of decode. A board would need a
+        vectorised CRC (or none) to be decoded any faster
+        """
+        for index, crc in enumerate(frames["crc"].tolist()):
+            frame_start = start + index * self.frame_size
+            checked = data[
+                frame_start + len(SYNC) : frame_start + self.frame_size - CRC.size
+            ]
+            if zlib.crc32(checked) != crc:
+                return index
+
+        return len(frames)
+
+    def _unwrap(self, sequences: np.ndarray) -> tuple[np.ndarray, int]:
+        """(the frames' unwrapped sequence numbers, frames missing between them). A jump backwards (e.g. the board
+        restarting) counts as none missing, and so does the jump after a reset
+        """
+        sequences = sequences.astype(np.int64)
+        if self.last_sequence is not None:
+            sequences = np.concatenate(([self.last_sequence], sequences))
+        else:
+            sequences = np.concatenate(([sequences[0] - 1], sequences))
+        self.last_sequence = int(sequences[-1])
+
+        gaps = (np.diff(sequences) - 1) % SEQUENCE_MODULUS
+        gaps[gaps >= SEQUENCE_MODULUS // 2] = 0
+        unwrapped = self.num_sent + np.cumsum(gaps + 1)
+        self.num_sent = int(unwrapped[-1])
+        return unwrapped, int(gaps.sum())
+
+    @profiler.traced
+    def decode(
+        self, data: bytes | memoryview
+    ) -> tuple[np.ndarray, int, int, int, int, np.ndarray]:
+        """
+        Decode every complete frame in data.
+
+        Returns:
+            (rows, num_consumed, num_wrong_channels, num_bad_crcs, num_dropped, sequences): the values of the frames,
+            shape (n_frames, num_channels), how many bytes of data were used up (the rest is the start of a frame that
+            hasn't fully arrived), how many frames had the wrong number of channels or a bad CRC, how many frames
+            are missing going by the sequence numbers, and the unwrapped sequence number of every frame
+        """
+        data = memoryview(data).cast("B")
+        all_values = []
+        all_sequences = []
+        num_wrong_channels = 0
+        num_bad_crcs = 0
+        position = 0
+        while len(data) - position >= self.frame_size:
+            sync, _, num_channels, value_type = HEADER.unpack_from(data, position)
+            if sync != SYNC:
+                next_sync = bytes(data[position + 1 :]).find(SYNC)
+                if next_sync < 0:
+                    # the last byte may be the first half of the next sync word
+                    position = len(data) - 1
+                    break
+                position += 1 + next_sync
+                continue
+
+            if num_channels != self.num_channels or value_type not in self.dtypes:
+                num_wrong_channels += 1
+                position += 1
+                continue
+
+            # every frame that follows is most likely another good one, check them all at once
+            num_frames = (len(data) - position) // self.frame_size
+            frames = np.frombuffer(
+                data, dtype=self.dtypes[value_type], count=num_frames, offset=position
+            )
+            valid = (
+                (frames["sync"] == SYNC)
+                & (frames["num_channels"] == self.num_channels)
+                & (frames["value_type"] == value_type)
+            )
+            if not valid.all():
+                num_frames = int(np.argmin(valid))
+            num_valid = self._count_valid_crcs(data, position, frames[:num_frames])
+
+            if num_valid == 0:
+                num_bad_crcs += 1
+                position += 1
+                continue
+
+            all_values.append(frames["values"][:num_valid].astype(np.float64))
+            all_sequences.append(frames["sequence"][:num_valid])
+            position += num_valid * self.frame_size
+
+        if not all_values:
+            return (
+                np.empty((0, self.num_channels), dtype=np.float64),
+                position,
+                num_wrong_channels,
+                num_bad_crcs,
+                0,
+                np.empty(0, dtype=np.int64),
+            )
+
+        sequences, num_dropped = self._unwrap(np.concatenate(all_sequences))
+        return (
+            np.concatenate(all_values),
+            position,
+            num_wrong_channels,
+            num_bad_crcs,
+            num_dropped,
+            sequences,
+        )
+
+
+def sniff_frame_format(data: bytes, min_frames: int = 2) -> int | None:
+    """number of channels if the data is made of frames, None if it doesn't look like it"""
+    position = data.find(SYNC)
+    while 0 <= position <= len(data) - HEADER.size:
+        _, _, num_channels, value_type = HEADER.unpack_from(data, position)
+        if num_channels > 0 and value_type in VALUE_DTYPES:
+            rows = FrameDecoder(num_channels).decode(data[position:])[0]
+            if len(rows) >= min_frames:
+                return num_channels
+
+        position = data.find(SYNC, position + 1)
+
+    return None
+
+
+def detect_protocol(data: bytes, num_channels: int) -> str | None:
+    """BINARY once a whole valid frame has arrived, ASCII once there are complete lines and nothing that looks like a
+    frame, None while it can't be told yet
+    """
+    if SYNC in data:
+        if len(FrameDecoder(num_channels).decode(data)[0]):
+            return BINARY
+        # a frame should have come through by now if there was one
+        if len(data) < 2 * get_frame_size(num_channels):
+            return None
+
+    if data.count(b"\n") >= 2:
+        return ASCII
+
+    return None
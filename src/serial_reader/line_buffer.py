@@ -0,0 +1,121 @@
+import numpy as np
+
+from profiling import profiler
+
+
+class LineBuffer:
+    """preallocated byte buffer that serial data is drained into and complete lines are sliced out of"""
+
+    def __init__(self, capacity: int = 1 << 16):
+        self.buffer = bytearray(capacity)
+        self.view = memoryview(self.buffer)
+        self.capacity = capacity
+        self.start = 0
+        self.end = 0
+        # after a reset the first line in the buffer is most likely partial, so drop it
+        self.skip_partial = False
+        self.dropped_bytes = 0
+
+    def clear(self, skip_partial: bool = True) -> None:
+        self.start = 0
+        self.end = 0
+        self.skip_partial = skip_partial
+
+    def __len__(self) -> int:
+        return self.end - self.start
+
+    def is_full(self) -> bool:
+        return self.end - self.start == self.capacity
+
+    def writable(self, num_bytes: int) -> memoryview:
+        """return a view that up to num_bytes can be read into, as many as there is room for. Old data is only dropped
+        when the buffer is full of it, i.e. it holds nothing but part of a line larger than the buffer
+        """
+        if self.capacity - self.end < num_bytes:
+            # move the unconsumed tail to the front of the buffer
+            remaining = self.end - self.start
+            self.buffer[:remaining] = self.view[self.start : self.end]
+            self.start = 0
+            self.end = remaining
+
+        if self.is_full():
+            # a single line larger than the buffer is garbage, throw it away
+            self.dropped_bytes += self.end - self.start
+            self.clear()
+
+        return self.view[self.end : min(self.end + num_bytes, self.capacity)]
+
+    def commit(self, num_bytes: int) -> None:
+        """mark num_bytes of the last writable view as filled"""
+        self.end += num_bytes
+
+    def peek(self) -> memoryview:
+        """everything in the buffer, without removing it"""
+        return self.view[self.start : self.end]
+
+    def consume(self, num_bytes: int) -> None:
+        """remove num_bytes from the front of the buffer"""
+        self.start += num_bytes
+        if self.start == self.end:
+            self.start = self.end = 0
+
+    def extend(self, data: bytes) -> None:
+        """append data that fits in the buffer"""
+        self.writable(len(data))[: len(data)] = data
+        self.commit(len(data))
+
+    @profiler.traced
+    def pop_lines(self) -> list[bytes]:
+        """remove and return every complete line in the buffer, leaving any trailing partial line"""
+        last_newline = self.buffer.rfind(b"\n", self.start, self.end)
+        if last_newline < 0:
+            return []
+
+        chunk = bytes(self.view[self.start : last_newline])
+        self.start = last_newline + 1
+        if self.start == self.end:
+            self.start = self.end = 0
+
+        lines = chunk.split(b"\n")
+        if self.skip_partial:
+            self.skip_partial = False
+            lines = lines[1:]
+
+        return lines
+
+
+@profiler.traced
+def parse_lines(lines: list[bytes], num_sensors: int) -> tuple[np.ndarray, int, int]:
+    """parse "v1, v2, ..." lines into an (n_lines x num_sensors) array.
+    Returns the array, the number of lines with the wrong number of values and the number of lines with a value that isn't a number
+    """
+    expected_commas = num_sensors - 1
+    valid = [line for line in lines if line.count(b",") == expected_commas]
+    num_wrong_columns = len(lines) - len(valid)
+
+    if not valid:
+        return np.empty((0, num_sensors), dtype=np.float64), num_wrong_columns, 0
+
+    try:
+        values = np.array(b",".join(valid).split(b",")).astype(np.float64)
+        return values.reshape(len(valid), num_sensors), num_wrong_columns, 0
+    except ValueError:
+        pass
+
+    # at least one line has a bad value in it, fall back to parsing line by line to find it
+    rows = []
+    num_decode_errors = 0
+    for line in valid:
+        try:
+            rows.append(np.array(line.split(b",")).astype(np.float64))
+        except ValueError:
+            num_decode_errors += 1
+
+    if not rows:
+        return (
+            np.empty((0, num_sensors), dtype=np.float64),
+            num_wrong_columns,
+            num_decode_errors,
+        )
+
+    return np.vstack(rows), num_wrong_columns, num_decode_errors
@@ -0,0 +1,214 @@
+import asyncio, json, os, time
+
+import numpy as np
+
+# upper bounds (in seconds) of the step latency histogram buckets, the last bucket catches everything above
+STEP_LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+# counters that are also reported as a rate per second
+RATE_COUNTERS = ("bytes_read", "lines_read")
+
+
+class ReaderMetrics:
+    """Counters and gauges describing how well a single port is being read.
+
+    Updating them is a handful of additions, so they are always on. Rates are worked out from two snapshots
+    (see get_rates) so that any number of consumers can sample them at their own pace
+    """
+
+    def __init__(self, buffer_capacity: int):
+        self.started_at = time.monotonic()
+        self.bytes_read = 0
+        # lines that were parsed into a set of readings
+        self.lines_read = 0
+        # lines with a value that isn't a number, e.g. corrupted bytes
+        self.decode_errors = 0
+        # lines with the wrong number of values, e.g. partial lines
+        self.wrong_column_lines = 0
+        # binary frames missing going by their sequence numbers
+        self.dropped_frames = 0
+        # reads that came back without a single valid line, and the time spent waiting before trying again
+        self.retries = 0
+        self.backoff_time = 0.0
+        self.buffer_capacity = buffer_capacity
+        self.buffer_used = 0
+        self.max_buffer_used = 0
+        self.steps = 0
+        self.step_latency_sum = 0.0
+        self.step_latency_counts = np.zeros(
+            len(STEP_LATENCY_BUCKETS) + 1, dtype=np.int64
+        )
+        # the last snapshot of a reader in another process that this one mirrors, see load_snapshot
+        self.loaded_snapshot: dict | None = None
+
+    def record_read(
+        self,
+        num_bytes: int,
+        num_lines: int,
+        num_wrong_columns: int,
+        num_decode_errors: int,
+        buffer_used: int,
+        num_dropped_frames: int = 0,
+    ) -> None:
+        self.bytes_read += num_bytes
+        self.lines_read += num_lines
+        self.wrong_column_lines += num_wrong_columns
+        self.decode_errors += num_decode_errors
+        self.dropped_frames += num_dropped_frames
+        self.buffer_used = buffer_used
+        self.max_buffer_used = max(self.max_buffer_used, buffer_used)
+
+    def record_retry(self, backoff_time: float) -> None:
+        self.retries += 1
+        self.backoff_time += backoff_time
+
+    def record_step(self, latency: float) -> None:
+        self.steps += 1
+        self.step_latency_sum += latency
+        self.step_latency_counts[
+            np.searchsorted(STEP_LATENCY_BUCKETS, latency, side="left")
+        ] += 1
+
+    def get_step_latency_quantile(self, quantile: float) -> float:
+        """upper bound of the histogram bucket the quantile falls into, inf if it's in the last bucket"""
+        if self.steps == 0:
+            return np.nan
+
+        bucket = np.searchsorted(
+            np.cumsum(self.step_latency_counts), quantile * self.steps, side="left"
+        )
+        return (*STEP_LATENCY_BUCKETS, np.inf)[bucket]
+
+    def load_snapshot(self, snapshot: dict) -> None:
+        """take on the metrics of a reader in another process, e.g. the acquisition daemon's. Snapshots are then that
+        reader's, so rates are worked out between the times it took them
+        """
+        self.loaded_snapshot = snapshot
+        self.steps = snapshot["steps"]
+        self.step_latency_counts = np.array(
+            snapshot["step_latency_counts"], dtype=np.int64
+        )
+
+    def snapshot(self) -> dict:
+        if self.loaded_snapshot is not None:
+            return dict(self.loaded_snapshot)
+
+        return {
+            "time": time.monotonic(),
+            "uptime_s": time.monotonic() - self.started_at,
+            "bytes_read": self.bytes_read,
+            "lines_read": self.lines_read,
+            "decode_errors": self.decode_errors,
+            "wrong_column_lines": self.wrong_column_lines,
+            "dropped_frames": self.dropped_frames,
+            "retries": self.retries,
+            "backoff_s": self.backoff_time,
+            "buffer_used": self.buffer_used,
+            "max_buffer_used": self.max_buffer_used,
+            "buffer_capacity": self.buffer_capacity,
+            "steps": self.steps,
+            "step_latency_sum_s": self.step_latency_sum,
+            "step_latency_counts": self.step_latency_counts.tolist(),
+        }
+
+
+def get_rates(previous: dict | None, current: dict) -> dict[str, float]:
+    """per second rates of the counters between two snapshots, or since the reader was created"""
+    if previous is None:
+        elapsed = current["uptime_s"]
+        previous = {counter: 0 for counter in RATE_COUNTERS}
+    else:
+        elapsed = current["time"] - previous["time"]
+
+    if elapsed <= 0:
+        return {f"{counter}_per_s": 0.0 for counter in RATE_COUNTERS}
+
+    return {
+        f"{counter}_per_s": (current[counter] - previous[counter]) / elapsed
+        for counter in RATE_COUNTERS
+    }
+
+
+def format_prometheus(snapshots: dict[str, dict]) -> str:
+    """the snapshots of every reader, by reader id, in the Prometheus text exposition format"""
+    metrics = (
+        ("bytes_read", "counter", "Bytes read from the port"),
+        ("lines_read", "counter", "Lines parsed into a set of readings"),
+        ("decode_errors", "counter", "Lines with a value that is not a number"),
+        ("wrong_column_lines", "counter", "Lines with the wrong number of values"),
+        ("dropped_frames", "counter", "Binary frames missing from the sequence"),
+        ("retries", "counter", "Reads without a single valid line"),
+        ("backoff_s", "counter", "Seconds spent waiting after reads without data"),
+        ("buffer_used", "gauge", "Bytes waiting in the line buffer"),
+        ("max_buffer_used", "gauge", "Most bytes ever waiting in the line buffer"),
+        ("buffer_capacity", "gauge", "Size of the line buffer in bytes"),
+    )
+
+    lines = []
+    for name, metric_type, description in metrics:
+        lines.append(f"# HELP autocal_{name} {description}")
+        lines.append(f"# TYPE autocal_{name} {metric_type}")
+        for reader_id, snapshot in snapshots.items():
+            lines.append(f'autocal_{name}{{reader="{reader_id}"}} {snapshot[name]}')
+
+    lines.append("# HELP autocal_step_latency_s Seconds taken to read a pressure step")
+    lines.append("# TYPE autocal_step_latency_s histogram")
+    for reader_id, snapshot in snapshots.items():
+        cumulative_counts = np.cumsum(snapshot["step_latency_counts"])
+        for bound, count in zip((*STEP_LATENCY_BUCKETS, "+Inf"), cumulative_counts):
+            lines.append(
+                f'autocal_step_latency_s_bucket{{reader="{reader_id}",le="{bound}"}} {count}'
+            )
+        lines.append(
+            f'autocal_step_latency_s_sum{{reader="{reader_id}"}} {snapshot["step_latency_sum_s"]}'
+        )
+        lines.append(
+            f'autocal_step_latency_s_count{{reader="{reader_id}"}} {snapshot["steps"]}'
+        )
+
+    return "\n".join(lines) + "\n"
+
+
+class MetricsExporter:
+    """Periodically writes the metrics of a set of readers to <path>.prom (replaced on every export, for a
+    node exporter textfile collector to pick up) and appends them to <path>.jsonl
+    """
+
+    def __init__(self, readers: list, path: str, interval: float = 5.0):
+        self.readers = readers
+        self.path = path
+        self.interval = interval
+        self.previous_snapshots: dict[str, dict] = {}
+
+    def export(self) -> None:
+        snapshots = {
+            reader.get_pt_id(): reader.metrics.snapshot() for reader in self.readers
+        }
+
+        # write the whole file and then swap it in, so it is never read half written
+        prom_path = f"{self.path}.prom"
+        with open(f"{prom_path}.tmp", "w") as prom_file:
+            prom_file.write(format_prometheus(snapshots))
+        os.replace(f"{prom_path}.tmp", prom_path)
+
+        with open(f"{self.path}.jsonl", "a") as jsonl_file:
+            wall_time = time.time()
+            for reader_id, snapshot in snapshots.items():
+                record = {
+                    "reader": reader_id,
+                    "timestamp": wall_time,
+                    **snapshot,
+                    **get_rates(self.previous_snapshots.get(reader_id), snapshot),
+                }
+                jsonl_file.write(json.dumps(record) + "\n")
+
+        self.previous_snapshots = snapshots
+
+    async def run(self) -> None:
+        """export every interval until cancelled, and once more on the way out"""
+        try:
+            while True:
+                await asyncio.sleep(self.interval)
+                self.export()
+        finally:
+            self.export()
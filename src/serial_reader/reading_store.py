@@ -0,0 +1,223 @@
+import numpy as np
+
+from cal import cal, robust
+from profiling import profiler
+
+
+class ReadingStore:
+    """Array backed store for the raw readings of the current pressure step and the averages of every previous step.
+
+    Running mean/variance/min/max (Welford) are updated as each row arrives so that averaging a step is O(num_sensors).
+    With one of the robust averaging methods the step is averaged from its block of samples instead, and the samples
+    that were left out are recorded
+    """
+
+    __slots__ = (
+        "num_sensors",
+        "num_readings_per_pt",
+        "block",
+        "timestamps",
+        "count",
+        "last_count",
+        "mean",
+        "m2",
+        "min",
+        "max",
+        "pressures",
+        "avgs",
+        "stds",
+        "num_steps",
+        "averaging",
+        "rejected",
+        "num_rejected",
+        "step_settled",
+        "settled",
+        "running_fit",
+    )
+
+    def __init__(
+        self,
+        num_sensors: int,
+        num_readings_per_pt: int,
+        initial_steps: int = 16,
+        averaging: str = robust.MEAN,
+    ):
+        if averaging not in robust.AVERAGING_METHODS:
+            raise ValueError(
+                f"Unknown averaging method {averaging}, expected one of {', '.join(robust.AVERAGING_METHODS)}"
+            )
+
+        self.num_sensors = num_sensors
+        self.num_readings_per_pt = num_readings_per_pt
+
+        # raw readings for the current pressure step
+        self.block = np.empty((num_readings_per_pt, num_sensors), dtype=np.float64)
+        self.timestamps = np.empty(num_readings_per_pt, dtype=np.float64)
+        self.count = 0
+        # number of readings in the step that was last finished, its block stays valid until the next step starts
+        self.last_count = 0
+        self.mean = np.zeros(num_sensors, dtype=np.float64)
+        self.m2 = np.zeros(num_sensors, dtype=np.float64)
+        self.min = np.full(num_sensors, np.inf)
+        self.max = np.full(num_sensors, -np.inf)
+
+        # one row per completed pressure step
+        self.pressures = np.empty(initial_steps, dtype=np.float64)
+        self.avgs = np.empty((initial_steps, num_sensors), dtype=np.float64)
+        self.stds = np.empty((initial_steps, num_sensors), dtype=np.float64)
+        self.num_steps = 0
+
+        self.averaging = averaging
+        # which samples of the step that was last finished were left out of its average
+        self.rejected = np.zeros((0, num_sensors), dtype=bool)
+        # number of samples left out of each step
+        self.num_rejected = np.zeros((initial_steps, num_sensors), dtype=np.int64)
+        # cleared when the current step is taken before its signal settled (see convergence.SettleDetector)
+        self.step_settled = True
+        # whether each step had settled
+        self.settled = np.ones(initial_steps, dtype=bool)
+        # least squares fit of the step averages against their pressures, updated as each step is recorded
+        self.running_fit = cal.RunningLinearFit(num_sensors)
+
+    def clear_step(self) -> None:
+        self.count = 0
+        self.step_settled = True
+        self.mean.fill(0)
+        self.m2.fill(0)
+        self.min.fill(np.inf)
+        self.max.fill(-np.inf)
+
+    def is_full(self) -> bool:
+        return self.count >= self.num_readings_per_pt
+
+    def add_row(self, row: np.ndarray, timestamp: float = np.nan) -> None:
+        """add a single set of readings (one per sensor) to the current step"""
+        if self.is_full():
+            raise ValueError(
+                f"Already have {self.num_readings_per_pt} readings for the current step"
+            )
+
+        self.block[self.count] = row
+        self.timestamps[self.count] = timestamp
+        self.count += 1
+
+        delta = row - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (row - self.mean)
+        np.minimum(self.min, row, out=self.min)
+        np.maximum(self.max, row, out=self.max)
+
+    @profiler.traced
+    def add_rows(
+        self, rows: np.ndarray, timestamps: np.ndarray | float = np.nan
+    ) -> int:
+        """add as many rows as fit into the current step, returns the number of rows taken"""
+        rows = rows[: self.num_readings_per_pt - self.count]
+        num_rows = len(rows)
+        if num_rows == 0:
+            return 0
+
+        self.block[self.count : self.count + num_rows] = rows
+        if np.ndim(timestamps):
+            timestamps = timestamps[:num_rows]
+        self.timestamps[self.count : self.count + num_rows] = timestamps
+
+        # merge the batch statistics into the running ones (Chan et al.)
+        batch_mean = rows.mean(axis=0)
+        batch_m2 = ((rows - batch_mean) ** 2).sum(axis=0)
+        total = self.count + num_rows
+        delta = batch_mean - self.mean
+        self.mean += delta * (num_rows / total)
+        self.m2 += batch_m2 + delta**2 * (self.count * num_rows / total)
+        self.count = total
+
+        np.minimum(self.min, rows.min(axis=0), out=self.min)
+        np.maximum(self.max, rows.max(axis=0), out=self.max)
+        return num_rows
+
+    def get_step_readings(self) -> np.ndarray:
+        return self.block[: self.count]
+
+    def get_step_timestamps(self) -> np.ndarray:
+        return self.timestamps[: self.count]
+
+    def get_last_step(self) -> tuple[np.ndarray, np.ndarray]:
+        """(timestamps, readings) of the step that was just finished"""
+        return self.timestamps[: self.last_count], self.block[: self.last_count]
+
+    def get_std(self) -> np.ndarray:
+        """sample standard deviation of each sensor over the current step"""
+        if self.count < 2:
+            return np.zeros(self.num_sensors, dtype=np.float64)
+
+        return np.sqrt(self.m2 / (self.count - 1))
+
+    @profiler.traced
+    def finish_step(self, pressure: float) -> tuple[np.ndarray, np.ndarray]:
+        """record the mean and std of the current step against the pressure, then clear the step"""
+        if self.averaging == robust.MEAN:
+            self.rejected = np.zeros((self.count, self.num_sensors), dtype=bool)
+            self.record_step(
+                pressure, self.mean, self.get_std(), settled=self.step_settled
+            )
+        else:
+            mean, std, self.rejected = robust.average_step(
+                self.get_step_readings(), self.averaging
+            )
+            self.record_step(
+                pressure,
+                mean,
+                std,
+                self.rejected.sum(axis=0),
+                settled=self.step_settled,
+            )
+
+        self.last_count = self.count
+        self.clear_step()
+        return self.avgs[self.num_steps - 1], self.stds[self.num_steps - 1]
+
+    def record_step(
+        self,
+        pressure: float,
+        mean: np.ndarray,
+        std: np.ndarray,
+        num_rejected: np.ndarray | int = 0,
+        settled: bool = True,
+    ) -> None:
+        """add the results of a step, e.g. one restored from a previous session"""
+        if self.num_steps == len(self.pressures):
+            self._grow()
+
+        self.pressures[self.num_steps] = pressure
+        self.avgs[self.num_steps] = mean
+        self.stds[self.num_steps] = std
+        self.num_rejected[self.num_steps] = num_rejected
+        self.settled[self.num_steps] = settled
+        self.num_steps += 1
+        self.running_fit.add(pressure, self.avgs[self.num_steps - 1])
+
+    def _grow(self) -> None:
+        new_size = 2 * len(self.pressures)
+        self.pressures = np.resize(self.pressures, new_size)
+        self.avgs = np.resize(self.avgs, (new_size, self.num_sensors))
+        self.stds = np.resize(self.stds, (new_size, self.num_sensors))
+        self.num_rejected = np.resize(self.num_rejected, (new_size, self.num_sensors))
+        self.settled = np.resize(self.settled, new_size)
+
+    def get_pressures(self) -> np.ndarray:
+        return self.pressures[: self.num_steps]
+
+    def get_avgs(self) -> np.ndarray:
+        """(n_pressures x num_sensors) matrix of step averages"""
+        return self.avgs[: self.num_steps]
+
+    def get_stds(self) -> np.ndarray:
+        return self.stds[: self.num_steps]
+
+    def get_num_rejected(self) -> np.ndarray:
+        """(n_pressures x num_sensors) matrix of the number of samples left out of each step's average"""
+        return self.num_rejected[: self.num_steps]
+
+    def get_settled(self) -> np.ndarray:
+        """whether each step had settled, False for steps taken anyway when they didn't settle in time"""
+        return self.settled[: self.num_steps]
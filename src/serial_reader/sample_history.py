@@ -0,0 +1,137 @@
+import numpy as np
+
+
+class SampleHistory:
+    """Bounded ring buffer of timestamped readings, oldest samples are overwritten once it is full.
+
+    Samples are addressed by a sequence index that counts every row ever appended, so callers can
+    remember where they left off and pick up only the rows that arrived after that
+    """
+
+    __slots__ = (
+        "num_sensors",
+        "capacity",
+        "values",
+        "timestamps",
+        "sequences",
+        "total",
+    )
+
+    def __init__(self, num_sensors: int, capacity: int = 1 << 14):
+        self.num_sensors = num_sensors
+        self.capacity = capacity
+        self.values = np.empty((capacity, num_sensors), dtype=np.float64)
+        self.timestamps = np.empty(capacity, dtype=np.float64)
+        # the board's sequence number of each sample, -1 for boards that don't send them
+        self.sequences = np.empty(capacity, dtype=np.int64)
+        # number of rows appended since the history was created
+        self.total = 0
+
+    def __len__(self) -> int:
+        return min(self.total, self.capacity)
+
+    def clear(self) -> None:
+        self.total = 0
+
+    def append(
+        self,
+        rows: np.ndarray,
+        timestamps: np.ndarray | float,
+        sequences: np.ndarray | None = None,
+    ) -> None:
+        num_rows = len(rows)
+        if num_rows == 0:
+            return
+
+        timestamps = np.broadcast_to(
+            np.asarray(timestamps, dtype=np.float64), (num_rows,)
+        )
+        sequences = np.broadcast_to(
+            np.asarray(-1 if sequences is None else sequences, dtype=np.int64),
+            (num_rows,),
+        )
+        if num_rows > self.capacity:
+            rows = rows[-self.capacity :]
+            timestamps = timestamps[-self.capacity :]
+            sequences = sequences[-self.capacity :]
+            self.total += num_rows - self.capacity
+            num_rows = self.capacity
+
+        start = self.total % self.capacity
+        first = min(num_rows, self.capacity - start)
+        self.values[start : start + first] = rows[:first]
+        self.timestamps[start : start + first] = timestamps[:first]
+        self.sequences[start : start + first] = sequences[:first]
+
+        # wrap around to the start of the buffer
+        self.values[: num_rows - first] = rows[first:]
+        self.timestamps[: num_rows - first] = timestamps[first:]
+        self.sequences[: num_rows - first] = sequences[first:]
+        self.total += num_rows
+
+    def oldest_index(self) -> int:
+        return max(0, self.total - self.capacity)
+
+    def get_range(
+        self, start: int, end: int | None = None
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """copy out the (timestamps, values) for sequence indices [start, end), clipped to what is still held"""
+        end = self.total if end is None else min(end, self.total)
+        start = max(start, self.oldest_index())
+        if start >= end:
+            return np.empty(0), np.empty((0, self.num_sensors))
+
+        positions = np.arange(start, end) % self.capacity
+        return self.timestamps[positions], self.values[positions]
+
+    def get_sequences(self, start: int, end: int | None = None) -> np.ndarray:
+        """the board's sequence numbers for sequence indices [start, end), as get_range"""
+        end = self.total if end is None else min(end, self.total)
+        start = max(start, self.oldest_index())
+        if start >= end:
+            return np.empty(0, dtype=np.int64)
+
+        return self.sequences[np.arange(start, end) % self.capacity]
+
+    def _search(self, timestamp: float, side: str) -> int:
+        oldest = self.oldest_index()
+        if self.total == oldest:
+            return self.total
+
+        # the held samples are sorted by time from the oldest one on, which is followed by the rest of the buffer and
+        # then its start once it has wrapped around. Searching the two parts in turn saves copying them into one
+        split = oldest % self.capacity
+        older = self.timestamps[split : len(self)]
+        position = int(np.searchsorted(older, timestamp, side=side))
+        if position < len(older):
+            return oldest + position
+
+        newer = self.timestamps[:split]
+        return oldest + len(older) + int(np.searchsorted(newer, timestamp, side=side))
+
+    def index_at(self, timestamp: float) -> int:
+        """sequence index of the first held sample taken at or after the timestamp"""
+        return self._search(timestamp, "left")
+
+    def index_after(self, timestamp: float) -> int:
+        """sequence index of the first held sample taken after the timestamp"""
+        return self._search(timestamp, "right")
+
+    def get_timestamp(self, index: int) -> float:
+        """when the sample with the sequence index was taken, it has to still be held"""
+        return float(self.timestamps[index % self.capacity])
+
+    def get_since(self, timestamp: float) -> tuple[np.ndarray, np.ndarray]:
+        return self.get_range(self.index_at(timestamp))
+
+    def latest(self) -> np.ndarray | None:
+        if self.total == 0:
+            return None
+
+        return self.values[(self.total - 1) % self.capacity]
+
+    def latest_timestamp(self) -> float | None:
+        if self.total == 0:
+            return None
+
+        return self.get_timestamp(self.total - 1)
@@ -1,7 +1,25 @@
 from serial import Serial
 import numpy as np
 import threading, time
-from cal import cal
+from cal import cal, models, robust
+from profiling import profiler
+from serial_reader import (
+    capture,
+    line_buffer,
+    reading_store,
+    sample_history,
+    convergence,
+    frames,
+    metrics,
+)
+
+# number of consecutive reads without a single valid line before giving up
+MAX_EMPTY_READS = 10
+
+
+def make_id(name: str) -> str:
+    # id is different from name because ID must not have spaces
+    return "-".join(name.split(" "))
 
 
 class SerialReader:
@@ -13,99 +31,299 @@ class SerialReader:
         num_readings_per_pt: int,
         name: str,
         timeout: int = 2,
+        buffer_size: int = 1 << 16,
+        history_size: int = 1 << 14,
+        criteria: convergence.ConvergenceCriteria | None = None,
+        averaging: str = robust.MEAN,
+        fit_method: str = robust.LEAST_SQUARES,
+        model_selection: str = models.AICC,
+        port=None,
+        capture_path: str | None = None,
+        protocol: str = frames.AUTO,
     ):
-        self.serial = Serial(serial_port, baudrate=baud_rate, timeout=timeout)
-        self.readings = {i: [] for i in range(num_sensors)}
+        if fit_method not in robust.FIT_METHODS:
+            raise ValueError(
+                f"Unknown fit method {fit_method}, expected one of {', '.join(robust.FIT_METHODS)}"
+            )
+        if model_selection not in models.CRITERIA:
+            raise ValueError(
+                f"Unknown model selection {model_selection}, expected one of {', '.join(models.CRITERIA)}"
+            )
+        if protocol not in frames.PROTOCOLS:
+            raise ValueError(
+                f"Unknown protocol {protocol}, expected one of {', '.join(frames.PROTOCOLS)}"
+            )
+
+        # anything with the same interface as Serial can stand in for the port, e.g. a capture.ReplayPort
+        self.serial = (
+            port
+            if port is not None
+            else Serial(serial_port, baudrate=baud_rate, timeout=timeout)
+        )
+        if capture_path:
+            # every byte read is also written to the capture file, to be replayed later
+            self.serial = capture.CapturingPort(self.serial, capture_path)
+        self.line_buffer = line_buffer.LineBuffer(buffer_size)
+        # "v1, v2, ..." lines or binary frames, see frames.PROTOCOLS. AUTO is replaced once the first bytes show which
+        self.protocol = protocol
+        self.frame_decoder = frames.FrameDecoder(num_sensors)
+        # rows that have been parsed from serial but not yet handed out by read_from_serial
+        self.pending_rows = np.empty((0, num_sensors), dtype=np.float64)
+        self.pending_index = 0
+        # when the port was last drained, every line completed since arrived after it
+        self.last_read_at = time.monotonic()
+        self.rejected_lines = 0
+        self.metrics = metrics.ReaderMetrics(buffer_size)
+        # raw readings of the current step and the averages of all previous steps
+        self.store = reading_store.ReadingStore(
+            num_sensors, num_readings_per_pt, averaging=averaging
+        )
+        # how the steps are fit, see cal.robust.FIT_METHODS
+        self.fit_method = fit_method
+        # how get_model_fit picks each PT's calibration curve, see cal.models.CRITERIA
+        self.model_selection = model_selection
+        # timestamped readings kept by continuous acquisition
+        self.history = sample_history.SampleHistory(num_sensors, history_size)
         self.num_sensors = num_sensors
         self.num_readings_per_pt = num_readings_per_pt
+        # when set, a step stops early once it has settled and converged, and num_readings_per_pt is the cap
+        self.criteria = criteria
         self.serial_lock = threading.Lock()
-        self.all_avgs = {i: [] for i in range(num_sensors)}
         self.name = name
-        # id is different from name because ID must not have spaces
-        self.id = "-".join(name.split(" "))
+        self.id = make_id(name)
 
     def __del__(self):
-        self.serial.close()
+        # the port may have failed to open
+        if hasattr(self, "serial"):
+            self.serial.close()
 
-    def read_from_serial(self, is_first_reading) -> None:
-        """take a reading from serial, and place it into the readings dict"""
-        # clear the current readings first
+    def fileno(self) -> int | None:
+        """file descriptor of the port, if the platform has one that can be waited on"""
+        try:
+            return self.serial.fileno()
+        except (AttributeError, OSError):
+            return None
+
+    def reset_input(self) -> None:
+        """throw away everything received so far, including the potentially incomplete line that follows"""
         with self.serial_lock:
-            # for the first reading of the set, clear the buffer and the first potentially incomplete line
-            if is_first_reading:
-                self.serial.reset_input_buffer()
-
-            readings = None
-            try:
-                # try to take 10 differnt set of readings to get one set of accurate readings
-                for i in range(10):
-                    line = self.serial.read_until(b"\n").decode().strip()
-                    line_readings = line.split(", ")
-                    if len(line_readings) == self.num_sensors:
-                        readings = line_readings
-                        break
-
-                    # increasing wait time if the readings are still not coming in properly
-                    time.sleep(0.3 * (i + 1))
-
-                if not readings:
-                    raise Exception(
-                        f"None of the 10 readings gave the desired set of values. Aborting..."
+            self.serial.reset_input_buffer()
+            self.line_buffer.clear()
+            self.frame_decoder.reset()
+            self.pending_rows = self.pending_rows[:0]
+            self.pending_index = 0
+            self.last_read_at = time.monotonic()
+
+    def _fill_buffer(self, block: bool) -> tuple[int, bool]:
+        """drain the bytes waiting on the port into the line buffer, as many as fit. Blocks for up to the port timeout
+        if nothing is waiting. Returns the number of bytes read, and whether more are left waiting because the buffer
+        filled up
+        """
+        num_read = 0
+        num_waiting = self.serial.in_waiting
+        if num_waiting == 0 and block:
+            # wait for the first byte, then pick up whatever arrived alongside it
+            first_byte = self.serial.read(1)
+            if not first_byte:
+                return 0, False
+            self.line_buffer.extend(first_byte)
+            num_read = 1
+            num_waiting = self.serial.in_waiting
+
+        while num_waiting > 0:
+            count = self.serial.readinto(self.line_buffer.writable(num_waiting))
+            if not count:
+                break
+            self.line_buffer.commit(count)
+            num_read += count
+            num_waiting -= count
+            if num_waiting > 0 and self.line_buffer.is_full():
+                return num_read, True
+
+        return num_read, False
+
+    def read_batch(self, block: bool = True) -> np.ndarray:
+        """read all complete lines (or frames) waiting on the port as an (n_lines x num_sensors) array. Malformed lines
+        and frames are counted and skipped
+        """
+        return self.read_rows(block)[0]
+
+    @profiler.traced
+    def read_rows(self, block: bool = True) -> tuple[np.ndarray, np.ndarray | None]:
+        """read_batch, along with the board's sequence number of every row (None for lines, which don't have any)"""
+        num_bytes = 0
+        buffer_used = 0
+        num_wrong_columns = 0
+        num_decode_errors = 0
+        num_dropped_frames = 0
+        frame_rows = []
+        frame_sequences = []
+        lines = []
+        with self.serial_lock:
+            more_waiting = True
+            while more_waiting:
+                # a backlog larger than the buffer is read a buffer at a time, taking the complete lines or frames
+                # out of it in between
+                num_read, more_waiting = self._fill_buffer(block and num_bytes == 0)
+                num_bytes += num_read
+                buffer_used = max(buffer_used, len(self.line_buffer))
+                if self.protocol == frames.AUTO:
+                    # nothing is taken out of the buffer until it is clear what the board speaks
+                    self.protocol = (
+                        frames.detect_protocol(
+                            bytes(self.line_buffer.peek()), self.num_sensors
+                        )
+                        or frames.AUTO
                     )
 
-            except UnicodeDecodeError:
-                print("Error decoding current sequence, continuing...")
-                return
+                protocol = self.protocol
+                if protocol == frames.BINARY:
+                    (
+                        rows,
+                        num_consumed,
+                        num_wrong_channels,
+                        num_bad_crcs,
+                        num_dropped,
+                        sequences,
+                    ) = self.frame_decoder.decode(self.line_buffer.peek())
+                    self.line_buffer.consume(num_consumed)
+                    frame_rows.append(rows)
+                    frame_sequences.append(sequences)
+                    num_wrong_columns += num_wrong_channels
+                    num_decode_errors += num_bad_crcs
+                    num_dropped_frames += num_dropped
+                elif protocol == frames.ASCII:
+                    lines.extend(self.line_buffer.pop_lines())
 
-        if not readings:
-            raise ValueError(
-                f"Expected {self.num_sensors} readings, but received {len(readings) if readings else readings} | readings: {readings}"
+        sequences = None
+        if protocol == frames.BINARY:
+            rows = np.concatenate(frame_rows)
+            sequences = np.concatenate(frame_sequences)
+        else:
+            rows, num_wrong_columns, num_decode_errors = line_buffer.parse_lines(
+                lines, self.num_sensors
             )
+        self.rejected_lines += num_wrong_columns + num_decode_errors
+        self.metrics.record_read(
+            num_bytes,
+            len(rows),
+            num_wrong_columns,
+            num_decode_errors,
+            buffer_used,
+            num_dropped_frames,
+        )
+        return rows, sequences
 
-        # add the reading to the dict
-        for pt_no, reading in enumerate(readings):
-            self.readings[pt_no].append(np.float64(reading))
+    def _get_timestamps(
+        self, num_rows: int, sequences: np.ndarray | None
+    ) -> np.ndarray:
+        """when each row of a read arrived, as far as the host can tell. The rows are spread out over the time since the
+        previous read, evenly or going by the board's sequence numbers where it sends them. That is only an estimate:
+        a row may have been sent before the previous read, and sat in the USB or kernel buffers until this one
+        """
+        read_at = time.monotonic()
+        drained_at, self.last_read_at = self.last_read_at, read_at
+        if sequences is not None and num_rows > 1 and sequences[-1] > sequences[0]:
+            positions = (sequences - sequences[0] + 1) / (
+                sequences[-1] - sequences[0] + 1
+            )
+        else:
+            positions = np.arange(1, num_rows + 1) / max(num_rows, 1)
+
+        return drained_at + positions * (read_at - drained_at)
+
+    @profiler.traced
+    def poll(self) -> tuple[np.ndarray, np.ndarray]:
+        """read whatever lines are waiting without blocking and record them in the history. Returns (rows, timestamps)"""
+        rows, sequences = self.read_rows(block=False)
+        timestamps = self._get_timestamps(len(rows), sequences)
+        self.history.append(rows, timestamps, sequences)
+        return rows, timestamps
+
+    @profiler.traced
+    def read_from_serial(self, is_first_reading) -> None:
+        """take a reading from serial, and place it into the reading store"""
+        # for the first reading of the set, clear the buffer and the first potentially incomplete line
+        if is_first_reading:
+            self.reset_input()
+
+        empty_reads = 0
+        while self.pending_index >= len(self.pending_rows):
+            if empty_reads >= MAX_EMPTY_READS:
+                raise Exception(
+                    f"No valid set of {self.num_sensors} readings after {MAX_EMPTY_READS} reads ({self.rejected_lines} lines rejected). Aborting..."
+                )
+
+            read_started_at = time.monotonic()
+            self.pending_rows = self.read_batch()
+            self.pending_index = 0
+            if len(self.pending_rows) == 0:
+                self.metrics.record_retry(time.monotonic() - read_started_at)
+            empty_reads += 1
+
+        readings = self.pending_rows[self.pending_index]
+        self.pending_index += 1
 
+        self.store.add_row(readings, time.monotonic())
+
+    @profiler.traced
     def calculate_avg(self, current_pressure: float) -> list[float]:
         """calculate the average reading for the current set of values and clear the reading history"""
-        avg_readings = []
-        for pt_no, readings in self.readings.items():
-            avg_for_pt = np.mean(np.array(readings)).item()
-            avg_readings.append(avg_for_pt)
-            self.all_avgs[pt_no].append((current_pressure, avg_for_pt))
+        avg_readings, _ = self.store.finish_step(current_pressure)
+        return avg_readings.tolist()
 
-            self.readings[pt_no] = []
+    def get_last_std(self) -> list[float]:
+        """standard deviation of each PT over the most recently averaged step"""
+        stds = self.store.get_stds()
+        if len(stds) == 0:
+            return []
 
-        return avg_readings
+        return stds[-1].tolist()
 
     def ready_for_avg(self) -> bool:
-        """crudely check for"""
-        if len(self.readings) <= 0:
+        """check that the current step has a full set of readings"""
+        if self.store.count <= 0:
             raise Exception("No readings recorded for avg calculation")
 
-        for reding_set in self.readings.values():
-            if len(reding_set) != self.num_readings_per_pt:
-                raise Exception(
-                    f"Expected {self.num_readings_per_pt} readings, but only got {len(reding_set)} readings. Reading set: {self.readings}"
-                )
+        required = (
+            self.criteria.min_readings if self.criteria else self.num_readings_per_pt
+        )
+        if self.store.count < required:
+            raise Exception(
+                f"Expected {required} readings, but only got {self.store.count} readings"
+            )
 
         return True
 
+    def get_live_fit(self) -> cal.LinearFit:
+        """least squares fit of every PT against the steps so far, from the running sums kept by the store"""
+        return self.store.running_fit.get_fit()
+
+    @profiler.traced
+    def get_linear_fit(self) -> cal.LinearFit:
+        """fit every PT against the recorded pressures with the reader's fit method. This goes over every step again
+        rather than using the live fit, whose residuals lose precision when the steps are almost on a straight line
+        """
+        return robust.fit_steps(
+            self.store.get_pressures(), self.store.get_avgs(), self.fit_method
+        )
+
+    def get_model_fit(self) -> models.ModelFit:
+        """fit every candidate calibration curve to every PT and pick the best one for each"""
+        return models.fit_models(
+            self.store.get_pressures(),
+            self.store.get_avgs(),
+            criterion=self.model_selection,
+        )
+
+    @profiler.traced
     def get_all_linear_regressions(self) -> dict[int, tuple[float, float]]:
         """returns data in format pt: (m, c)"""
-        linear_regressions = {}
-        for pt, pressure_value_pair in self.all_avgs.items():
-            pressures = []
-            avg_readings = []
-            for pressure, avg_reading in pressure_value_pair:
-                pressures.append(pressure)
-                avg_readings.append(avg_reading)
-
-            linear_regressions[pt] = cal.calculate_linear_regression(
-                pressures, avg_readings
-            )
-
-        return linear_regressions
+        fit = self.get_linear_fit()
+        return {
+            pt: (float(slope), float(intercept))
+            for pt, (slope, intercept) in enumerate(zip(fit.slopes, fit.intercepts))
+        }
 
     def get_pt_name(self) -> str:
         return self.name
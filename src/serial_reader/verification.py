@@ -0,0 +1,53 @@
+import numpy as np
+
+from cal import models
+from profiling import profiler
+from serial_reader import sample_history
+
+# number of most recent samples of each PT the error band is worked out over
+ERROR_WINDOW = 1024
+
+
+class Verifier:
+    """Converts the raw readings of every PT on a board to pressure with the calibration curve picked for each PT (see
+    cal.models), to check the calibration against a known reference pressure before the rig is taken down.
+
+    Readings are converted a whole batch at a time, and the errors against the reference are kept in a ring buffer
+    so that the error band always covers the most recent ERROR_WINDOW samples
+    """
+
+    def __init__(self, fit: models.ModelFit, window: int = ERROR_WINDOW):
+        self.fit = fit
+        num_sensors = len(fit.selected)
+        self.pressures = np.full(num_sensors, np.nan)
+        self.reference: float | None = None
+        self.errors = sample_history.SampleHistory(num_sensors, window)
+
+    def set_reference(self, pressure: float) -> None:
+        """start measuring the errors against a new reference pressure"""
+        self.reference = pressure
+        self.errors.clear()
+
+    @profiler.traced
+    def add_rows(self, rows: np.ndarray) -> None:
+        """convert a batch of raw readings, shape (n, n_sensors)"""
+        if len(rows) == 0:
+            return
+
+        # only as many rows as the error window holds can matter
+        rows = rows[-self.errors.capacity :]
+        pressures = self.fit.invert(rows)
+        self.pressures = pressures[-1]
+        if self.reference is not None:
+            self.errors.append(pressures - self.reference, np.nan)
+
+    def get_errors(self) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """(mean, standard deviation, largest absolute) error of each PT over the window, NaN without any errors"""
+        num_errors = len(self.errors)
+        if num_errors == 0:
+            nan = np.full(self.errors.num_sensors, np.nan)
+            return nan, nan, nan
+
+        # the order of the samples doesn't matter, so the ring buffer can be used as it is
+        errors = self.errors.values[:num_errors]
+        return errors.mean(axis=0), errors.std(axis=0), np.abs(errors).max(axis=0)
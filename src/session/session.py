@@ -0,0 +1,339 @@
+"""
+A session is a directory holding everything recorded during a calibration:
+
+    manifest.json         the readers in the session and the run config
+    <reader id>.samples   raw float64 readings, one row of num_sensors values per sample
+    <reader id>.times     float64 monotonic timestamp of every sample
+    steps.jsonl           one record per finished step: pressure, where its samples are, their mean/std, the
+                          number of samples left out of the mean and whether the step had settled
+    fits.jsonl            one record per calculated calibration
+
+Every file is only ever appended to. A step's samples are written and fsynced before its record is appended
+to steps.jsonl, so a step only counts once its record is complete, and anything after the last complete record
+is discarded when the session is resumed. The sample files have no header so they can be memory mapped directly
+"""
+
+import datetime, json, os
+
+import numpy as np
+
+from cal import cal
+from profiling import profiler
+from serial_reader import serial_reader
+
+MANIFEST = "manifest.json"
+STEPS = "steps.jsonl"
+FITS = "fits.jsonl"
+FLOAT_SIZE = np.dtype(np.float64).itemsize
+
+
+def _fsync_dir(path: str) -> None:
+    """make sure newly created files survive a crash"""
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        # not possible on every platform (e.g. Windows)
+        return
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def _read_records(path: str) -> list[dict]:
+    """read a jsonl file, stopping at the first record that was only partially written"""
+    if not os.path.exists(path):
+        return []
+
+    records = []
+    with open(path, "rb") as records_file:
+        for line in records_file:
+            if not line.endswith(b"\n"):
+                break
+            try:
+                records.append(json.loads(line))
+            except json.JSONDecodeError:
+                break
+
+    return records
+
+
+def _latest_steps(records: list[dict]) -> dict[str, list[dict]]:
+    """group step records by reader, keeping only the latest record for each step"""
+    steps: dict[str, dict[int, dict]] = {}
+    for record in records:
+        steps.setdefault(record["reader"], {})[record["step"]] = record
+
+    return {
+        reader_id: [reader_steps[step] for step in sorted(reader_steps)]
+        for reader_id, reader_steps in steps.items()
+    }
+
+
+def describe_reader(reader: serial_reader.SerialReader) -> dict:
+    return {
+        "id": reader.get_pt_id(),
+        "name": reader.get_pt_name(),
+        "num_sensors": reader.get_num_pts(),
+        "port": reader.serial.port,
+    }
+
+
+class SessionWriter:
+    """Appends the steps and fits of a calibration to a session directory, resuming it if it already exists"""
+
+    def __init__(self, path: str, readers: list[dict], config: dict | None = None):
+        """readers are described by their id, name, num_sensors and port (see describe_reader)"""
+        self.path = path
+        self.num_sensors = {reader["id"]: reader["num_sensors"] for reader in readers}
+        os.makedirs(path, exist_ok=True)
+
+        manifest_path = os.path.join(path, MANIFEST)
+        if os.path.exists(manifest_path):
+            with open(manifest_path) as manifest_file:
+                self.manifest = json.load(manifest_file)
+            self._check_readers(readers)
+        else:
+            self.manifest = {
+                "version": 1,
+                "created": datetime.datetime.now().isoformat(),
+                "readers": readers,
+                "config": config or {},
+            }
+            self._write_new_file(manifest_path, json.dumps(self.manifest, indent=2))
+
+        # records of the steps already in the session, per reader
+        self.steps = _latest_steps(_read_records(os.path.join(path, STEPS)))
+        self._discard_partial_writes()
+
+        flags = os.O_WRONLY | os.O_APPEND | os.O_CREAT | getattr(os, "O_BINARY", 0)
+        self.sample_fds = {}
+        self.time_fds = {}
+        for reader_id in self.num_sensors:
+            self.sample_fds[reader_id] = os.open(
+                self._samples_path(reader_id), flags, 0o644
+            )
+            self.time_fds[reader_id] = os.open(
+                self._times_path(reader_id), flags, 0o644
+            )
+        self.steps_fd = os.open(os.path.join(path, STEPS), flags, 0o644)
+        self.fits_fd = os.open(os.path.join(path, FITS), flags, 0o644)
+        _fsync_dir(path)
+
+    def _samples_path(self, reader_id: str) -> str:
+        return os.path.join(self.path, f"{reader_id}.samples")
+
+    def _times_path(self, reader_id: str) -> str:
+        return os.path.join(self.path, f"{reader_id}.times")
+
+    def _write_new_file(self, path: str, contents: str) -> None:
+        with open(path, "w") as new_file:
+            new_file.write(contents)
+            new_file.flush()
+            os.fsync(new_file.fileno())
+        _fsync_dir(self.path)
+
+    def _check_readers(self, readers: list[dict]) -> None:
+        session_readers = {reader["id"]: reader for reader in self.manifest["readers"]}
+        for reader in readers:
+            if reader["id"] not in session_readers:
+                raise ValueError(f"{reader['name']} is not part of session {self.path}")
+
+            num_sensors = session_readers[reader["id"]]["num_sensors"]
+            if num_sensors != reader["num_sensors"]:
+                raise ValueError(
+                    f"{reader['name']} has {reader['num_sensors']} PTs, but {num_sensors} in session {self.path}"
+                )
+
+    def _discard_partial_writes(self) -> None:
+        """cut off samples and half written records left behind by a crash"""
+        for reader_id, num_sensors in self.num_sensors.items():
+            committed_rows = max(
+                (
+                    step["offset"] + step["count"]
+                    for step in self.steps.get(reader_id, [])
+                ),
+                default=0,
+            )
+            for path, row_size in (
+                (self._samples_path(reader_id), num_sensors * FLOAT_SIZE),
+                (self._times_path(reader_id), FLOAT_SIZE),
+            ):
+                if (
+                    os.path.exists(path)
+                    and os.path.getsize(path) > committed_rows * row_size
+                ):
+                    os.truncate(path, committed_rows * row_size)
+
+        for name in (STEPS, FITS):
+            path = os.path.join(self.path, name)
+            if not os.path.exists(path):
+                continue
+            with open(path, "rb") as records_file:
+                contents = records_file.read()
+            if contents and not contents.endswith(b"\n"):
+                os.truncate(path, contents.rfind(b"\n") + 1)
+
+    def get_num_completed_steps(self) -> int:
+        """number of steps every reader in the session has finished"""
+        return min(len(self.steps.get(reader_id, [])) for reader_id in self.num_sensors)
+
+    def get_completed_steps(self, reader_id: str) -> list[dict]:
+        return self.steps.get(reader_id, [])
+
+    def restore(self, readers: list[serial_reader.SerialReader]) -> int:
+        """load the completed steps back into the readers' stores, returns the number of steps restored"""
+        num_steps = self.get_num_completed_steps()
+        for reader_id in self.num_sensors:
+            # steps some readers finished but others didn't are taken again
+            self.steps[reader_id] = self.steps.get(reader_id, [])[:num_steps]
+
+        for reader in readers:
+            for step in self.steps[reader.get_pt_id()]:
+                reader.store.record_step(
+                    step["pressure"],
+                    np.array(step["avgs"]),
+                    np.array(step["stds"]),
+                    np.array(step.get("num_rejected", 0)),
+                    step.get("settled", True),
+                )
+
+        return num_steps
+
+    @profiler.traced
+    def write_step(
+        self,
+        reader_id: str,
+        pressure: float,
+        timestamps: np.ndarray,
+        samples: np.ndarray,
+        avgs: np.ndarray,
+        stds: np.ndarray,
+        settled: bool = True,
+        num_rejected: np.ndarray | int = 0,
+    ) -> None:
+        sample_fd = self.sample_fds[reader_id]
+        offset = os.fstat(sample_fd).st_size // (samples.shape[1] * FLOAT_SIZE)
+
+        os.write(sample_fd, np.ascontiguousarray(samples, dtype=np.float64).tobytes())
+        os.write(
+            self.time_fds[reader_id],
+            np.ascontiguousarray(timestamps, dtype=np.float64).tobytes(),
+        )
+        os.fsync(sample_fd)
+        os.fsync(self.time_fds[reader_id])
+
+        reader_steps = self.steps.setdefault(reader_id, [])
+        record = {
+            "reader": reader_id,
+            "step": len(reader_steps),
+            "pressure": pressure,
+            "offset": offset,
+            "count": len(samples),
+            "avgs": np.asarray(avgs).tolist(),
+            "stds": np.asarray(stds).tolist(),
+            "settled": bool(settled),
+            "num_rejected": np.broadcast_to(num_rejected, len(avgs)).tolist(),
+            "time": datetime.datetime.now().isoformat(),
+        }
+        self._append_record(self.steps_fd, record)
+        reader_steps.append(record)
+
+    def write_reader_step(self, reader: serial_reader.SerialReader) -> None:
+        """write the step the reader just averaged"""
+        store = reader.store
+        timestamps, samples = store.get_last_step()
+        self.write_step(
+            reader.get_pt_id(),
+            float(store.get_pressures()[-1]),
+            timestamps,
+            samples,
+            store.get_avgs()[-1],
+            store.get_stds()[-1],
+            store.get_settled()[-1],
+            store.get_num_rejected()[-1],
+        )
+
+    def write_fit(self, reader_id: str, fit: cal.LinearFit) -> None:
+        self._append_record(
+            self.fits_fd,
+            {
+                "reader": reader_id,
+                "time": datetime.datetime.now().isoformat(),
+                **fit.to_dict(),
+            },
+        )
+
+    def _append_record(self, fd: int, record: dict) -> None:
+        os.write(fd, (json.dumps(record) + "\n").encode())
+        os.fsync(fd)
+
+    def close(self) -> None:
+        for fd in (*self.sample_fds.values(), *self.time_fds.values()):
+            os.close(fd)
+        os.close(self.steps_fd)
+        os.close(self.fits_fd)
+
+
+class Session:
+    """Read only view of a session directory. Samples are memory mapped, so only the parts that are used get read"""
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(os.path.join(path, MANIFEST)) as manifest_file:
+            self.manifest = json.load(manifest_file)
+
+        self.num_sensors = {
+            reader["id"]: reader["num_sensors"] for reader in self.manifest["readers"]
+        }
+        self.steps = _latest_steps(_read_records(os.path.join(path, STEPS)))
+        self.fits = _read_records(os.path.join(path, FITS))
+
+    def get_reader_ids(self) -> list[str]:
+        return list(self.num_sensors)
+
+    def get_samples(self, reader_id: str) -> np.ndarray:
+        """every sample of the reader as an (n x num_sensors) memory mapped array"""
+        path = os.path.join(self.path, f"{reader_id}.samples")
+        num_sensors = self.num_sensors[reader_id]
+        num_rows = os.path.getsize(path) // (num_sensors * FLOAT_SIZE)
+        if num_rows == 0:
+            return np.empty((0, num_sensors))
+
+        return np.memmap(
+            path, dtype=np.float64, mode="r", shape=(num_rows, num_sensors)
+        )
+
+    def get_timestamps(self, reader_id: str) -> np.ndarray:
+        path = os.path.join(self.path, f"{reader_id}.times")
+        num_rows = os.path.getsize(path) // FLOAT_SIZE
+        if num_rows == 0:
+            return np.empty(0)
+
+        return np.memmap(path, dtype=np.float64, mode="r", shape=(num_rows,))
+
+    def get_step_samples(
+        self, reader_id: str, step: int
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """(timestamps, samples) of a single step"""
+        record = self.steps[reader_id][step]
+        start, end = record["offset"], record["offset"] + record["count"]
+        return (
+            self.get_timestamps(reader_id)[start:end],
+            self.get_samples(reader_id)[start:end],
+        )
+
+    def get_pressures(self, reader_id: str) -> np.ndarray:
+        return np.array([step["pressure"] for step in self.steps.get(reader_id, [])])
+
+    def get_avgs(self, reader_id: str) -> np.ndarray:
+        """(n_pressures x num_sensors) matrix of step averages"""
+        steps = self.steps.get(reader_id, [])
+        if not steps:
+            return np.empty((0, self.num_sensors[reader_id]))
+
+        return np.array([step["avgs"] for step in steps])
+
+    def get_latest_fit(self, reader_id: str) -> dict | None:
+        fits = [fit for fit in self.fits if fit["reader"] == reader_id]
+        return fits[-1] if fits else None
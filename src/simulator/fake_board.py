@@ -0,0 +1,212 @@
+import os, pty, threading, time, tty
+
+import numpy as np
+
+from serial_reader import frames
+
+
+class FaultConfig:
+    """Probability of each kind of corrupted line the fake board sends"""
+
+    def __init__(
+        self,
+        partial_line: float = 0.0,
+        bad_utf8: float = 0.0,
+        wrong_columns: float = 0.0,
+    ):
+        self.partial_line = partial_line
+        self.bad_utf8 = bad_utf8
+        self.wrong_columns = wrong_columns
+
+
+class FakeBoard:
+    """Simulated sensor board behind a pseudo-terminal, sending "v1, v2, ..." lines like the ESP32 boards do, or
+    binary frames (see serial_reader.frames) with protocol BINARY.
+
+    Every channel responds linearly to the current pressure (raw = slope * pressure + intercept) with gaussian noise,
+    settling exponentially after each pressure change. Open `port` with SerialReader as if it were a real device
+    """
+
+    def __init__(
+        self,
+        num_channels: int,
+        line_rate: float = 1000,
+        noise_std: float = 0.01,
+        slopes: np.ndarray | list[float] | None = None,
+        intercepts: np.ndarray | list[float] | None = None,
+        settle_time: float = 0.0,
+        faults: FaultConfig | None = None,
+        decimals: int = 4,
+        seed: int | None = None,
+        protocol: str = frames.ASCII,
+        value_type: int = frames.FLOAT32,
+    ):
+        self.num_channels = num_channels
+        self.protocol = protocol
+        self.value_type = value_type
+        self.line_rate = line_rate
+        self.noise_std = noise_std
+        self.rng = np.random.default_rng(seed)
+        self.slopes = (
+            np.asarray(slopes, dtype=float)
+            if slopes is not None
+            else self.rng.uniform(0.5, 2.0, num_channels)
+        )
+        self.intercepts = (
+            np.asarray(intercepts, dtype=float)
+            if intercepts is not None
+            else self.rng.uniform(-1.0, 1.0, num_channels)
+        )
+        self.settle_time = settle_time
+        self.faults = faults or FaultConfig()
+        self.line_format = (
+            ", ".join([f"%.{decimals}f"] * num_channels) + "\n"
+        ).encode()
+
+        self.master_fd, self.slave_fd = pty.openpty()
+        tty.setraw(self.slave_fd)
+        # like a real UART, data nobody reads in time is lost rather than stalling the board
+        os.set_blocking(self.master_fd, False)
+        self.port = os.ttyname(self.slave_fd)
+
+        self.pressure = 0.0
+        self.previous_pressure = 0.0
+        self.pressure_changed_at = time.monotonic()
+        self.lines_sent = 0
+        self.faulty_lines_sent = 0
+        self.bytes_dropped = 0
+        self.running = False
+        self.thread: threading.Thread | None = None
+
+    def __enter__(self) -> "FakeBoard":
+        self.start()
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.stop()
+
+    def set_pressure(self, pressure: float) -> None:
+        self.previous_pressure = self.get_pressure()
+        self.pressure = pressure
+        self.pressure_changed_at = time.monotonic()
+
+    def get_pressure(self) -> float:
+        """the pressure the sensors currently see, which lags the set pressure by the settle time"""
+        if self.settle_time <= 0:
+            return self.pressure
+
+        elapsed = time.monotonic() - self.pressure_changed_at
+        remaining = np.exp(-elapsed / self.settle_time)
+        return self.pressure + (self.previous_pressure - self.pressure) * remaining
+
+    def start(self) -> None:
+        self.running = True
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def stop(self) -> None:
+        self.running = False
+        if self.thread:
+            self.thread.join()
+        os.close(self.master_fd)
+        os.close(self.slave_fd)
+
+    def make_values(self, num_lines: int) -> np.ndarray:
+        values = self.slopes * self.get_pressure() + self.intercepts
+        return values + self.rng.normal(
+            0, self.noise_std, (num_lines, self.num_channels)
+        )
+
+    def make_frames(self, num_frames: int) -> bytes:
+        """generate num_frames binary frames for the current pressure, with faults mixed in: partial frames, a
+        corrupted byte (which fails the CRC) and frames with a channel missing
+        """
+        values = self.make_values(num_frames)
+        if self.value_type == frames.INT32:
+            values = np.round(values)
+
+        faults = self.faults
+        if not (faults.partial_line or faults.bad_utf8 or faults.wrong_columns):
+            data = frames.encode_frames(values, self.lines_sent, self.value_type)
+            self.lines_sent += num_frames
+            return data
+
+        data = []
+        fault_rolls = self.rng.random((num_frames, 3))
+        for index, (partial_roll, corrupt_roll, columns_roll) in enumerate(fault_rolls):
+            sequence = self.lines_sent + index
+            if columns_roll < self.faults.wrong_columns:
+                frame = frames.encode_frames(
+                    values[index : index + 1, :-1], sequence, self.value_type
+                )
+            else:
+                frame = frames.encode_frames(
+                    values[index : index + 1], sequence, self.value_type
+                )
+
+            if partial_roll < self.faults.partial_line:
+                frame = frame[: len(frame) // 2]
+            elif corrupt_roll < self.faults.bad_utf8:
+                frame = frame[:-5] + bytes([frame[-5] ^ 0xFF]) + frame[-4:]
+            elif columns_roll >= self.faults.wrong_columns:
+                data.append(frame)
+                continue
+
+            self.faulty_lines_sent += 1
+            data.append(frame)
+
+        self.lines_sent += num_frames
+        return b"".join(data)
+
+    def make_lines(self, num_lines: int) -> bytes:
+        """generate num_lines lines for the current pressure, with faults mixed in"""
+        if self.protocol == frames.BINARY:
+            return self.make_frames(num_lines)
+
+        values = self.make_values(num_lines)
+
+        lines = []
+        fault_rolls = self.rng.random((num_lines, 3))
+        for row, (partial_roll, utf8_roll, columns_roll) in zip(values, fault_rolls):
+            line = self.line_format % tuple(row)
+            if partial_roll < self.faults.partial_line:
+                # the rest of the line is lost and the next line runs into it
+                line = line[: len(line) // 2]
+            elif utf8_roll < self.faults.bad_utf8:
+                line = line[:2] + b"\xff\xfe" + line[2:]
+            elif columns_roll < self.faults.wrong_columns:
+                line = line[: line.rfind(b",")] + b"\n"
+            else:
+                lines.append(line)
+                continue
+
+            self.faulty_lines_sent += 1
+            lines.append(line)
+
+        self.lines_sent += num_lines
+        return b"".join(lines)
+
+    def _run(self) -> None:
+        started_at = time.monotonic()
+        # never send more than 100ms worth of lines at once if the writer falls behind
+        max_burst = max(1, int(self.line_rate * 0.1))
+
+        while self.running:
+            due = (
+                int((time.monotonic() - started_at) * self.line_rate) - self.lines_sent
+            )
+            if due > max_burst:
+                started_at += (due - max_burst) / self.line_rate
+                due = max_burst
+
+            if due > 0:
+                data = memoryview(self.make_lines(due))
+                try:
+                    while data:
+                        data = data[os.write(self.master_fd, data) :]
+                except BlockingIOError:
+                    self.bytes_dropped += len(data)
+                except OSError:
+                    return
+
+            time.sleep(0.001)
@@ -0,0 +1,4 @@
+import os, sys
+
+# the modules are imported from src, the same way main.py imports them
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
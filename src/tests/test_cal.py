@@ -0,0 +1,62 @@
+import numpy as np
+import pytest
+
+from cal import cal
+
+
+def make_steps(noise_std: float) -> tuple[np.ndarray, np.ndarray]:
+    rng = np.random.default_rng(4)
+    pressures = np.linspace(0, 1000, 9)
+    readings = 3e4 + np.outer(pressures, [1.5, -0.2, 8.0])
+    return pressures, readings + rng.normal(0, noise_std, readings.shape)
+
+
+def running_fit(pressures: np.ndarray, readings: np.ndarray) -> cal.LinearFit:
+    fit = cal.RunningLinearFit(readings.shape[1])
+    for pressure, reading in zip(pressures, readings):
+        fit.add(pressure, reading)
+    return fit.get_fit()
+
+
+@pytest.mark.parametrize("noise_std", [1.0, 1e-3])
+def test_running_fit_matches_the_batch_fit(noise_std):
+    pressures, readings = make_steps(noise_std)
+
+    running = running_fit(pressures, readings)
+    batch = cal.calculate_linear_regressions(pressures, readings)
+
+    np.testing.assert_allclose(running.slopes, batch.slopes, rtol=1e-12)
+    np.testing.assert_allclose(running.intercepts, batch.intercepts, rtol=1e-12)
+    for sensor in range(readings.shape[1]):
+        slope, intercept = np.polyfit(pressures, readings[:, sensor], 1)
+        assert running.slopes[sensor] == pytest.approx(slope, rel=1e-10)
+        assert running.intercepts[sensor] == pytest.approx(intercept, rel=1e-10)
+
+    # the residuals come from a difference of sums of squares, which loses digits as the fit gets closer to exact
+    # (down to about 4 digits here, where R² is 1 - 1e-14)
+    rtol = 1e-3 if noise_std < 1e-2 else 1e-10
+    np.testing.assert_allclose(running.residual_rms, batch.residual_rms, rtol=rtol)
+    np.testing.assert_allclose(running.slope_stderr, batch.slope_stderr, rtol=rtol)
+    np.testing.assert_allclose(running.r_squared, batch.r_squared, rtol=1e-12)
+
+
+def test_running_fit_needs_two_distinct_pressures():
+    fit = cal.RunningLinearFit(2)
+    fit.add(10.0, np.array([1.0, 2.0]))
+    with pytest.raises(ValueError):
+        fit.get_fit()
+
+    fit.add(10.0, np.array([1.5, 2.5]))
+    with pytest.raises(ValueError):
+        fit.get_fit()
+
+    fit.add(20.0, np.array([2.0, 3.0]))
+    assert np.isfinite(fit.get_fit().slope_stderr).all()
+
+
+def test_two_points_have_no_standard_errors():
+    fit = cal.calculate_linear_regressions([0.0, 1.0], np.array([[1.0], [3.0]]))
+
+    assert fit.slopes.tolist() == [2.0]
+    assert np.isnan(fit.slope_stderr).all()
+    assert fit.r_squared.tolist() == [1.0]
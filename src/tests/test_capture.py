@@ -0,0 +1,90 @@
+import asyncio, math
+
+import pytest
+
+from headless import headless
+from serial_reader import frames
+from simulator import fake_board
+
+PRESSURES = [0.0, 50.0, 100.0]
+
+
+def assert_close(replayed, captured) -> None:
+    """compare nested results, allowing for rounding"""
+    if isinstance(captured, dict):
+        assert replayed.keys() == captured.keys()
+        for key in captured:
+            assert_close(replayed[key], captured[key])
+    elif isinstance(captured, list):
+        assert len(replayed) == len(captured)
+        for replayed_item, captured_item in zip(replayed, captured):
+            assert_close(replayed_item, captured_item)
+    elif isinstance(captured, float):
+        assert replayed == pytest.approx(captured, rel=1e-9, abs=1e-9)
+    else:
+        assert replayed == captured
+
+
+def run(config: dict, schedule: list[tuple[float, float]], boards=()) -> dict:
+    readers = headless.create_readers(config)
+    engine = headless.create_engine(config, readers)
+
+    def set_pressure(pressure: float) -> None:
+        for board in boards:
+            board.set_pressure(pressure)
+
+    try:
+        asyncio.run(headless.run_calibration(engine, schedule, set_pressure))
+    finally:
+        for reader in readers:
+            reader.serial.close()
+
+    return headless.build_results(readers)
+
+
+@pytest.mark.parametrize("protocol", [frames.ASCII, frames.BINARY])
+def test_a_replay_gives_the_same_calibration_as_the_capture(tmp_path, protocol):
+    boards = [
+        fake_board.FakeBoard(3, 500, 0.01, seed=seed, protocol=protocol)
+        for seed in range(2)
+    ]
+    for board in boards:
+        board.start()
+    config = {
+        "baud_rate": 115200,
+        "num_readings_per_pt": 50,
+        "boards": [
+            {"name": f"Board {board_no}", "port": board.port, "pt_count": 3}
+            for board_no, board in enumerate(boards)
+        ],
+    }
+    prefix = str(tmp_path / "run")
+    try:
+        schedule = headless.apply_capture_options(
+            config, [(pressure, 0.1) for pressure in PRESSURES], capture_prefix=prefix
+        )
+        captured = run(config, schedule, boards)
+    finally:
+        for board in boards:
+            board.stop()
+
+    for board in config["boards"]:
+        del board["capture"]
+    schedule = headless.apply_capture_options(
+        config,
+        [(pressure, 0.1) for pressure in PRESSURES],
+        replay_prefix=prefix,
+        replay_speed=math.inf,
+    )
+    # nothing to wait for when replaying as fast as possible
+    assert schedule == [(pressure, 0.0) for pressure in PRESSURES]
+    replayed = run(config, schedule)
+
+    # the same samples, only read in different chunks and so summed up in a different order
+    for captured_board, replayed_board in zip(captured["boards"], replayed["boards"]):
+        assert captured_board["pressures"] == replayed_board["pressures"] == PRESSURES
+        assert_close(replayed_board["averages"], captured_board["averages"])
+        assert_close(replayed_board["stds"], captured_board["stds"])
+        assert_close(replayed_board["fit"], captured_board["fit"])
+        assert replayed_board["models"]["models"] == captured_board["models"]["models"]
+        assert_close(replayed_board["models"], captured_board["models"])
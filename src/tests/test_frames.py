@@ -0,0 +1,153 @@
+import numpy as np
+import pytest
+
+from serial_reader import frames
+
+NUM_CHANNELS = 4
+
+
+def make_values(num_frames: int) -> np.ndarray:
+    # values whose float32 bytes can't be mistaken for the sync word
+    return np.arange(num_frames * NUM_CHANNELS, dtype=np.float64).reshape(
+        num_frames, NUM_CHANNELS
+    )
+
+
+def decode(data: bytes, decoder: frames.FrameDecoder | None = None):
+    return (decoder or frames.FrameDecoder(NUM_CHANNELS)).decode(data)
+
+
+@pytest.mark.parametrize("value_type", [frames.FLOAT32, frames.INT32])
+def test_round_trip(value_type):
+    values = make_values(10)
+    rows, num_consumed, num_wrong_channels, num_bad_crcs, num_dropped, sequences = (
+        decode(frames.encode_frames(values, value_type=value_type))
+    )
+
+    assert rows.tolist() == values.tolist()
+    assert num_consumed == 10 * frames.get_frame_size(NUM_CHANNELS)
+    assert (num_wrong_channels, num_bad_crcs, num_dropped) == (0, 0, 0)
+    assert sequences.tolist() == list(range(1, 11))
+
+
+def test_a_frame_that_has_not_fully_arrived_is_left_for_the_next_read():
+    data = frames.encode_frames(make_values(3))
+    decoder = frames.FrameDecoder(NUM_CHANNELS)
+    frame_size = frames.get_frame_size(NUM_CHANNELS)
+
+    rows, num_consumed, *_ = decode(data[:-5], decoder)
+    assert len(rows) == 2
+    assert num_consumed == 2 * frame_size
+
+    rows, num_consumed, _, _, num_dropped, sequences = decode(
+        data[num_consumed:], decoder
+    )
+    assert rows.tolist() == make_values(3)[2:].tolist()
+    assert num_dropped == 0
+    assert sequences.tolist() == [3]
+
+
+def test_bad_crcs_are_skipped_and_counted():
+    values = make_values(10)
+    data = bytearray(frames.encode_frames(values))
+    frame_size = frames.get_frame_size(NUM_CHANNELS)
+    # flip a bit of a value in the fourth frame
+    data[3 * frame_size + frames.HEADER.size] ^= 0x01
+
+    rows, num_consumed, num_wrong_channels, num_bad_crcs, num_dropped, sequences = (
+        decode(bytes(data))
+    )
+
+    assert rows.tolist() == np.delete(values, 3, axis=0).tolist()
+    assert num_consumed == len(data)
+    assert num_wrong_channels == 0
+    assert num_bad_crcs == 1
+    # the corrupted frame is also missing from the sequence
+    assert num_dropped == 1
+    assert sequences.tolist() == [1, 2, 3, 5, 6, 7, 8, 9, 10]
+
+
+def test_garbage_is_skipped_to_the_next_sync_word():
+    values = make_values(6)
+    data = frames.encode_frames(values)
+    frame_size = frames.get_frame_size(NUM_CHANNELS)
+    garbage = b"\x00\x13garbage\xa5\x01"
+    corrupted = garbage + data[: 3 * frame_size] + garbage + data[3 * frame_size :]
+
+    rows, num_consumed, _, num_bad_crcs, num_dropped, _ = decode(corrupted)
+
+    assert rows.tolist() == values.tolist()
+    assert num_consumed == len(corrupted)
+    assert num_bad_crcs == 0
+    assert num_dropped == 0
+
+
+def test_a_sync_word_split_across_reads_is_kept():
+    data = frames.encode_frames(make_values(1))
+    rows, num_consumed, *_ = decode(b"\x00" * len(data) + data[:1])
+
+    assert len(rows) == 0
+    assert num_consumed == len(data)
+
+
+def test_frames_with_the_wrong_number_of_channels_are_counted():
+    data = frames.encode_frames(np.ones((1, NUM_CHANNELS + 1)))
+    data += frames.encode_frames(make_values(2))
+
+    rows, _, num_wrong_channels, _, _, _ = decode(data)
+
+    assert rows.tolist() == make_values(2).tolist()
+    assert num_wrong_channels == 1
+
+
+def test_sequence_numbers_keep_counting_up_past_the_wrap():
+    values = make_values(12)
+    data = frames.encode_frames(values, first_sequence=frames.SEQUENCE_MODULUS - 6)
+    decoder = frames.FrameDecoder(NUM_CHANNELS)
+    frame_size = frames.get_frame_size(NUM_CHANNELS)
+
+    first = decode(data[: 5 * frame_size], decoder)
+    second = decode(data[5 * frame_size :], decoder)
+
+    assert first[4] == second[4] == 0
+    assert np.concatenate((first[5], second[5])).tolist() == list(range(1, 13))
+
+
+def test_frames_dropped_across_the_wrap_are_counted():
+    decoder = frames.FrameDecoder(NUM_CHANNELS)
+    before = frames.encode_frames(make_values(3), first_sequence=65533)
+    # frames 0 and 1 never arrive
+    after = frames.encode_frames(make_values(3), first_sequence=2)
+
+    assert decode(before, decoder)[4] == 0
+    _, _, _, _, num_dropped, sequences = decode(after, decoder)
+
+    assert num_dropped == 2
+    assert sequences.tolist() == [6, 7, 8]
+
+
+def test_gaps_after_a_reset_or_a_restarted_board_are_not_dropped_frames():
+    decoder = frames.FrameDecoder(NUM_CHANNELS)
+    decode(frames.encode_frames(make_values(2), first_sequence=100), decoder)
+
+    decoder.reset()
+    assert (
+        decode(frames.encode_frames(make_values(2), first_sequence=500), decoder)[4]
+        == 0
+    )
+    # the board started again from 0
+    _, _, _, _, num_dropped, sequences = decode(
+        frames.encode_frames(make_values(2)), decoder
+    )
+    assert num_dropped == 0
+    assert sequences.tolist() == [5, 6]
+
+
+def test_protocol_detection():
+    data = frames.encode_frames(make_values(3))
+
+    assert frames.sniff_frame_format(b"\x00garbage" + data) == NUM_CHANNELS
+    assert frames.sniff_frame_format(b"1.0, 2.0\n3.0, 4.0\n") is None
+    assert frames.detect_protocol(data, NUM_CHANNELS) == frames.BINARY
+    assert frames.detect_protocol(b"1.0, 2.0\n3.0, 4.0\n", 2) == frames.ASCII
+    assert frames.detect_protocol(data[:5], NUM_CHANNELS) is None
@@ -0,0 +1,121 @@
+import numpy as np
+import pytest
+
+from cal import models
+
+PRESSURES = np.linspace(0, 100, 11)
+# the true coefficients of x of each sensor's curve, the piecewise one bends at the median pressure
+CURVES = {
+    models.LINEAR: [1.0, 2.0],
+    models.QUADRATIC: [1.0, 0.5, 2e-3],
+    models.CUBIC: [0.5, 0.2, 1e-3, 2e-5],
+    models.PIECEWISE: [2.0, 0.3, 0.4],
+}
+
+
+def evaluate(model: str, coefficients: list[float], x_values: np.ndarray):
+    if model == models.PIECEWISE:
+        intercept, slope, bend = coefficients
+        return intercept + slope * x_values + bend * np.maximum(x_values - 50, 0)
+
+    return np.polynomial.polynomial.polyval(x_values, coefficients)
+
+
+def make_readings(noise_std: float = 1e-3) -> np.ndarray:
+    readings = np.column_stack(
+        [evaluate(model, curve, PRESSURES) for model, curve in CURVES.items()]
+    )
+    # noise that flips sign every step, which none of the curves can follow. With random noise a few extra
+    # coefficients can, by chance, fit it better than the true curve
+    noise = noise_std * (-1) ** np.arange(len(PRESSURES))
+    return readings + noise[:, np.newaxis]
+
+
+@pytest.mark.parametrize("criterion", models.CRITERIA)
+def test_each_sensor_gets_the_model_of_its_curve(criterion):
+    fit = models.fit_models(PRESSURES, make_readings(), criterion=criterion)
+
+    assert fit.get_model_names() == list(CURVES)
+
+
+def test_coefficients_are_of_the_raw_pressure():
+    fit = models.fit_models(PRESSURES, make_readings()).to_dict()
+
+    assert fit["knot"] == pytest.approx(50)
+    for coefficients, curve in zip(fit["coefficients"], CURVES.values()):
+        assert coefficients == pytest.approx(curve, rel=1e-2, abs=2e-3)
+    assert max(fit["max_errors"]) < 5e-3
+    assert set(fit["scores"]) == set(models.MODELS)
+    # the data can't be fit exactly, every model gets a score
+    assert all(
+        score is not None for scores in fit["scores"].values() for score in scores
+    )
+
+
+def test_predict_follows_each_sensors_model():
+    fit = models.fit_models(PRESSURES, make_readings(noise_std=0))
+    x_values = np.array([5.0, 37.5, 62.5, 95.0])
+
+    expected = np.column_stack(
+        [evaluate(model, curve, x_values) for model, curve in CURVES.items()]
+    )
+    np.testing.assert_allclose(fit.predict(x_values), expected, atol=1e-9)
+
+
+def test_exact_fits_go_to_the_simplest_model():
+    readings = evaluate(models.LINEAR, CURVES[models.LINEAR], PRESSURES)
+
+    for criterion in models.CRITERIA:
+        fit = models.fit_models(PRESSURES, readings, criterion=criterion)
+        assert fit.get_model_names() == [models.LINEAR]
+
+
+def test_two_steps_can_only_be_a_straight_line():
+    fit = models.fit_models([0.0, 100.0], np.array([[1.0, -3.0], [201.0, 47.0]]))
+    fit_dict = fit.to_dict()
+
+    assert fit_dict["models"] == [models.LINEAR, models.LINEAR]
+    assert fit_dict["coefficients"] == [
+        pytest.approx([1.0, 2.0]),
+        pytest.approx([-3.0, 0.5]),
+    ]
+    # there are no points left over to score any model with
+    assert fit_dict["scores"] == {model: [None, None] for model in models.MODELS}
+    assert fit_dict["max_errors"] == pytest.approx([0, 0], abs=1e-12)
+
+
+def test_bad_input_is_refused():
+    with pytest.raises(ValueError):
+        models.fit_models([10.0, 10.0, 10.0], np.ones((3, 2)))
+    with pytest.raises(ValueError):
+        models.fit_models(PRESSURES, np.ones((len(PRESSURES) - 1, 2)))
+    with pytest.raises(ValueError):
+        models.fit_models(PRESSURES, make_readings(), models=("spline",))
+    with pytest.raises(ValueError):
+        models.fit_models(PRESSURES, make_readings(), criterion="bic")
+
+
+def test_invert_gives_the_pressure_of_each_sensors_readings():
+    fit = models.fit_models(PRESSURES, make_readings(noise_std=0))
+    # including pressures a little outside of the calibrated range
+    x_values = np.linspace(-10, 110, 25)
+    readings = np.column_stack(
+        [evaluate(model, curve, x_values) for model, curve in CURVES.items()]
+    )
+
+    pressures = fit.invert(readings)
+
+    np.testing.assert_allclose(
+        pressures, np.tile(x_values[:, np.newaxis], 4), atol=1e-9
+    )
+
+
+def test_readings_a_curve_never_reaches_invert_to_nan():
+    fit = models.fit_models(PRESSURES, make_readings(noise_std=0))
+    # the quadratic's lowest value is -30.25, at -125
+    readings = np.array([[1.0, -100.0, 0.5, 2.0]])
+
+    pressures = fit.invert(readings)
+
+    assert np.isnan(pressures[0, 1])
+    assert pressures[0, [0, 2, 3]] == pytest.approx([0, 0, 0], abs=1e-9)
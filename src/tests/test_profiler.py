@@ -0,0 +1,53 @@
+import json
+
+import pytest
+
+from profiling import profiler
+
+
+@pytest.fixture
+def profiling():
+    profiler.enable(max_events=100)
+    yield
+    profiler._profiler = None
+
+
+@profiler.traced
+def inner() -> None:
+    pass
+
+
+@profiler.traced
+def outer() -> None:
+    for _ in range(10):
+        inner()
+
+
+def test_the_trace_keeps_the_most_recent_spans(profiling, tmp_path):
+    for _ in range(50):
+        outer()
+
+    prefix = str(tmp_path / "run")
+    profiler.write(prefix)
+    with open(f"{prefix}.trace.json") as trace_file:
+        trace = json.load(trace_file)
+
+    spans = [event for event in trace["traceEvents"] if event["ph"] == "X"]
+    assert len(spans) == 100
+    assert trace["otherData"] == {"dropped_spans": 450}
+    # the last call of outer finishes after its calls of inner
+    assert spans[-1]["name"] == outer.__qualname__
+
+    # the collapsed stacks still cover every span
+    with open(f"{prefix}.folded") as folded_file:
+        paths = [line.rsplit(" ", 1)[0] for line in folded_file]
+    assert set(paths) <= {
+        outer.__qualname__,
+        f"{outer.__qualname__};{inner.__qualname__}",
+    }
+
+
+def test_nothing_is_recorded_while_profiling_is_off():
+    assert not profiler.is_enabled()
+    outer()
+    profiler.write("never-written")
@@ -0,0 +1,74 @@
+import numpy as np
+import pytest
+
+from cal import robust
+from serial_reader import reading_store
+
+
+def make_rows(num_rows: int = 100) -> np.ndarray:
+    rng = np.random.default_rng(3)
+    # large values with a small spread, where naive sums of squares lose their precision
+    return 1e6 + rng.normal(0, 1e-3, (num_rows, 4))
+
+
+def test_batches_merge_into_the_statistics_of_the_whole_step():
+    rows = make_rows()
+    store = reading_store.ReadingStore(4, len(rows))
+
+    # batches of every size, including single rows added one at a time
+    store.add_rows(rows[:1])
+    store.add_row(rows[1])
+    store.add_rows(rows[2:37], np.arange(2, 37))
+    for start in range(37, len(rows), 9):
+        store.add_rows(rows[start : start + 9])
+
+    assert store.count == len(rows)
+    assert store.is_full()
+    np.testing.assert_allclose(store.mean, rows.mean(axis=0), rtol=1e-15)
+    # the values only differ in their last 9 or so digits, neither std can be any closer than that
+    np.testing.assert_allclose(store.get_std(), rows.std(axis=0, ddof=1), rtol=1e-7)
+    np.testing.assert_array_equal(store.min, rows.min(axis=0))
+    np.testing.assert_array_equal(store.max, rows.max(axis=0))
+    np.testing.assert_array_equal(store.get_step_readings(), rows)
+    assert store.get_step_timestamps()[2:37].tolist() == list(range(2, 37))
+
+
+def test_rows_beyond_the_step_are_not_taken():
+    rows = make_rows(10)
+    store = reading_store.ReadingStore(4, 8)
+
+    assert store.add_rows(rows[:6]) == 6
+    assert store.add_rows(rows[6:]) == 2
+    assert store.add_rows(rows) == 0
+    with pytest.raises(ValueError):
+        store.add_row(rows[0])
+    np.testing.assert_allclose(store.mean, rows[:8].mean(axis=0), rtol=1e-15)
+
+
+def test_robust_averaging_records_the_rejected_samples():
+    rows = make_rows()
+    rows[[3, 60], 1] += 1
+    store = reading_store.ReadingStore(4, len(rows), averaging=robust.SIGMA_CLIP)
+    store.add_rows(rows)
+
+    avgs, _ = store.finish_step(10.0)
+
+    assert store.get_num_rejected().tolist() == [[0, 2, 0, 0]]
+    np.testing.assert_allclose(
+        avgs[1], np.delete(rows[:, 1], [3, 60]).mean(), rtol=1e-15
+    )
+    assert store.count == 0
+
+
+def test_steps_keep_being_recorded_past_the_initial_size():
+    store = reading_store.ReadingStore(2, 1, initial_steps=2)
+    for step in range(5):
+        store.add_row(np.array([step, 2 * step + 1.0]))
+        store.finish_step(float(step))
+
+    assert store.get_pressures().tolist() == [0, 1, 2, 3, 4]
+    assert store.get_avgs()[:, 1].tolist() == [1, 3, 5, 7, 9]
+    assert store.get_settled().all()
+    fit = store.running_fit.get_fit()
+    np.testing.assert_allclose(fit.slopes, [1, 2])
+    np.testing.assert_allclose(fit.intercepts, [0, 1], atol=1e-12)
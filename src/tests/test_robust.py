@@ -0,0 +1,97 @@
+import numpy as np
+import pytest
+
+from cal import cal, robust
+
+
+def make_block(num_samples: int = 200, num_sensors: int = 3) -> np.ndarray:
+    rng = np.random.default_rng(1)
+    return 10 * np.arange(1, num_sensors + 1) + rng.normal(
+        0, 0.1, (num_samples, num_sensors)
+    )
+
+
+def test_sigma_clip_rejects_only_the_spikes():
+    block = make_block()
+    clean_means = block.mean(axis=0)
+    spiked = block.copy()
+    spiked[[5, 50, 150], 0] += 100
+    spiked[7, 2] -= 50
+
+    means, stds, rejected = robust.sigma_clip(spiked)
+
+    assert rejected.sum(axis=0).tolist() == [3, 0, 1]
+    assert np.flatnonzero(rejected[:, 0]).tolist() == [5, 50, 150]
+    np.testing.assert_allclose(means, clean_means, atol=0.02)
+    assert stds == pytest.approx(block.std(axis=0, ddof=1), rel=0.1)
+    # a plain mean is dragged well off
+    assert spiked[:, 0].mean() - clean_means[0] > 1
+
+
+def test_sigma_clip_keeps_quantised_readings():
+    # more than half of the readings are the same, so the median absolute deviation is 0
+    block = np.array([[1.0]] * 7 + [[1.1]] * 3)
+
+    means, _, rejected = robust.sigma_clip(block)
+
+    assert not rejected.any()
+    assert means == pytest.approx([1.03])
+
+
+def test_median_of_means_ignores_a_bad_group():
+    block = make_block(num_samples=100)
+    spiked = block.copy()
+    # a burst of bad samples, all within one of the five groups
+    spiked[20:30] += 100
+
+    means = robust.median_of_means(spiked)
+
+    np.testing.assert_allclose(means, block.mean(axis=0), atol=0.05)
+    assert robust.median_of_means(block[:3]) == pytest.approx(
+        np.median(block[:3], axis=0)
+    )
+
+
+@pytest.mark.parametrize("method", robust.AVERAGING_METHODS)
+def test_average_step_of_clean_samples_is_the_mean(method):
+    block = make_block()
+
+    means, stds, rejected = robust.average_step(block, method)
+
+    np.testing.assert_allclose(means, block.mean(axis=0), atol=0.02)
+    assert stds == pytest.approx(block.std(axis=0, ddof=1), rel=0.05)
+    assert rejected.shape == block.shape
+
+
+def test_unknown_averaging_is_refused():
+    with pytest.raises(ValueError):
+        robust.average_step(make_block(), "mode")
+
+
+def test_huber_recovers_the_slope_that_least_squares_loses():
+    pressures = np.linspace(0, 100, 11)
+    rng = np.random.default_rng(2)
+    slopes = np.array([2.0, 0.5])
+    readings = 1 + np.outer(pressures, slopes) + rng.normal(0, 0.01, (11, 2))
+    # a step taken before the rig settled
+    readings[9] += 5
+
+    least_squares = cal.calculate_linear_regressions(pressures, readings)
+    huber = robust.calculate_huber_regressions(pressures, readings)
+
+    assert np.all(np.abs(least_squares.slopes - slopes) > 5e-3)
+    np.testing.assert_allclose(huber.slopes, slopes, atol=1e-3)
+    np.testing.assert_allclose(huber.intercepts, 1, atol=0.02)
+    assert np.flatnonzero(huber.outlier_steps[:, 0]).tolist() == [9]
+    assert np.flatnonzero(huber.outlier_steps[:, 1]).tolist() == [9]
+
+
+def test_huber_of_clean_steps_is_least_squares():
+    pressures = np.linspace(0, 100, 11)
+    readings = 1 + 2 * pressures[:, np.newaxis]
+
+    huber = robust.fit_steps(pressures, readings, robust.HUBER)
+
+    np.testing.assert_allclose(huber.slopes, [2])
+    np.testing.assert_allclose(huber.intercepts, [1], atol=1e-9)
+    assert not huber.outlier_steps.any()
@@ -0,0 +1,135 @@
+import json, os
+
+import numpy as np
+import pytest
+
+from daemon import client
+from serial_reader import serial_reader
+from session import session
+
+READERS = [
+    {"id": "High-Voltage", "name": "High Voltage", "num_sensors": 3, "port": "hv"},
+    {"id": "Low-Voltage", "name": "Low Voltage", "num_sensors": 2, "port": "lv"},
+]
+
+
+def write_steps(writer: session.SessionWriter, reader: dict, pressures: list[float]):
+    for pressure in pressures:
+        samples = np.full((4, reader["num_sensors"]), pressure)
+        writer.write_step(
+            reader["id"],
+            pressure,
+            np.arange(4, dtype=np.float64),
+            samples,
+            samples.mean(axis=0),
+            samples.std(axis=0),
+        )
+
+
+def make_reader(reader: dict) -> serial_reader.SerialReader:
+    return serial_reader.SerialReader(
+        reader["port"],
+        115200,
+        reader["num_sensors"],
+        4,
+        reader["name"],
+        port=client.RemotePort(reader["port"], 115200),
+    )
+
+
+@pytest.fixture
+def session_path(tmp_path):
+    """a session in which the first reader finished two steps and the second one"""
+    path = str(tmp_path / "session")
+    writer = session.SessionWriter(path, READERS, {"baud_rate": 115200})
+    write_steps(writer, READERS[0], [10.0, 20.0])
+    write_steps(writer, READERS[1], [10.0])
+    writer.close()
+    return path
+
+
+def append(path: str, data: bytes) -> None:
+    with open(path, "ab") as appended:
+        appended.write(data)
+
+
+def test_partial_writes_are_cut_off(session_path):
+    hv_samples = os.path.join(session_path, "High-Voltage.samples")
+    hv_times = os.path.join(session_path, "High-Voltage.times")
+    lv_samples = os.path.join(session_path, "Low-Voltage.samples")
+    steps = os.path.join(session_path, session.STEPS)
+    sizes = {path: os.path.getsize(path) for path in (hv_samples, hv_times, steps)}
+
+    # a crash part way through the next step: some of its samples, a partial timestamp and half its record
+    append(hv_samples, np.ones((3, 3)).tobytes() + b"\x00\x01")
+    append(hv_times, b"\x00" * 5)
+    append(lv_samples, np.ones((1, 2)).tobytes())
+    append(steps, b'{"reader": "High-Voltage", "step": 2, "pres')
+
+    writer = session.SessionWriter(session_path, READERS)
+    writer.close()
+
+    for path, size in sizes.items():
+        assert os.path.getsize(path) == size
+    # only the one step of the second reader was ever committed
+    assert os.path.getsize(lv_samples) == 4 * 2 * session.FLOAT_SIZE
+    with open(steps, "rb") as steps_file:
+        assert steps_file.read().endswith(b"\n")
+
+
+def test_samples_of_a_step_without_a_record_are_discarded(session_path):
+    hv_samples = os.path.join(session_path, "High-Voltage.samples")
+    size = os.path.getsize(hv_samples)
+    # the samples of a third step made it to disk, its record didn't
+    append(hv_samples, np.ones((4, 3)).tobytes())
+
+    writer = session.SessionWriter(session_path, READERS)
+    writer.close()
+
+    assert os.path.getsize(hv_samples) == size
+
+
+def test_resume_picks_up_after_the_steps_every_reader_finished(session_path):
+    append(os.path.join(session_path, session.STEPS), b'{"reader": "Low')
+    readers = [make_reader(reader) for reader in READERS]
+
+    writer = session.SessionWriter(session_path, READERS)
+    assert writer.get_num_completed_steps() == 1
+    assert writer.restore(readers) == 1
+    for reader in readers:
+        assert reader.store.get_pressures().tolist() == [10.0]
+        assert reader.store.get_avgs()[0].tolist() == [10.0] * reader.get_num_pts()
+
+    # the step only the first reader finished is taken again, and replaces the earlier record
+    write_steps(writer, READERS[0], [25.0])
+    write_steps(writer, READERS[1], [25.0])
+    writer.close()
+
+    recorded = session.Session(session_path)
+    for reader in READERS:
+        assert recorded.get_pressures(reader["id"]).tolist() == [10.0, 25.0]
+        timestamps, samples = recorded.get_step_samples(reader["id"], 1)
+        assert samples.tolist() == [[25.0] * reader["num_sensors"]] * 4
+        assert timestamps.tolist() == [0.0, 1.0, 2.0, 3.0]
+
+
+def test_unreadable_records_end_the_session(session_path):
+    steps = os.path.join(session_path, session.STEPS)
+    with open(steps, "rb") as steps_file:
+        lines = steps_file.readlines()
+    # a record that was only partly flushed before the ones after it
+    lines[1] = lines[1][:10] + b"\n"
+    with open(steps, "wb") as steps_file:
+        steps_file.writelines(lines)
+
+    writer = session.SessionWriter(session_path, READERS)
+    assert writer.get_completed_steps("High-Voltage") == [json.loads(lines[0])]
+    assert writer.get_num_completed_steps() == 0
+    writer.close()
+
+
+def test_readers_that_do_not_match_the_session_are_refused(session_path):
+    with pytest.raises(ValueError):
+        session.SessionWriter(
+            session_path, [{**READERS[0], "num_sensors": 4}, READERS[1]]
+        )
@@ -0,0 +1,43 @@
+import numpy as np
+
+from cal import models
+from serial_reader import verification
+
+PRESSURES = np.linspace(0, 100, 11)
+
+
+def make_verifier(window: int = verification.ERROR_WINDOW) -> verification.Verifier:
+    # a linear PT and a quadratic one
+    readings = np.column_stack(
+        (1 + 2 * PRESSURES, 1 + 0.5 * PRESSURES + 2e-3 * PRESSURES**2)
+    )
+    return verification.Verifier(models.fit_models(PRESSURES, readings), window)
+
+
+def test_readings_are_converted_with_each_pts_curve():
+    verifier = make_verifier()
+    assert verifier.fit.get_model_names() == [models.LINEAR, models.QUADRATIC]
+
+    # both PTs at 40
+    verifier.add_rows(np.array([[81.0, 24.2]]))
+
+    np.testing.assert_allclose(verifier.pressures, [40, 40])
+
+
+def test_errors_are_against_the_reference_over_the_window():
+    verifier = make_verifier(window=4)
+    verifier.add_rows(np.array([[81.0, 24.2]]))
+    means, _, _ = verifier.get_errors()
+    # nothing to compare against yet
+    assert np.isnan(means).all()
+
+    verifier.set_reference(40.0)
+    # readings that fall out of the window of 4, then at 39 and 41 twice over
+    verifier.add_rows(
+        np.array([[200.0, 200.0]] * 3 + [[79.0, 23.542], [83.0, 24.862]] * 2)
+    )
+
+    means, stds, max_errors = verifier.get_errors()
+    np.testing.assert_allclose(means, [0, 0], atol=1e-9)
+    np.testing.assert_allclose(stds, [1, 1], atol=1e-9)
+    np.testing.assert_allclose(max_errors, [1, 1], atol=1e-9)